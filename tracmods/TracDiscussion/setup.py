@@ -10,11 +10,13 @@ setup(
   package_data = {'tracdiscussion' : ['templates/*.cs', 'htdocs/css/*.css']},
   entry_points = {'trac.plugins': ['TracDiscussion.core = tracdiscussion.core',
     'TracDiscussion.init = tracdiscussion.init',
+    'TracDiscussion.cache = tracdiscussion.cache',
     'TracDiscussion.wiki = tracdiscussion.wiki',
     'TracDiscussion.timeline = tracdiscussion.timeline',
     'TracDiscussion.admin = tracdiscussion.admin',
     'TracDiscussion.search = tracdiscussion.search',
-    'TracDiscussion.notification = tracdiscussion.notification']},
+    'TracDiscussion.notification = tracdiscussion.notification',
+    'TracDiscussion.console = tracdiscussion.console']},
   install_requires = ['TracWebAdmin'],
   keywords = 'trac discussion',
   author = 'Alec Thomas, Radek Bartoň',
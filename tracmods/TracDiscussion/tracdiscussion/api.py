@@ -1,19 +1,30 @@
 # -*- coding: utf8 -*-
 
 from tracdiscussion.notification import *
+from tracdiscussion.search import get_words
+from tracdiscussion.cache import DiscussionCache
 from trac.core import *
 from trac.web.chrome import add_stylesheet, add_link
-from trac.wiki import wiki_to_html, wiki_to_oneliner
+from trac.wiki import wiki_to_html, wiki_to_oneliner, \
+  wiki_to_cacheable_html, get_dependencies_hash
+from trac.wiki.api import WikiSystem
 from trac.perm import PermissionError
 from trac.util import format_datetime, pretty_timedelta
-from trac.util.text import to_unicode
-import time
+from trac.util.html import Markup
+import md5, time
 
 class DiscussionApi(object):
     def __init__(self, component, req):
         self.env = component.env
         self.log = component.log
-        self.topics_per_page = component.topics_per_page
+        self.topics_per_page = self.env.config.getint('discussion',
+          'topics_per_page', 20)
+        self.messages_per_page = self.env.config.getint('discussion',
+          'messages_per_page', 50)
+        self.read_state_days = self.env.config.getint('discussion',
+          'read_state_days', 90)
+        self.cache_bodies = self.env.config.getbool('discussion',
+          'cache_bodies', True)
 
     # Main request processing function
 
@@ -57,17 +68,17 @@ class DiscussionApi(object):
             forum['time'] = format_datetime(forum['time'])
             req.hdf['discussion.forum'] = forum
             title = 'POPFile ' + forum['name'] + ' Forum'
+        db = self.env.get_db_cnx()
         if topic:
             topic['subject'] = wiki_to_oneliner(topic['subject'], self.env)
-            topic['author'] = wiki_to_oneliner(topic['author'], self.env)
-            topic['body'] = wiki_to_html(topic['body'], self.env, req, None, False, True)
+            self.render_items(req, db.cursor(), 'topic', [topic])
             topic['time'] = format_datetime(topic['time'])
             req.hdf['discussion.topic'] = topic
         if message:
-            message['author'] = wiki_to_oneliner(message['author'], self.env)
-            message['body'] = wiki_to_html(message['body'], self.env, req, None, False, True)
+            self.render_items(req, db.cursor(), 'message', [message])
             message['time'] = format_datetime(message['time'])
             req.hdf['discussion.message'] = message
+        db.commit()
         req.hdf['discussion.mode'] = modes[-1]
         req.hdf['discussion.time'] = format_datetime(time.time())
         req.hdf['title'] = title
@@ -383,7 +394,12 @@ class DiscussionApi(object):
                 req.hdf['discussion.order'] = order
                 req.hdf['discussion.asc'] = asc
                 req.hdf['discussion.groups'] = self.get_groups(req, cursor)
-                req.hdf['discussion.forums'] = self.get_forums(req, cursor, asc, order)
+                forums = self.get_forums(req, cursor, asc, order)
+                unread = self.get_unread_counts(cursor, req.session.sid,
+                  [item['id'] for item in forums])
+                for item in forums:
+                    item['unread'] = unread.get(item['id'], 0)
+                req.hdf['discussion.forums'] = forums
 
             elif mode == 'admin-forum-list':
                 req.perm.assert_permission('DISCUSSION_ADMIN')
@@ -567,8 +583,9 @@ class DiscussionApi(object):
                 self.add_topic(cursor, forum['id'], new_subject, new_time,
                   new_author, new_body)
 
-                # Get new popic and notify about creation.
+                # Get new popic, render it and notify about creation.
                 new_topic = self.get_topic_by_time(cursor, new_time)
+                self.render_items(req, cursor, 'topic', [new_topic.copy()])
                 to = self.get_topic_to_recipients(cursor, new_topic['id'])
                 cc = self.get_topic_cc_recipients(cursor, new_topic['id'])
                 notifier = DiscussionNotifyEmail(self.env)
@@ -605,6 +622,7 @@ class DiscussionApi(object):
                 topic['body'] = new_body
                 self.edit_topic(cursor, topic['id'], topic['forum'],
                   new_subject, new_body)
+                self.render_items(req, cursor, 'topic', [topic.copy()])
 
                 # Redirect request to prevent re-submit.
                 db.commit()
@@ -681,8 +699,10 @@ class DiscussionApi(object):
                     self.add_message(cursor, forum['id'], topic['id'], '-1',
                       new_time, new_author, new_body)
 
-                # Get inserted message and notify about its creation.
+                # Get inserted message, render it and notify about its
+                # creation.
                 new_message = self.get_message_by_time(cursor, new_time)
+                self.render_items(req, cursor, 'message', [new_message.copy()])
                 to = self.get_topic_to_recipients(cursor, topic['id'])
                 cc = self.get_topic_cc_recipients(cursor, topic['id'])
                 notifier = DiscussionNotifyEmail(self.env)
@@ -716,6 +736,7 @@ class DiscussionApi(object):
                 message['body'] = new_body
                 self.edit_message(cursor, message['id'], message['forum'],
                   message['topic'], message['replyto'], new_body)
+                self.render_items(req, cursor, 'message', [message.copy()])
 
                 # Redirect request to prevent re-submit.
                 if req.args.get('component') != 'wiki':
@@ -754,16 +775,11 @@ class DiscussionApi(object):
         new_subject = req.args.get('subject')
         new_body = req.args.get('body')
 
-        # Get time when topic was visited from session.
-        visited = eval(req.session.get('visited-topics') or '{}')
-        if visited.has_key(topic['id']):
-            visit_time = int(visited[topic['id']])
-        else:
-            visit_time = 0
-
-        # Update this topic visit time and save to session.
-        visited[topic['id']] = int(time.time())
-        req.session['visited-topics'] = to_unicode(visited)
+        # Get time when topic was visited and update it.
+        visit_time = self.get_read_times(cursor, req.session.sid,
+          [topic['id']])[topic['id']]
+        self.set_read_times(cursor, req.session.sid, {topic['id'] :
+          int(time.time())})
 
         # Mark new topic.
         if int(topic['time']) > visit_time:
@@ -779,18 +795,49 @@ class DiscussionApi(object):
         if new_body:
             req.hdf['discussion.body'] = wiki_to_html(new_body, self.env, req, None, False, True)
 
-        # Prepare display of messages
+        # Get the page of messages to display, either the requested one or the
+        # one of the first unread message.
         display = req.session.get('message-list-display')
+        limit = self.messages_per_page
+        message_count = self.get_message_count(req, cursor, topic['id'])
+        first_unread = self.get_first_unread(req, cursor, topic['id'],
+          visit_time, display)
+        if req.args.has_key('start'):
+            start = int(req.args.get('start') or 0)
+        elif req.args.get('unread') and first_unread:
+            start = first_unread[1]
+        else:
+            start = 0
+        start = max(0, min(start, message_count - 1))
+        start -= start % limit
+        if first_unread:
+            req.hdf['discussion.first_unread'] = {'id' : first_unread[0],
+              'start' : first_unread[1] - first_unread[1] % limit}
+
+        # Prepare display of messages. The page of messages is cached with the
+        # generation of the forum, the bodies and the messages new to the user
+        # are done after the cache lookup.
         req.hdf['discussion.display'] = display
-        if display == 'flat-asc':
-            req.hdf['discussion.messages'] = self.get_flat_messages(req, cursor,
-              topic['id'], visit_time)
-        elif display == 'flat-desc':
-            req.hdf['discussion.messages'] = self.get_flat_messages(req, cursor,
-              topic['id'], visit_time, 'ORDER BY time DESC')
+        order_by = self._get_message_order(display)
+        messages = self._get_cached_list(req, cursor, topic['forum'],
+          ('messages', topic['id'], order_by, start, limit),
+          self._get_message_rows, cursor, topic['id'], order_by, start, limit)
+        self._prepare_messages(req, cursor, messages, visit_time)
+        if display not in ('flat-asc', 'flat-desc'):
+            messages = self._get_message_tree(messages)
+        req.hdf['discussion.messages'] = messages
+
+        # Create the paging links
+        req.hdf['discussion.message_count'] = message_count
+        req.hdf['discussion.start'] = start
+        if start + limit < message_count:
+            req.hdf['discussion.next_page'] = start + limit
         else:
-            req.hdf['discussion.messages'] = self.get_messages(req, cursor,
-             topic['id'], visit_time)
+            req.hdf['discussion.next_page'] = ''
+        if start > 0:
+            req.hdf['discussion.prev_page'] = max(0, start - limit)
+        else:
+            req.hdf['discussion.prev_page'] = ''
 
     # Get one item functions
 
@@ -839,11 +886,12 @@ class DiscussionApi(object):
         return None
 
     def get_topic_by_subject(self, cursor, subject):
-        columns = ('id', 'forum', 'subject', 'time', 'author', 'body')
-        sql = "SELECT id, forum, subject, time, author, body FROM topic WHERE" \
-          " subject = '%s'" % (subject)
-        self.log.debug(sql)
-        cursor.execute(sql)
+        columns = ('id', 'forum', 'subject', 'time', 'author', 'body',
+          'lastreply')
+        sql = "SELECT id, forum, subject, time, author, body, lastreply FROM" \
+          " topic WHERE subject = %s ORDER BY id LIMIT 1"
+        self.log.debug(sql % (subject,))
+        cursor.execute(sql, (subject,))
         for row in cursor:
             row = dict(zip(columns, row))
             return row
@@ -894,14 +942,28 @@ class DiscussionApi(object):
         sql = "UPDATE forum SET forum_group = %s WHERE id = %s"
         self.log.debug(sql % (group, forum))
         cursor.execute(sql, (group, forum))
+        self.bump_generation(cursor, forum)
 
     def set_forum(self, cursor, topic, forum):
+        old_forum = self.get_topic(cursor, topic)['forum']
         sql = "UPDATE topic SET forum = %s WHERE id = %s"
         self.log.debug(sql % (forum, topic))
         cursor.execute(sql, (forum, topic))
         sql = "UPDATE message SET forum = %s WHERE topic = %s"
         self.log.debug(sql % (forum, topic))
         cursor.execute(sql, (forum, topic))
+        sql = "UPDATE discussion_search SET forum = %s WHERE (type = 'topic'" \
+          " AND id = %s) OR (type = 'message' AND id IN (SELECT id FROM" \
+          " message WHERE topic = %s))"
+        self.log.debug(sql % (forum, topic, topic))
+        cursor.execute(sql, (forum, topic, topic))
+        sql = "UPDATE discussion_event SET forum = %s, forum_name = (SELECT" \
+          " name FROM forum WHERE id = %s) WHERE topic = %s"
+        self.log.debug(sql % (forum, forum, topic))
+        cursor.execute(sql, (forum, forum, topic))
+        self.update_forum_counters(cursor, old_forum)
+        self.update_forum_counters(cursor, forum)
+        self.bump_generation(cursor, [old_forum, forum])
 
     # Edit all functons
 
@@ -909,6 +971,7 @@ class DiscussionApi(object):
         sql = "UPDATE forum_group SET name = %s, description = %s WHERE id = %s"
         self.log.debug(sql % (name, description, group))
         cursor.execute(sql, (name, description, group))
+        self.bump_generation(cursor, 0)
 
     def edit_forum(self, cursor, forum, name, subject, description, moderators,
       group):
@@ -921,22 +984,49 @@ class DiscussionApi(object):
           group, forum))
         cursor.execute(sql, (name, subject, description, moderators, group,
           forum))
+        sql = "UPDATE discussion_event SET forum_name = %s WHERE forum = %s"
+        self.log.debug(sql % (name, forum))
+        cursor.execute(sql, (name, forum))
+        sql = "UPDATE discussion_event SET subject = %s WHERE type = 'forum'" \
+          " AND forum = %s"
+        self.log.debug(sql % (subject, forum))
+        cursor.execute(sql, (subject, forum))
+        self.bump_generation(cursor, forum)
 
     def edit_topic(self, cursor, topic, forum, subject, body):
+        old_forum = self.get_topic(cursor, topic)['forum']
         sql = "UPDATE topic SET forum = %s, subject = %s, body = %s WHERE id" \
           " = %s"
         self.log.debug(sql % (forum, subject, body, topic))
         cursor.execute(sql, (forum, subject, body, topic))
+        self.index_item(cursor, 'topic', topic, forum, '%s %s' % (subject,
+          body))
+        sql = "UPDATE discussion_event SET forum = %s, forum_name = (SELECT" \
+          " name FROM forum WHERE id = %s), subject = %s WHERE topic = %s"
+        self.log.debug(sql % (forum, forum, subject, topic))
+        cursor.execute(sql, (forum, forum, subject, topic))
+        self.bump_generation(cursor, [old_forum, forum])
 
     def edit_message(self, cursor, message, forum, topic, replyto, body):
         sql = "UPDATE message SET forum = %s, topic = %s, replyto = %s, body" \
           " = %s WHERE id = %s"
         self.log.debug(sql % (forum, topic, replyto, body, message))
         cursor.execute(sql, (forum, topic, replyto, body, message))
+        self.index_item(cursor, 'message', message, forum, body)
+        sql = "UPDATE discussion_event SET forum = %s, topic = %s, forum_name" \
+          " = (SELECT name FROM forum WHERE id = %s), subject = (SELECT" \
+          " subject FROM topic WHERE id = %s) WHERE message = %s"
+        self.log.debug(sql % (forum, topic, forum, topic, message))
+        cursor.execute(sql, (forum, topic, forum, topic, message))
+        self.bump_generation(cursor, forum)
 
     # Get list functions
 
     def get_groups(self, req, cursor, order_by = 'id', desc = False):
+        return self._get_cached_list(req, cursor, 0, ('groups', order_by,
+          bool(desc)), self._get_groups, cursor, order_by, desc)
+
+    def _get_groups(self, cursor, order_by, desc):
         # Get count of forums without group
         sql = "SELECT COUNT(f.id) FROM forum f WHERE f.forum_group = 0"
         self.log.debug(sql)
@@ -966,19 +1056,31 @@ class DiscussionApi(object):
         return groups
 
     def get_forums(self, req, cursor, asc=0, order_by = 'subject'):
-        if not order_by in ('topics', 'replies', 'lasttopic', 'lastreply'):
-            order_by = 'f.' + order_by
+        forums = self._get_cached_list(req, cursor, 0, ('forums', order_by,
+          int(asc)), self._get_forums, cursor, asc, order_by)
+
+        # Relative times are formatted after the cache lookup.
+        for row in forums:
+            if row['lastreply']:
+                row['lastreply'] = pretty_timedelta(float(row['lastreply']))
+            else:
+                row['lastreply'] = 'No replies'
+            if row['lasttopic']:
+                self.log.debug('lasttopic: %s' % row['lasttopic'])
+                row['lasttopic'] = pretty_timedelta(float(row['lasttopic']))
+            else:
+                row['lasttopic'] = 'No topics'
+            row['time'] = format_datetime(row['time'])
+        return forums
+
+    def _get_forums(self, cursor, asc, order_by):
+        order_by = 'f.' + order_by
         columns = ('id', 'name', 'author', 'time', 'moderators', 'group',
           'subject', 'description', 'topics', 'replies', 'lasttopic',
-          'lastreply')
+          'lastreply', 'lastposter')
         sql = "SELECT f.id, f.name, f.author, f.time, f.moderators, " \
-          "f.forum_group, f.subject, f.description, ta.topics, ta.replies, " \
-          "ta.lasttopic, ta.lastreply FROM forum f LEFT JOIN (SELECT " \
-          "COUNT(t.id) AS topics, MAX(t.time) AS lasttopic, SUM(ma.replies) " \
-          "AS replies, MAX(ma.lastreply) AS lastreply, t.forum AS forum FROM " \
-          " topic t LEFT JOIN (SELECT COUNT(m.id) AS replies, MAX(m.time) AS " \
-          "lastreply, m.topic AS topic FROM message m GROUP BY m.topic) ma ON " \
-          "t.id = ma.topic GROUP BY forum) ta ON f.id = ta.forum ORDER BY " + \
+          "f.forum_group, f.subject, f.description, f.topics, f.replies, " \
+          "f.lasttopic, f.lastreply, f.lastposter FROM forum f ORDER BY " + \
           order_by + (" DESC", " ASC")[int(asc)]
         self.log.debug(sql)
         cursor.execute(sql)
@@ -987,15 +1089,6 @@ class DiscussionApi(object):
             row = dict(zip(columns, row))
             row['moderators'] = wiki_to_oneliner(row['moderators'], self.env)
             row['description'] = wiki_to_oneliner(row['description'], self.env)
-            if row['lastreply']:
-                row['lastreply'] = pretty_timedelta(float(row['lastreply']))
-            else:
-                row['lastreply'] = 'No replies'
-            if row['lasttopic']:
-                self.log.debug('lasttopic: %s' % row['lasttopic'])
-                row['lasttopic'] = pretty_timedelta(float(row['lasttopic']))
-            else:
-                row['lasttopic'] = 'No topics'
             if not row['topics']:
                 row['topics'] = 0
             if not row['replies']:
@@ -1003,7 +1096,6 @@ class DiscussionApi(object):
             else:
                 # SUM on PosgreSQL returns float number.
                 row['replies'] = int(row['replies'])
-            row['time'] = format_datetime(row['time'])
             forums.append(row)
         return forums
 
@@ -1018,15 +1110,39 @@ class DiscussionApi(object):
         return count
 
     def get_topics(self, req, cursor, forum_id, start_at, order_by = 'lastreply', asc = 0):
-        if not order_by in ('replies', 'lastreply',):
-            order_by = 't.' + order_by
+        topics = self._get_cached_list(req, cursor, forum_id, ('topics',
+          forum_id, start_at, self.topics_per_page, order_by, int(asc)),
+          self._get_topics, req, cursor, forum_id, start_at, order_by, asc)
+
+        # Bodies are rendered after the cache lookup, so that their links are
+        # checked against the cached renderings on each request.
+        self.render_items(req, cursor, 'topic', topics)
+
+        # Relative times and the topics not read by the user are specific to
+        # each request.
+        read_times = {}
+        if req:
+            read_times = self.get_read_times(cursor, req.session.sid,
+              [row['id'] for row in topics])
+        for row in topics:
+            if row['id'] in read_times:
+                row['new'] = int(row['lastreply'] or row['time']) > \
+                  read_times[row['id']]
+            if row['lastreply']:
+                row['lastreply'] = pretty_timedelta(float(row['lastreply']))
+            else:
+                row['lastreply'] = 'No replies'
+            row['time'] = format_datetime(row['time'])
+        return topics
+
+    def _get_topics(self, req, cursor, forum_id, start_at, order_by, asc):
+        order_by = 't.' + order_by
         columns = ('id', 'forum', 'time', 'subject', 'body', 'author',
-          'replies', 'lastreply')
+          'replies', 'lastreply', 'lastposter')
         sql = "SELECT t.id, t.forum, t.time, t.subject, t.body, t.author," \
-          " m.replies, t.lastreply FROM topic t LEFT JOIN (SELECT COUNT(id)" \
-          " AS replies, topic FROM message GROUP BY" \
-          " topic) m ON t.id = m.topic WHERE t.forum = %s ORDER BY " \
-          + order_by + (" DESC", " ASC")[int(asc)] + " LIMIT %s,%s"
+          " t.replies, t.lastreply, t.lastposter FROM topic t WHERE" \
+          " t.forum = %s ORDER BY " + order_by + (" DESC", " ASC")[int(asc)] \
+          + " LIMIT %s,%s"
 
         self.log.debug(sql % (forum_id, start_at, self.topics_per_page))
         cursor.execute(sql, (forum_id, start_at, self.topics_per_page) )
@@ -1034,66 +1150,117 @@ class DiscussionApi(object):
         topics = []
         for row in cursor:
             row = dict(zip(columns, row))
-            row['author'] = wiki_to_oneliner(row['author'], self.env)
-            row['body'] = wiki_to_html(row['body'], self.env, req, None, False, True)
-            if row['lastreply']:
-                row['lastreply'] = pretty_timedelta(float(row['lastreply']))
-            else:
-                row['lastreply'] = 'No replies'
             if not row['replies']:
                 row['replies'] = 0
-            row['time'] = format_datetime(row['time'])
             topics.append(row)
         return topics
 
-    def get_messages(self, req, cursor, topic_id, time, order_by = 'time', desc = False):
-        order_by = 'm.' + order_by
-        columns = ('id', 'replyto', 'time', 'author', 'body')
-        sql = "SELECT m.id, m.replyto, m.time, m.author, m.body FROM message m WHERE" \
-          " m.topic = %s ORDER BY " + order_by + (" ASC", " DESC")[bool(desc)]
+    def _get_cached_list(self, req, cursor, forum, key, function, *args):
+        # Lists are cached with the generation of the forum they depend on,
+        # or of the group and forum lists for forum 0. The rendering signature
+        # in the key accounts for wiki syntax changes and the base URL.
+        if not req:
+            return function(*args)
+        key = key + (WikiSystem(self.env).get_render_signature(req),)
+        generation = self.get_generation(cursor, forum)
+        cache = DiscussionCache(self.env)
+        rows = cache.get(key, generation)
+        if rows is None:
+            rows = function(*args)
+            cache.set(key, generation, rows)
+        else:
+            self.log.debug('Using cached list %s' % (key,))
+        return [row.copy() for row in rows]
+
+    def get_message_count(self, req, cursor, topic_id):
+        sql = "SELECT COUNT(id) FROM message WHERE topic = %s"
         self.log.debug(sql % (topic_id,))
         cursor.execute(sql, (topic_id,))
-        messagemap = {}
-        messages = []
-        for row in cursor:
-            row = dict(zip(columns, row))
-            row['author'] = wiki_to_oneliner(row['author'], self.env)
-            row['body'] = wiki_to_html(row['body'], self.env, req, None, False, True)
-            if int(row['time']) > time:
-                row['new'] = True
-            row['time'] = format_datetime(row['time'])
-            messagemap[row['id']] = row
+        return int(cursor.fetchone()[0])
+
+    def get_first_unread(self, req, cursor, topic_id, time, display = None):
+        """Return the id of the first message of the topic posted after the
+        given time in the given display order, and the number of messages
+        before it, or `None` if there is no such message."""
+        if display == 'flat-desc':
+            # Newest messages come first.
+            sql = "SELECT id FROM message WHERE topic = %s AND time > %s" \
+              " ORDER BY time DESC LIMIT 1"
+            self.log.debug(sql % (topic_id, time))
+            cursor.execute(sql, (topic_id, time))
+            row = cursor.fetchone()
+            return row and (row[0], 0) or None
+        key = ('path', 'time')[display == 'flat-asc']
+        sql = "SELECT id, " + key + " FROM message WHERE topic = %s AND" \
+          " time > %s ORDER BY " + key + " LIMIT 1"
+        self.log.debug(sql % (topic_id, time))
+        cursor.execute(sql, (topic_id, time))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        sql = "SELECT COUNT(id) FROM message WHERE topic = %s AND " + key + \
+          " < %s"
+        self.log.debug(sql % (topic_id, row[1]))
+        cursor.execute(sql, (topic_id, row[1]))
+        return row[0], int(cursor.fetchone()[0])
+
+    def get_messages(self, req, cursor, topic_id, time, start = 0,
+      limit = None):
+        # Messages are ordered by their thread order key, so that replies
+        # follow their parent and a page of the tree is a range of keys.
+        rows = self._get_message_rows(cursor, topic_id, 'ORDER BY m.path',
+          start, limit)
+        self._prepare_messages(req, cursor, rows, time)
+        return self._get_message_tree(rows)
 
-            # Add top-level messages to the main list, in order of time
-            if row['replyto'] == -1:
-                messages.append(row)
+    def get_flat_messages(self, req, cursor, topic_id, time, order_by =
+      'ORDER BY time ASC', start = 0, limit = None):
+        messages = self._get_message_rows(cursor, topic_id, order_by, start,
+          limit)
+        self._prepare_messages(req, cursor, messages, time)
+        return messages
 
-        # Second pass, add replies
-        for message in messagemap.values():
-            if message['replyto'] != -1:
-                parent = messagemap[message['replyto']]
-                if 'replies' in parent:
-                    parent['replies'].append(message)
-                else:
-                    parent['replies'] = [message]
-        return messages;
+    def _get_message_order(self, display):
+        if display == 'flat-asc':
+            return 'ORDER BY time ASC'
+        elif display == 'flat-desc':
+            return 'ORDER BY time DESC'
+        return 'ORDER BY m.path'
 
-    def get_flat_messages(self, req, cursor, topic_id, time, order_by =
-      'ORDER BY time ASC'):
+    def _get_message_rows(self, cursor, topic_id, order_by, start, limit):
         columns = ('id', 'replyto', 'time', 'author', 'body')
         sql = "SELECT m.id, m.replyto, m.time, m.author, m.body FROM message m" \
           " WHERE m.topic = %s " + order_by
-        self.log.debug(sql % (topic_id,))
-        cursor.execute(sql, (topic_id,))
-        messages = []
-        for row in cursor:
-            row = dict(zip(columns, row))
-            row['author'] = wiki_to_oneliner(row['author'], self.env)
-            row['body'] = wiki_to_html(row['body'], self.env, req, None, False, True)
+        args = [topic_id]
+        if limit:
+            sql += " LIMIT %s OFFSET %s"
+            args += [limit, start]
+        self.log.debug(sql % tuple(args))
+        cursor.execute(sql, args)
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def _prepare_messages(self, req, cursor, messages, time):
+        self.render_items(req, cursor, 'message', messages)
+        for row in messages:
             if int(row['time']) > time:
                 row['new'] = True
             row['time'] = format_datetime(row['time'])
-            messages.append(row)
+
+    def _get_message_tree(self, rows):
+        messagemap = {}
+        messages = []
+        for row in rows:
+            messagemap[row['id']] = row
+
+            # Replies to messages of previous pages start at the top level.
+            if messagemap.has_key(row['replyto']):
+                parent = messagemap[row['replyto']]
+                if 'replies' in parent:
+                    parent['replies'].append(row)
+                else:
+                    parent['replies'] = [row]
+            else:
+                messages.append(row)
         return messages
 
     def get_users(self):
@@ -1108,32 +1275,69 @@ class DiscussionApi(object):
         sql = "INSERT INTO forum_group (name, description) VALUES (%s, %s)"
         self.log.debug(sql % (name, description))
         cursor.execute(sql, (name, description))
+        self.bump_generation(cursor, 0)
 
     def add_forum(self, cursor, name, author, subject, description, moderators,
       group):
         moderators = ' '.join(moderators)
         sql = "INSERT INTO forum (name, author, time, moderators, subject," \
-          " description, forum_group) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+          " description, forum_group, topics, replies) VALUES (%s, %s, %s," \
+          " %s, %s, %s, %s, 0, 0)"
         self.log.debug(sql % (name, author, int(time.time()), moderators,
           subject, description, group))
         cursor.execute(sql, (name, author, int(time.time()), moderators,
           subject, description, group))
+        id = self.env.get_db_cnx().get_last_id(cursor, 'forum')
+        self.log_event(cursor, 'forum', int(time.time()), author, id, None,
+          None, name, subject)
+        self.bump_generation(cursor, id)
 
     def add_topic(self, cursor, forum, subject, time, author, body):
-        sql = "INSERT INTO topic (forum, subject, time, author, body, lastreply) VALUES" \
-          " (%s, %s, %s, %s, %s, %s)"
-        self.log.debug(sql % (forum, subject, time, author, body, time))
-        cursor.execute(sql, (forum, subject, time, author, body, time))
+        sql = "INSERT INTO topic (forum, subject, time, author, body, lastreply," \
+          " replies, lastposter) VALUES (%s, %s, %s, %s, %s, %s, 0, %s)"
+        self.log.debug(sql % (forum, subject, time, author, body, time, author))
+        cursor.execute(sql, (forum, subject, time, author, body, time, author))
+        id = self.env.get_db_cnx().get_last_id(cursor, 'topic')
+        self.index_item(cursor, 'topic', id, forum, '%s %s' % (subject, body))
+        self.log_event(cursor, 'topic', time, author, forum, id, None)
+
+        sql = "UPDATE forum SET topics = topics + 1, lasttopic = %s," \
+          " lastposter = %s WHERE id = %s"
+        self.log.debug(sql % (time, author, forum))
+        cursor.execute(sql, (time, author, forum))
+        self.bump_generation(cursor, forum)
 
     def add_message(self, cursor, forum, topic, replyto, time, author, body):
         sql = "INSERT INTO message (forum, topic, replyto, time, author," \
           " body) VALUES (%s, %s, %s, %s, %s, %s)"
         self.log.debug(sql % (forum, topic, replyto, time, author, body))
         cursor.execute(sql, (forum, topic, replyto, time, author, body))
-
-        sql = "UPDATE topic SET lastreply = %s WHERE id = %s"
-        self.log.debug( sql % (time, topic))
-        cursor.execute( sql, (time, topic) )
+        id = self.env.get_db_cnx().get_last_id(cursor, 'message')
+
+        # Set the thread order key of the message.
+        path = '%010d' % (int(id),)
+        if int(replyto) != -1:
+            sql = "SELECT path FROM message WHERE id = %s"
+            self.log.debug(sql % (replyto,))
+            cursor.execute(sql, (replyto,))
+            for row in cursor:
+                path = '%s/%s' % (row[0], path)
+        sql = "UPDATE message SET path = %s WHERE id = %s"
+        self.log.debug(sql % (path, id))
+        cursor.execute(sql, (path, id))
+        self.index_item(cursor, 'message', id, forum, body)
+        self.log_event(cursor, 'message', time, author, forum, topic, id)
+
+        sql = "UPDATE topic SET replies = replies + 1, lastreply = %s," \
+          " lastposter = %s WHERE id = %s"
+        self.log.debug(sql % (time, author, topic))
+        cursor.execute(sql, (time, author, topic))
+
+        sql = "UPDATE forum SET replies = replies + 1, lastreply = %s," \
+          " lastposter = %s WHERE id = %s"
+        self.log.debug(sql % (time, author, forum))
+        cursor.execute(sql, (time, author, forum))
+        self.bump_generation(cursor, forum)
 
     # Delete items functions
 
@@ -1144,8 +1348,25 @@ class DiscussionApi(object):
         sql = "UPDATE forum SET forum_group = 0 WHERE forum_group = %s"
         self.log.debug(sql % (group,))
         cursor.execute(sql, (group,))
+        self.bump_generation(cursor, 0)
 
     def delete_forum(self, cursor, forum):
+        sql = "DELETE FROM discussion_cache WHERE (type IN ('message'," \
+          " 'message-rss') AND id IN (SELECT id FROM message WHERE forum =" \
+          " %s)) OR (type IN ('topic', 'topic-rss') AND id IN (SELECT id FROM" \
+          " topic WHERE forum = %s))"
+        self.log.debug(sql % (forum, forum))
+        cursor.execute(sql, (forum, forum))
+        sql = "DELETE FROM discussion_event WHERE forum = %s"
+        self.log.debug(sql % (forum,))
+        cursor.execute(sql, (forum,))
+        sql = "DELETE FROM discussion_read_state WHERE topic IN (SELECT id" \
+          " FROM topic WHERE forum = %s)"
+        self.log.debug(sql % (forum,))
+        cursor.execute(sql, (forum,))
+        sql = "DELETE FROM discussion_search WHERE forum = %s"
+        self.log.debug(sql % (forum,))
+        cursor.execute(sql, (forum,))
         sql = "DELETE FROM message WHERE forum = %s"
         self.log.debug(sql % (forum,))
         cursor.execute(sql, (forum,))
@@ -1155,31 +1376,407 @@ class DiscussionApi(object):
         sql = "DELETE FROM forum WHERE id = %s"
         self.log.debug(sql % (forum,))
         cursor.execute(sql, (forum,))
+        self.bump_generation(cursor, forum)
 
     def delete_topic(self, cursor, topic):
-        sql = "DELETE FROM message WHERE topic = %s"
-        self.log.debug(sql % (topic,))
-        cursor.execute(sql, (topic,))
-        sql = "DELETE FROM topic WHERE id = %s"
-        self.log.debug(sql % (topic,))
-        cursor.execute(sql, (topic,))
+        self.delete_topics(cursor, [topic])
+
+    def delete_topics(self, cursor, topics):
+        """Delete the given topics with all their messages."""
+        topics = list(topics)
+        forums = self._select_ids(cursor, "SELECT DISTINCT forum FROM topic"
+          " WHERE id IN (%s)", topics)
+        self._execute_ids(cursor, "DELETE FROM discussion_cache WHERE type IN"
+          " ('message', 'message-rss') AND id IN (SELECT id FROM message WHERE"
+          " topic IN (%s))", topics)
+        self._execute_ids(cursor, "DELETE FROM discussion_cache WHERE type IN"
+          " ('topic', 'topic-rss') AND id IN (%s)", topics)
+        self._execute_ids(cursor, "DELETE FROM discussion_event WHERE topic IN"
+          " (%s)", topics)
+        self._execute_ids(cursor, "DELETE FROM discussion_read_state WHERE"
+          " topic IN (%s)", topics)
+        self._execute_ids(cursor, "DELETE FROM discussion_search WHERE type ="
+          " 'message' AND id IN (SELECT id FROM message WHERE topic IN (%s))",
+          topics)
+        self._execute_ids(cursor, "DELETE FROM discussion_search WHERE type ="
+          " 'topic' AND id IN (%s)", topics)
+        self._execute_ids(cursor, "DELETE FROM message WHERE topic IN (%s)",
+          topics)
+        self._execute_ids(cursor, "DELETE FROM topic WHERE id IN (%s)", topics)
+        self.update_forum_counters(cursor, forums)
+        self.bump_generation(cursor, forums)
 
     def delete_message(self, cursor, message):
-        # Get message replies
-        sql = "SELECT m.id FROM message m WHERE m.replyto = %s"
-        self.log.debug(sql % (message,))
-        cursor.execute(sql, (message,))
-        replies = []
+        self.delete_messages(cursor, [message])
 
-        # Get all replies first.
+    def delete_messages(self, cursor, messages):
+        """Delete the given messages with all their replies, and return the
+        number of deleted messages."""
+        # Replies are the messages of the same topic whose thread order key
+        # starts with the one of the deleted message.
+        db = self.env.get_db_cnx()
+        sql = "SELECT DISTINCT m.id, m.topic, m.forum FROM message m, message" \
+          " r WHERE r.id IN (%s) AND m.topic = r.topic AND (m.id = r.id OR" \
+          " m.path LIKE " + db.concat('r.path', "'/%%%%'") + ")"
+        rows = dict([(row[0], row) for row in self._select_ids(cursor, sql,
+          list(messages), 3)]).values()
+        ids = [row[0] for row in rows]
+        self._execute_ids(cursor, "DELETE FROM discussion_cache WHERE type IN"
+          " ('message', 'message-rss') AND id IN (%s)", ids)
+        self._execute_ids(cursor, "DELETE FROM discussion_event WHERE message IN"
+          " (%s)", ids)
+        self._execute_ids(cursor, "DELETE FROM discussion_search WHERE type ="
+          " 'message' AND id IN (%s)", ids)
+        self._execute_ids(cursor, "DELETE FROM message WHERE id IN (%s)", ids)
+        self.update_topic_counters(cursor, list(set([row[1] for row in
+          rows])))
+        forums = list(set([row[2] for row in rows]))
+        self.update_forum_counters(cursor, forums)
+        self.bump_generation(cursor, forums)
+        return len(ids)
+
+    def delete_posts(self, cursor, author = None, since = None, until = None,
+      forum = None):
+        """Delete the topics and messages posted by the given author, between
+        the given times or in the given forum, along with the replies to them.
+        Returns the numbers of deleted topics and messages."""
+        conditions, args = [], []
+        if author is not None:
+            conditions.append("author = %s")
+            args.append(author)
+        if since is not None:
+            conditions.append("time >= %s")
+            args.append(since)
+        if until is not None:
+            conditions.append("time < %s")
+            args.append(until)
+        if forum is not None:
+            conditions.append("forum = %s")
+            args.append(forum)
+        if not conditions:
+            raise TracError('At least one criterion is required to delete'
+              ' posts.')
+        where = " WHERE " + " AND ".join(conditions)
+
+        sql = "SELECT id FROM topic" + where
+        self.log.debug(sql % tuple(args))
+        cursor.execute(sql, args)
+        topics = [row[0] for row in cursor]
+        sql = "SELECT id FROM message" + where
+        self.log.debug(sql % tuple(args))
+        cursor.execute(sql, args)
+        messages = [row[0] for row in cursor]
+
+        message_count = self.delete_messages(cursor, messages)
+        self.delete_topics(cursor, topics)
+        return len(topics), message_count
+
+    def _select_ids(self, cursor, sql, ids, columns = 1):
+        # Runs the query for chunks of the ids, substituted to the first %s,
+        # so that literal % signs have to be written %%%%.
+        rows = []
+        for i in xrange(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            chunk_sql = sql % (', '.join(['%s'] * len(chunk)),)
+            self.log.debug(chunk_sql % tuple(chunk))
+            cursor.execute(chunk_sql, chunk)
+            for row in cursor:
+                if columns == 1:
+                    rows.append(row[0])
+                else:
+                    rows.append(tuple(row))
+        return rows
+
+    def _execute_ids(self, cursor, sql, ids):
+        # Same as _select_ids() for statements returning nothing.
+        for i in xrange(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            chunk_sql = sql % (', '.join(['%s'] * len(chunk)),)
+            self.log.debug(chunk_sql % tuple(chunk))
+            cursor.execute(chunk_sql, chunk)
+
+    # Counters functions
+
+    def update_topic_counters(self, cursor, topic = None):
+        """Recompute the number of replies, the time of the last reply and the
+        last poster of the given topic or list of topics, or of all the
+        topics."""
+        sql = "UPDATE topic SET replies = (SELECT COUNT(m.id) FROM message m" \
+          " WHERE m.topic = topic.id), lastreply = COALESCE((SELECT" \
+          " MAX(m.time) FROM message m WHERE m.topic = topic.id), time)," \
+          " lastposter = COALESCE((SELECT m.author FROM message m WHERE" \
+          " m.topic = topic.id ORDER BY m.time DESC LIMIT 1), author)"
+        self._update_counters(cursor, sql, topic)
+
+    def update_forum_counters(self, cursor, forum = None):
+        """Recompute the number of topics and replies, the times of the last
+        topic and reply and the last poster of the given forum or list of
+        forums, or of all the forums, from the counters of their topics."""
+        sql = "UPDATE forum SET topics = (SELECT COUNT(t.id) FROM topic t" \
+          " WHERE t.forum = forum.id), replies = COALESCE((SELECT" \
+          " SUM(t.replies) FROM topic t WHERE t.forum = forum.id), 0)," \
+          " lasttopic = (SELECT MAX(t.time) FROM topic t WHERE t.forum =" \
+          " forum.id), lastreply = (SELECT MAX(t.lastreply) FROM topic t" \
+          " WHERE t.forum = forum.id AND t.replies > 0), lastposter =" \
+          " (SELECT t.lastposter FROM topic t WHERE t.forum = forum.id ORDER" \
+          " BY t.lastreply DESC LIMIT 1)"
+        self._update_counters(cursor, sql, forum)
+
+    def recount(self, cursor):
+        """Recompute the counters of all the topics and forums."""
+        self.update_topic_counters(cursor)
+        self.update_forum_counters(cursor)
+        self.bump_generation(cursor)
+
+    def _update_counters(self, cursor, sql, id):
+        if id is None:
+            self.log.debug(sql)
+            cursor.execute(sql)
+        elif isinstance(id, list):
+            self._execute_ids(cursor, sql + " WHERE id IN (%s)", id)
+        else:
+            sql += " WHERE id = %s"
+            self.log.debug(sql % (id,))
+            cursor.execute(sql, (id,))
+
+    # Read state functions
+
+    def get_read_times(self, cursor, sid, topics):
+        """Return a dictionary with the time the given topics were last read
+        by the user of the session `sid`.
+
+        Topics never read, or whose read state was pruned, are considered read
+        up to `read_state_days` days ago."""
+        horizon = self._get_read_horizon()
+        times = dict([(topic, horizon) for topic in topics])
+        for i in xrange(0, len(topics), 500):
+            chunk = list(topics[i:i + 500])
+            sql = "SELECT topic, time FROM discussion_read_state WHERE" \
+              " sid = %s AND topic IN (" + ', '.join(['%s'] * len(chunk)) + ")"
+            self.log.debug(sql % tuple([sid] + chunk))
+            cursor.execute(sql, [sid] + chunk)
+            for topic, read_time in cursor:
+                times[int(topic)] = max(int(read_time), horizon)
+        return times
+
+    def set_read_times(self, cursor, sid, times):
+        """Record the times the topics of the `{topic : time}` dictionary
+        were read by the user of the session `sid`."""
+        rows = [(sid, topic, read_time) for topic, read_time in times.items()]
+        if rows:
+            cursor.executemany("DELETE FROM discussion_read_state WHERE sid = %s"
+              " AND topic = %s", [row[:2] for row in rows])
+            cursor.executemany("INSERT INTO discussion_read_state (sid, topic,"
+              " time) VALUES (%s, %s, %s)", rows)
+        self.prune_read_state(cursor, sid)
+
+    def prune_read_state(self, cursor, sid = None):
+        """Delete the read times older than `read_state_days` days, of the
+        user of the session `sid` or of all users. These topics are considered
+        read up to that date anyway."""
+        horizon = self._get_read_horizon()
+        if not horizon:
+            return
+        sql = "DELETE FROM discussion_read_state WHERE time < %s"
+        args = [horizon]
+        if sid:
+            sql += " AND sid = %s"
+            args.append(sid)
+        self.log.debug(sql % tuple(args))
+        cursor.execute(sql, args)
+
+    def get_unread_counts(self, cursor, sid, forums):
+        """Return a dictionary with the number of topics of each of the given
+        forums with topics or replies the user of the session `sid` hasn't
+        read yet.
+
+        Only the topics with replies newer than the read horizon are looked
+        at, through the index on the forum and last reply time of topics."""
+        counts = {}
+        if not forums:
+            return counts
+        horizon = self._get_read_horizon()
+        sql = "SELECT t.forum, COUNT(t.id) FROM topic t LEFT OUTER JOIN" \
+          " discussion_read_state r ON r.topic = t.id AND r.sid = %s WHERE" \
+          " t.forum IN (" + ', '.join(['%s'] * len(forums)) + ") AND" \
+          " t.lastreply > %s AND t.lastreply > COALESCE(r.time, 0)" \
+          " GROUP BY t.forum"
+        args = [sid] + list(forums) + [horizon]
+        self.log.debug(sql % tuple(args))
+        cursor.execute(sql, args)
+        for forum, count in cursor:
+            counts[int(forum)] = int(count)
+        return counts
+
+    def _get_read_horizon(self):
+        if self.read_state_days > 0:
+            return int(time.time()) - self.read_state_days * 86400
+        return 0
+
+    # Search index functions
+
+    def index_item(self, cursor, type, id, forum, text):
+        """Replace the words of the given topic or message in the
+        `discussion_search` index by the ones of `text`."""
+        sql = "DELETE FROM discussion_search WHERE type = %s AND id = %s"
+        self.log.debug(sql % (type, id))
+        cursor.execute(sql, (type, id))
+        rows = [(word, type, id, forum, count) for word, count in
+          get_words(text).items()]
+        if rows:
+            cursor.executemany("INSERT INTO discussion_search (word, type, id,"
+              " forum, count) VALUES (%s, %s, %s, %s, %s)", rows)
+
+    def reindex(self, cursor):
+        """Rebuild the search index of all the topics and messages."""
+        sql = "DELETE FROM discussion_search"
+        self.log.debug(sql)
+        cursor.execute(sql)
+        sql = "SELECT id, forum, subject, body FROM topic"
+        self.log.debug(sql)
+        cursor.execute(sql)
+        for id, forum, subject, body in cursor.fetchall():
+            self.index_item(cursor, 'topic', id, forum, '%s %s' % (subject,
+              body))
+        sql = "SELECT id, forum, body FROM message"
+        self.log.debug(sql)
+        cursor.execute(sql)
+        for id, forum, body in cursor.fetchall():
+            self.index_item(cursor, 'message', id, forum, body)
+
+    # Event log functions
+
+    def log_event(self, cursor, type, time, author, forum, topic, message,
+      forum_name = None, subject = None):
+        """Record the creation of a forum, topic or message in the
+        `discussion_event` table read by the timeline, along with the names of
+        its forum and topic."""
+        if forum_name is None:
+            forum_name = self.get_forum(cursor, forum)['name']
+        if subject is None:
+            subject = self.get_topic(cursor, topic)['subject']
+        sql = "INSERT INTO discussion_event (type, time, author, forum, topic," \
+          " message, forum_name, subject) VALUES (%s, %s, %s, %s, %s, %s, %s," \
+          " %s)"
+        self.log.debug(sql % (type, time, author, forum, topic, message,
+          forum_name, subject))
+        cursor.execute(sql, (type, time, author, forum, topic, message,
+          forum_name, subject))
+
+    def get_events(self, cursor, start, stop, limit = None):
+        """Return the events logged between the given times, newest first,
+        with the bodies of topics and messages."""
+        columns = ('type', 'time', 'author', 'forum', 'topic', 'message',
+          'forum_name', 'subject', 'description', 'body')
+        sql = "SELECT e.type, e.time, e.author, e.forum, e.topic, e.message," \
+          " e.forum_name, e.subject, f.description, COALESCE(m.body, t.body)" \
+          " FROM discussion_event e LEFT JOIN forum f ON e.type = 'forum' AND" \
+          " f.id = e.forum LEFT JOIN topic t ON e.type = 'topic' AND t.id =" \
+          " e.topic LEFT JOIN message m ON e.type = 'message' AND m.id =" \
+          " e.message WHERE e.time >= %s AND e.time <= %s ORDER BY e.time DESC"
+        args = [start, stop]
+        if limit:
+            sql += " LIMIT %s"
+            args.append(limit)
+        self.log.debug(sql % tuple(args))
+        cursor.execute(sql, args)
+        return [dict(zip(columns, row)) for row in cursor]
+
+    # Generation functions
+
+    def get_generation(self, cursor, forum = 0):
+        """Return the generation number of the given forum, or of the group
+        and forum lists for forum 0."""
+        sql = "SELECT generation FROM discussion_generation WHERE forum = %s"
+        self.log.debug(sql % (forum,))
+        cursor.execute(sql, (forum,))
         for row in cursor:
-            replies.append(row[0])
-
-        # Delete all replies
-        for reply in replies:
-            self.delete_message(cursor, reply)
-
-        # Delete message itself
-        sql = "DELETE FROM message WHERE id = %s"
-        self.log.debug(sql % (message,))
-        cursor.execute(sql, (message,))
+            return int(row[0])
+        return 0
+
+    def bump_generation(self, cursor, forum = None):
+        """Increment the generation number of the group and forum lists and of
+        the given forum or list of forums, or of all the forums, so that the
+        lists cached for their previous generation aren't used anymore."""
+        if forum is None:
+            sql = "UPDATE discussion_generation SET generation = generation + 1"
+            self.log.debug(sql)
+            cursor.execute(sql)
+            sql = "INSERT INTO discussion_generation (forum, generation) SELECT" \
+              " id, 1 FROM forum WHERE id NOT IN (SELECT forum FROM" \
+              " discussion_generation)"
+            self.log.debug(sql)
+            cursor.execute(sql)
+            return
+        if isinstance(forum, list):
+            forums = [0] + forum
+        else:
+            forums = [0, forum]
+        forums = list(set([int(id) for id in forums]))
+        existing = self._select_ids(cursor, "SELECT forum FROM"
+          " discussion_generation WHERE forum IN (%s)", forums)
+        self._execute_ids(cursor, "UPDATE discussion_generation SET generation"
+          " = generation + 1 WHERE forum IN (%s)", existing)
+        rows = [(id, 1) for id in forums if id not in existing]
+        if rows:
+            cursor.executemany("INSERT INTO discussion_generation (forum,"
+              " generation) VALUES (%s, %s)", rows)
+
+    # Rendering cache functions
+
+    def render_items(self, req, cursor, type, items, absurls = False):
+        """Replace the wiki text of the `author` and `body` of the given topic
+        or message dictionaries by their HTML rendering.
+
+        Unless `[discussion] cache_bodies` is disabled, the renderings of the
+        bodies are kept in the `discussion_cache` table, keyed by the item
+        type and id, along with their links and macros. They are used as long
+        as the hash of the wiki text, of the wiki rule set and of the current
+        rendering of these links and macros is unchanged, the same way as the
+        ticket comments cached by `TicketCommentCache`. Renderings with
+        absolute links, used by feeds, are kept apart."""
+        if absurls:
+            type += '-rss'
+        cached = {}
+        if self.cache_bodies:
+            ids = [item['id'] for item in items]
+            for i in xrange(0, len(ids), 500):
+                chunk = ids[i:i + 500]
+                sql = "SELECT id, hash, body, dependencies FROM" \
+                  " discussion_cache WHERE type = %s AND id IN (" + \
+                  ', '.join(['%s'] * len(chunk)) + ")"
+                self.log.debug(sql % tuple([type] + chunk))
+                cursor.execute(sql, [type] + chunk)
+                for id, hash, body, dependencies in cursor:
+                    cached[int(id)] = (hash, body, filter(None, (dependencies
+                      or '').split('\n')))
+
+        rows = []
+        rendered = {}
+        for item in items:
+            item['author'] = wiki_to_oneliner(item['author'], self.env)
+            body = item['body']
+            entry = cached.get(int(item['id']))
+            if entry and entry[0] == self._get_hash(req, body, entry[2],
+              absurls, rendered):
+                item['body'] = Markup(entry[1])
+                continue
+            item['body'], dependencies = wiki_to_cacheable_html(body,
+              self.env, req, None, absurls, True)
+            if self.cache_bodies and dependencies is not None:
+                rows.append((type, item['id'], self._get_hash(req, body,
+                  dependencies, absurls, rendered), unicode(item['body']),
+                  '\n'.join(dependencies)))
+
+        if rows:
+            self.log.debug('Caching rendering of %d items of type %s' %
+              (len(rows), type))
+            cursor.executemany("DELETE FROM discussion_cache WHERE type = %s"
+              " AND id = %s", [row[:2] for row in rows])
+            cursor.executemany("INSERT INTO discussion_cache (type, id, hash,"
+              " body, dependencies) VALUES (%s, %s, %s, %s, %s)", rows)
+
+    def _get_hash(self, req, body, dependencies, absurls, rendered):
+        return md5.new('\n'.join([WikiSystem(self.env).get_render_signature(
+          req), get_dependencies_hash(self.env, req, dependencies, None,
+          absurls, rendered), body.encode('utf-8')])).hexdigest()
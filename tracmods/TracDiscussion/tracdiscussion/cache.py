@@ -0,0 +1,55 @@
+# -*- coding: utf8 -*-
+
+from trac.core import *
+from trac.config import IntOption
+import threading
+
+class DiscussionCache(Component):
+    """
+        The cache module keeps the forum, topic and message lists in memory.
+        Each list is stored along with the generation number of the forum it
+        was read from, so that lists of forums changed since, possibly by
+        another process, are never returned.
+    """
+    max_entries = IntOption('discussion', 'list_cache_size', 500,
+      'The maximal number of forum, topic and message lists kept in memory.'
+      ' Set to 0 to disable the cache.')
+
+    def __init__(self):
+        self._entries = {} # key: [generation, value, last use]
+        self._uses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, generation):
+        """Return the list cached for the given key at the given generation,
+        or `None` if there is none."""
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key)
+            if entry and entry[0] == generation:
+                self._uses += 1
+                entry[2] = self._uses
+                return entry[1]
+            return None
+        finally:
+            self._lock.release()
+
+    def set(self, key, generation, value):
+        """Cache a list for the given key at the given generation."""
+        if self.max_entries <= 0:
+            return
+        self._lock.acquire()
+        try:
+            # When the cache is full, the least recently used quarter of the
+            # entries is dropped, so that the entries are sorted only once in
+            # a while.
+            if len(self._entries) >= self.max_entries and not key in \
+              self._entries:
+                uses = [(entry[2], k) for k, entry in self._entries.items()]
+                uses.sort()
+                for use, k in uses[:max(len(uses) / 4, 1)]:
+                    del self._entries[k]
+            self._uses += 1
+            self._entries[key] = [generation, value, self._uses]
+        finally:
+            self._lock.release()
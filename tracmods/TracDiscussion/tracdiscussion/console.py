@@ -0,0 +1,82 @@
+# -*- coding: utf8 -*-
+
+from tracdiscussion.api import *
+from trac.core import *
+from trac.scripts.admin import IAdminCommandProvider
+import time
+
+class DiscussionConsole(Component):
+    """
+        The console module implements discussion plugin maintenance commands
+        for trac-admin.
+    """
+    implements(IAdminCommandProvider)
+
+    # IAdminCommandProvider methods
+    def get_admin_commands(self):
+        yield ('discussion recount', '',
+          'Recompute the topic and reply counters of all forums and topics',
+          self._do_recount)
+        yield ('discussion prune', '',
+          'Forget the topics read more than read_state_days days ago',
+          self._do_prune)
+        yield ('discussion reindex', '',
+          'Rebuild the search index of all topics and messages',
+          self._do_reindex)
+        yield ('discussion delete-posts', '<author> [from] [until]',
+          'Delete the posts of an author and their replies (dates are'
+          ' YYYY-MM-DD)',
+          self._do_delete_posts)
+
+    def _do_recount(self):
+        # Get database access.
+        db = self.env.get_db_cnx()
+        cursor = db.cursor()
+
+        # Recompute counters.
+        api = DiscussionApi(self, None)
+        api.recount(cursor)
+        db.commit()
+        print 'Discussion counters recomputed.'
+
+    def _do_prune(self):
+        # Get database access.
+        db = self.env.get_db_cnx()
+        cursor = db.cursor()
+
+        # Delete old read times of all users.
+        api = DiscussionApi(self, None)
+        api.prune_read_state(cursor)
+        db.commit()
+        print 'Discussion read state pruned.'
+
+    def _do_reindex(self):
+        # Get database access.
+        db = self.env.get_db_cnx()
+        cursor = db.cursor()
+
+        # Rebuild search index.
+        api = DiscussionApi(self, None)
+        api.reindex(cursor)
+        db.commit()
+        print 'Discussion search index rebuilt.'
+
+    def _do_delete_posts(self, author, since = None, until = None):
+        # Get database access.
+        db = self.env.get_db_cnx()
+        cursor = db.cursor()
+
+        # Delete posts of the author.
+        api = DiscussionApi(self, None)
+        topics, messages = api.delete_posts(cursor, author,
+          self._parse_date(since), self._parse_date(until))
+        db.commit()
+        print 'Deleted %d topics and %d messages.' % (topics, messages)
+
+    def _parse_date(self, date):
+        if date is None:
+            return None
+        try:
+            return int(time.mktime(time.strptime(date, '%Y-%m-%d')))
+        except ValueError:
+            raise TracError('Invalid date %s, expected YYYY-MM-DD' % (date,))
@@ -4,7 +4,7 @@ from tracdiscussion.api import *
 from trac.core import *
 from trac.web.chrome import INavigationContributor, ITemplateProvider
 from trac.web.main import IRequestHandler
-from trac.config import Option, IntOption
+from trac.config import Option, BoolOption, IntOption
 from trac.perm import IPermissionRequestor
 from trac.util.html import html
 import re
@@ -18,8 +18,17 @@ class DiscussionCore(Component):
       IPermissionRequestor)
     topics_per_page = IntOption('discussion', 'topics_per_page', 20,
       'The number of topics to display on each page inside a forum' )
+    messages_per_page = IntOption('discussion', 'messages_per_page', 50,
+      'The number of messages to display on each page of a topic' )
+    read_state_days = IntOption('discussion', 'read_state_days', 90,
+      'The number of days the topics read by each user are remembered.'
+      ' Older topics are considered read. Set to 0 to never forget them.' )
     title = Option('discussion', 'title', 'Discussion',
       'Main navigation bar button title.')
+    cache_bodies = BoolOption('discussion', 'cache_bodies', 'true',
+      'Keep the HTML rendering of topic and message bodies in the database.'
+      ' Cached renderings are checked against the current rendering of'
+      ' their links and macros, as for `[ticket] cache_comments`.' )
 
     # IPermissionRequestor methods
     def get_permission_actions(self):
@@ -0,0 +1,28 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+tables = [
+  Table('discussion_generation', key = 'forum')[
+    Column('forum', type = 'integer'),
+    Column('generation', type = 'integer')
+  ]
+]
+
+def do_upgrade(env, cursor):
+    db_connector, _ = DatabaseManager(env)._get_connector()
+
+    print "Upgrading forum database tables to version 10\n"
+
+    # Create tables
+    for table in tables:
+        for statement in db_connector.to_sql(table):
+            cursor.execute(statement)
+
+    # Forum 0 holds the generation of the group and forum lists.
+    cursor.execute("INSERT INTO discussion_generation (forum, generation)" \
+      " VALUES (0, 0)")
+
+    # Set database schema version.
+    cursor.execute("UPDATE system SET value = '10' WHERE" \
+      " name = 'discussion_version'")
+
+    print "done.\n"
@@ -0,0 +1,27 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+# Only the index statements are used, the table already exists.
+tables = [
+  Table('topic', key = 'id')[
+    Column('id', type = 'integer', auto_increment = True),
+    Column('subject'),
+    Index(['subject'])
+  ]
+]
+
+def do_upgrade(env, cursor):
+    db_connector, _ = DatabaseManager(env)._get_connector()
+
+    print "Upgrading forum database tables to version 11\n"
+
+    # Create indices
+    for table in tables:
+        for statement in db_connector.to_sql(table):
+            if statement.startswith('CREATE INDEX'):
+                cursor.execute(statement)
+
+    # Set database schema version.
+    cursor.execute("UPDATE system SET value = '11' WHERE" \
+      " name = 'discussion_version'")
+
+    print "done.\n"
@@ -0,0 +1,28 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+# Only the index statements are used, the table already exists.
+tables = [
+  Table('topic', key = 'id')[
+    Column('id', type = 'integer', auto_increment = True),
+    Column('forum', type = 'integer'),
+    Column('lastreply', type = 'integer'),
+    Index(['forum', 'lastreply'])
+  ]
+]
+
+def do_upgrade(env, cursor):
+    db_connector, _ = DatabaseManager(env)._get_connector()
+
+    print "Upgrading forum database tables to version 12\n"
+
+    # Create indices
+    for table in tables:
+        for statement in db_connector.to_sql(table):
+            if statement.startswith('CREATE INDEX'):
+                cursor.execute(statement)
+
+    # Set database schema version.
+    cursor.execute("UPDATE system SET value = '12' WHERE" \
+      " name = 'discussion_version'")
+
+    print "done.\n"
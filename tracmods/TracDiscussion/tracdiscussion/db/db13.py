@@ -0,0 +1,28 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+tables = [
+  Table('discussion_cache', key = ('type', 'id'))[
+    Column('type'),
+    Column('id', type = 'integer'),
+    Column('hash'),
+    Column('body'),
+    Column('dependencies')
+  ]
+]
+
+def do_upgrade(env, cursor):
+    db_connector, _ = DatabaseManager(env)._get_connector()
+
+    print "Upgrading forum database tables to version 13\n"
+
+    # Recreate the rendering cache, the cached bodies are rendered again.
+    cursor.execute("DROP TABLE discussion_cache")
+    for table in tables:
+        for statement in db_connector.to_sql(table):
+            cursor.execute(statement)
+
+    # Set database schema version.
+    cursor.execute("UPDATE system SET value = '13' WHERE" \
+      " name = 'discussion_version'")
+
+    print "done.\n"
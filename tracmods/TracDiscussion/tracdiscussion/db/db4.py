@@ -0,0 +1,98 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+tables = [
+  Table('forum', key = 'id')[
+    Column('id', type = 'integer', auto_increment = True),
+    Column('name'),
+    Column('time', type = 'integer'),
+    Column('forum_group', type = 'integer'),
+    Column('author'),
+    Column('moderators'),
+    Column('subject'),
+    Column('description'),
+    Column('topics', type = 'integer'),
+    Column('replies', type = 'integer'),
+    Column('lasttopic', type = 'integer'),
+    Column('lastreply', type = 'integer'),
+    Column('lastposter')
+  ],
+  Table('topic', key = 'id')[
+    Column('id', type = 'integer', auto_increment = True),
+    Column('forum', type = 'integer'),
+    Column('time', type = 'integer'),
+    Column('author'),
+    Column('subject'),
+    Column('body'),
+    Column('lastreply', type = 'integer'),
+    Column('replies', type = 'integer'),
+    Column('lastposter'),
+    Index(['forum'])
+  ],
+  Table('message', key = 'id')[
+    Column('id', type = 'integer', auto_increment = True),
+    Column('forum', type = 'integer'),
+    Column('topic', type = 'integer'),
+    Column('replyto', type = 'integer'),
+    Column('time', type = 'integer'),
+    Column('author'),
+    Column('body'),
+    Index(['topic'])
+  ]
+]
+
+def do_upgrade(env, cursor):
+    db_connector, _ = DatabaseManager(env)._get_connector()
+
+    print "Upgrading forum database tables to version 4\n"
+
+    # Backup old tables
+    for table in tables:
+        cursor.execute("CREATE TEMPORARY TABLE %s_v3 AS SELECT * FROM %s" %
+          (table.name, table.name))
+        cursor.execute("DROP TABLE %s" % (table.name,))
+
+    # Create tables
+    for table in tables:
+        for statement in db_connector.to_sql(table):
+            cursor.execute(statement)
+
+    # Copy old messages
+    sql = "INSERT INTO message (id, forum, topic, replyto, time, author, " \
+          "body) SELECT id, forum, topic, replyto, time, author, body FROM " \
+          "message_v3"
+    print sql + "\n"
+    cursor.execute(sql)
+
+    # Copy old topics and count their replies
+    sql = "INSERT INTO topic (id, forum, time, author, subject, body, " \
+          "lastreply, replies, lastposter) SELECT t.id, t.forum, t.time, " \
+          "t.author, t.subject, t.body, COALESCE((SELECT MAX(m.time) FROM " \
+          "message m WHERE m.topic = t.id), t.time), (SELECT COUNT(m.id) FROM " \
+          "message m WHERE m.topic = t.id), COALESCE((SELECT m.author FROM " \
+          "message m WHERE m.topic = t.id ORDER BY m.time DESC LIMIT 1), " \
+          "t.author) FROM topic_v3 t"
+    print sql + "\n"
+    cursor.execute(sql)
+
+    # Copy old forums and count their topics and replies
+    sql = "INSERT INTO forum (id, name, time, forum_group, author, " \
+          "moderators, subject, description, topics, replies, lasttopic, " \
+          "lastreply, lastposter) SELECT f.id, f.name, f.time, " \
+          "f.forum_group, f.author, f.moderators, f.subject, f.description, " \
+          "(SELECT COUNT(t.id) FROM topic t WHERE t.forum = f.id), " \
+          "COALESCE((SELECT SUM(t.replies) FROM topic t WHERE t.forum = " \
+          "f.id), 0), (SELECT MAX(t.time) FROM topic t WHERE t.forum = f.id), " \
+          "(SELECT MAX(t.lastreply) FROM topic t WHERE t.forum = f.id AND " \
+          "t.replies > 0), (SELECT t.lastposter FROM topic t WHERE t.forum = " \
+          "f.id ORDER BY t.lastreply DESC LIMIT 1) FROM forum_v3 f"
+    print sql + "\n"
+    cursor.execute(sql)
+
+    for table in tables:
+        cursor.execute("DROP TABLE %s_v3" % (table.name,))
+
+    # Set database schema version.
+    cursor.execute("UPDATE system SET value = '4' WHERE" \
+      " name = 'discussion_version'")
+
+    print "done.\n"
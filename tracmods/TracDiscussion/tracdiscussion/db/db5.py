@@ -0,0 +1,27 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+tables = [
+  Table('discussion_cache', key = ('type', 'id'))[
+    Column('type'),
+    Column('id', type = 'integer'),
+    Column('hash'),
+    Column('author'),
+    Column('body')
+  ]
+]
+
+def do_upgrade(env, cursor):
+    db_connector, _ = DatabaseManager(env)._get_connector()
+
+    print "Upgrading forum database tables to version 5\n"
+
+    # Create tables
+    for table in tables:
+        for statement in db_connector.to_sql(table):
+            cursor.execute(statement)
+
+    # Set database schema version.
+    cursor.execute("UPDATE system SET value = '5' WHERE" \
+      " name = 'discussion_version'")
+
+    print "done.\n"
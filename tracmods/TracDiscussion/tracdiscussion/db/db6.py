@@ -0,0 +1,58 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+tables = [
+  Table('message', key = 'id')[
+    Column('id', type = 'integer', auto_increment = True),
+    Column('forum', type = 'integer'),
+    Column('topic', type = 'integer'),
+    Column('replyto', type = 'integer'),
+    Column('time', type = 'integer'),
+    Column('author'),
+    Column('body'),
+    Column('path'),
+    Index(['topic']),
+    Index(['topic', 'path']),
+    Index(['topic', 'time'])
+  ]
+]
+
+def do_upgrade(env, cursor):
+    db_connector, _ = DatabaseManager(env)._get_connector()
+
+    print "Upgrading forum database tables to version 6\n"
+
+    # Backup old message table
+    cursor.execute("CREATE TEMPORARY TABLE message_v5 AS SELECT * FROM message")
+    cursor.execute("DROP TABLE message")
+
+    # Create tables
+    for table in tables:
+        for statement in db_connector.to_sql(table):
+            cursor.execute(statement)
+
+    sql = "INSERT INTO message (id, forum, topic, replyto, time, author, " \
+          "body) SELECT id, forum, topic, replyto, time, author, body FROM " \
+          "message_v5"
+
+    # Copy old messages
+    print sql + "\n"
+    cursor.execute(sql)
+    cursor.execute("DROP TABLE message_v5")
+
+    # Compute thread order keys, replies always come after their parent
+    cursor.execute("SELECT id, replyto FROM message ORDER BY id")
+    paths = {}
+    for id, replyto in cursor.fetchall():
+        if paths.has_key(replyto):
+            paths[id] = '%s/%010d' % (paths[replyto], id)
+        else:
+            paths[id] = '%010d' % (id,)
+    if paths:
+        cursor.executemany("UPDATE message SET path = %s WHERE id = %s",
+          [(path, id) for id, path in paths.items()])
+
+    # Set database schema version.
+    cursor.execute("UPDATE system SET value = '6' WHERE" \
+      " name = 'discussion_version'")
+
+    print "done.\n"
@@ -0,0 +1,44 @@
+from trac.db import Table, Column, Index, DatabaseManager
+import re
+
+tables = [
+  Table('discussion_read_state', key = ('sid', 'topic'))[
+    Column('sid'),
+    Column('topic', type = 'integer'),
+    Column('time', type = 'integer'),
+    Index(['time'])
+  ]
+]
+
+def do_upgrade(env, cursor):
+    db_connector, _ = DatabaseManager(env)._get_connector()
+
+    print "Upgrading forum database tables to version 7\n"
+
+    # Create tables
+    for table in tables:
+        for statement in db_connector.to_sql(table):
+            cursor.execute(statement)
+
+    # Move visit times of topics from sessions to the new table. They were
+    # stored as representation of {topic : time} dictionary.
+    sql = "SELECT sid, value FROM session_attribute WHERE" \
+      " name = 'visited-topics'"
+    print sql + "\n"
+    cursor.execute(sql)
+    read_state = {}
+    for sid, value in cursor:
+        for topic, time in re.findall(r'(\d+)L?\s*:\s*(\d+)L?', value or ''):
+            read_state[(sid, int(topic))] = int(time)
+    if read_state:
+        cursor.executemany("INSERT INTO discussion_read_state (sid, topic," \
+          " time) VALUES (%s, %s, %s)", [(sid, topic, time) for (sid, topic),
+          time in read_state.items()])
+    cursor.execute("DELETE FROM session_attribute WHERE" \
+      " name = 'visited-topics'")
+
+    # Set database schema version.
+    cursor.execute("UPDATE system SET value = '7' WHERE" \
+      " name = 'discussion_version'")
+
+    print "done.\n"
@@ -0,0 +1,45 @@
+from trac.db import Table, Column, Index, DatabaseManager
+from tracdiscussion.search import get_words
+
+tables = [
+  Table('discussion_search', key = ('word', 'type', 'id'))[
+    Column('word'),
+    Column('type'),
+    Column('id', type = 'integer'),
+    Column('forum', type = 'integer'),
+    Column('count', type = 'integer'),
+    Index(['type', 'id'])
+  ]
+]
+
+def do_upgrade(env, cursor):
+    db_connector, _ = DatabaseManager(env)._get_connector()
+
+    print "Upgrading forum database tables to version 8\n"
+
+    # Create tables
+    for table in tables:
+        for statement in db_connector.to_sql(table):
+            cursor.execute(statement)
+
+    # Index existing topics and messages.
+    rows = []
+    cursor.execute("SELECT id, forum, subject, body FROM topic")
+    for id, forum, subject, body in cursor.fetchall():
+        words = get_words('%s %s' % (subject, body))
+        rows.extend([(word, 'topic', id, forum, count) for word, count in
+          words.items()])
+    cursor.execute("SELECT id, forum, body FROM message")
+    for id, forum, body in cursor.fetchall():
+        words = get_words(body)
+        rows.extend([(word, 'message', id, forum, count) for word, count in
+          words.items()])
+    if rows:
+        cursor.executemany("INSERT INTO discussion_search (word, type, id," \
+          " forum, count) VALUES (%s, %s, %s, %s, %s)", rows)
+
+    # Set database schema version.
+    cursor.execute("UPDATE system SET value = '8' WHERE" \
+      " name = 'discussion_version'")
+
+    print "done.\n"
@@ -0,0 +1,51 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+tables = [
+  Table('discussion_event', key = 'id')[
+    Column('id', type = 'integer', auto_increment = True),
+    Column('type'),
+    Column('time', type = 'integer'),
+    Column('author'),
+    Column('forum', type = 'integer'),
+    Column('topic', type = 'integer'),
+    Column('message', type = 'integer'),
+    Column('forum_name'),
+    Column('subject'),
+    Index(['time'])
+  ]
+]
+
+def do_upgrade(env, cursor):
+    db_connector, _ = DatabaseManager(env)._get_connector()
+
+    print "Upgrading forum database tables to version 9\n"
+
+    # Create tables
+    for table in tables:
+        for statement in db_connector.to_sql(table):
+            cursor.execute(statement)
+
+    # Log creation of existing forums, topics and messages.
+    sql = "INSERT INTO discussion_event (type, time, author, forum, topic," \
+      " message, forum_name, subject) SELECT 'forum', time, author, id, NULL," \
+      " NULL, name, subject FROM forum"
+    print sql + "\n"
+    cursor.execute(sql)
+    sql = "INSERT INTO discussion_event (type, time, author, forum, topic," \
+      " message, forum_name, subject) SELECT 'topic', t.time, t.author," \
+      " t.forum, t.id, NULL, f.name, t.subject FROM topic t LEFT JOIN forum f" \
+      " ON f.id = t.forum"
+    print sql + "\n"
+    cursor.execute(sql)
+    sql = "INSERT INTO discussion_event (type, time, author, forum, topic," \
+      " message, forum_name, subject) SELECT 'message', m.time, m.author," \
+      " m.forum, m.topic, m.id, f.name, t.subject FROM message m LEFT JOIN" \
+      " topic t ON t.id = m.topic LEFT JOIN forum f ON f.id = m.forum"
+    print sql + "\n"
+    cursor.execute(sql)
+
+    # Set database schema version.
+    cursor.execute("UPDATE system SET value = '9' WHERE" \
+      " name = 'discussion_version'")
+
+    print "done.\n"
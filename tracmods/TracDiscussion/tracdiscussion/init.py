@@ -5,7 +5,7 @@ from trac.db import *
 from trac.env import IEnvironmentSetupParticipant
 
 # Last discussion database schema version
-last_db_version = 3
+last_db_version = 13
 
 class DiscussionInit(Component):
     """ Initialise database and environment for discussion component """
@@ -34,6 +34,11 @@ class DiscussionInit(Component):
             globals(), locals(), ['do_upgrade'])
             module.do_upgrade(self.env, cursor)
 
+        # Tables recreated by the upgrades keep their ids
+        if db_version < last_db_version:
+            for table in ('forum', 'topic', 'message'):
+                db.update_sequence(cursor, table)
+
     def _get_db_version(self, cursor):
         try:
             sql = "SELECT value FROM system WHERE name='discussion_version'"
@@ -1,9 +1,34 @@
 # -*- coding: utf8 -*-
 
 from trac.core import *
-from trac.config import Option
+from trac.config import Option, IntOption
 from trac.Search import ISearchSource, shorten_result
 from trac import util
+import re
+import sys
+
+word_re = re.compile(r'\w+', re.UNICODE)
+
+def get_words(text):
+    """Return a dictionary with the number of occurences of each word of the
+    given text, as stored in the `discussion_search` index."""
+    words = {}
+    for word in word_re.findall((text or '').lower()):
+        if len(word) > 1:
+            word = word[:64]
+            words[word] = words.get(word, 0) + 1
+    return words
+
+def get_prefix_range(prefix):
+    """Return the bounds of the indexed words starting with the given prefix:
+    `low <= word < high`, the upper bound being the prefix with its last
+    character incremented."""
+    high = prefix
+    while high and ord(high[-1]) >= sys.maxunicode:
+        high = high[:-1]
+    if high:
+        high = high[:-1] + unichr(ord(high[-1]) + 1)
+    return prefix, high
 
 class DiscussionSearch(Component):
     """
@@ -13,45 +38,102 @@ class DiscussionSearch(Component):
 
     title = Option('discussion', 'title', 'Discussion',
       'Main navigation bar button title.')
+    max_search_results = IntOption('discussion', 'max_search_results', 200,
+      'The maximal number of topics and messages returned by a search,'
+      ' the most relevant first.')
 
     #ISearchSource
     def get_search_filters(self, req):
         if req.perm.has_permission('DISCUSSION_VIEW'):
             yield ("discussion", self.title)
 
+            # Allow to restrict the search to some forums.
+            db = self.env.get_db_cnx()
+            cursor = db.cursor()
+            sql = "SELECT id, name FROM forum ORDER BY name"
+            self.log.debug(sql)
+            cursor.execute(sql)
+            for id, name in cursor:
+                yield ("discussion-forum-%s" % (id,), "%s: %s" % (self.title,
+                  name), False)
+
     def get_search_results(self, req, keywords, filters):
-        if not 'discussion' in filters:
+        forums = [int(filter[17:]) for filter in filters
+          if filter.startswith('discussion-forum-')]
+        if not 'discussion' in filters and not forums:
             return
 
         # Create database context
         db = self.env.get_db_cnx()
         cursor = db.cursor()
 
+        # Each keyword has to match the start of an indexed word, the items
+        # containing the most occurences of them are returned first.
+        ranges = []
+        for keyword in keywords:
+            for word in word_re.findall(keyword.lower()):
+                ranges.append(get_prefix_range(word[:64]))
+        if not ranges:
+            return
+        matches, args = [], []
+        for low, high in ranges:
+            if high:
+                matches.append("word >= %s AND word < %s")
+                args.extend((low, high))
+            else:
+                matches.append("word >= %s")
+                args.append(low)
+        sql = "SELECT type, id FROM discussion_search WHERE ((" + \
+          ") OR (".join(matches) + "))"
+        if forums:
+            sql += " AND forum IN (" + ', '.join(['%s'] * len(forums)) + ")"
+            args.extend(forums)
+        sql += " GROUP BY type, id HAVING " + " AND ".join(["SUM(CASE WHEN " +
+          match + " THEN 1 ELSE 0 END) > 0" for match in matches]) + \
+          " ORDER BY SUM(count) DESC LIMIT %s"
+        for low, high in ranges:
+            args.append(low)
+            if high:
+                args.append(high)
+        args.append(self.max_search_results)
+        self.log.debug(sql % tuple(args))
+        cursor.execute(sql, args)
+        topics, messages = [], []
+        for type, id in cursor:
+            if type == 'topic':
+                topics.append(id)
+            else:
+                messages.append(id)
+
         # Search in topics.
-        query = ' '.join(keywords)
         columns = ('id', 'forum', 'time', 'subject', 'body', 'author')
         sql = "SELECT id, forum, time, subject, body, author FROM topic" \
-          " WHERE subject || body LIKE '%%%s%%'" % (query)
-        self.log.debug(sql)
-        cursor.execute(sql)
-        for row in cursor:
+          " WHERE id IN (%s)"
+        for row in self._get_rows(cursor, sql, topics):
             row = dict(zip(columns, row))
             yield (req.href.discussion(row['forum'], row['id']) + '#-1',
               "topic: %d: %s" % (row['id'], util.shorten_line(row['subject'])),
               row['time'], row['author'], shorten_result(row['body'],
-              [query]))
+              keywords))
 
         # Search in messages
         columns = ('id', 'forum', 'topic', 'time', 'author', 'body', 'subject')
         sql = "SELECT m.id, m.forum, m.topic, m.time, m.author, m.body," \
-          " t.subject FROM message m LEFT JOIN (SELECT subject, id FROM" \
-          " topic) t ON t.id = m.topic WHERE body LIKE '%%%s%%'" \
-          % (query)
-        self.log.debug(sql)
-        cursor.execute(sql)
-        for row in cursor:
+          " t.subject FROM message m LEFT JOIN topic t ON t.id = m.topic" \
+          " WHERE m.id IN (%s)"
+        for row in self._get_rows(cursor, sql, messages):
             row = dict(zip(columns, row))
             yield (req.href.discussion(row['forum'], row['topic'], row['id'])
               + '#%s' % (row['id']), "message: %d: %s" % (row['id'],
               util.shorten_line(row['subject'])), row['time'], row['author'],
-              shorten_result(row['body'], [query]))
+              shorten_result(row['body'], keywords))
+
+    def _get_rows(self, cursor, sql, ids):
+        rows = []
+        for i in xrange(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            chunk_sql = sql % (', '.join(['%s'] * len(chunk)),)
+            self.log.debug(chunk_sql % tuple(chunk))
+            cursor.execute(chunk_sql, chunk)
+            rows.extend(cursor.fetchall())
+        return rows
@@ -99,6 +99,24 @@
   </div>
 <?cs /def ?>
 
+<?cs def:display_message_pages() ?>
+  <?cs if:(discussion.prev_page != '') || (discussion.next_page != '') || discussion.first_unread.id ?>
+    <table width="100%" border="0" cellpadding="1" cellspacing="0" class="pages">
+      <tr>
+        <td style="text-align: left">
+          <?cs if:discussion.prev_page != '' ?><a href="<?cs var:discussion.href ?>?start=<?cs var:discussion.prev_page ?>">&lt; previous page</a><?cs /if ?>
+        </td>
+        <td style="text-align: center">
+          <?cs if:discussion.first_unread.id ?><a href="<?cs var:discussion.href ?>?start=<?cs var:discussion.first_unread.start ?>#<?cs var:discussion.first_unread.id ?>">Jump to first unread</a><?cs /if ?>
+        </td>
+        <td style="text-align: right">
+          <?cs if:discussion.next_page != '' ?><a href="<?cs var:discussion.href ?>?start=<?cs var:discussion.next_page ?>">next page &gt;</a><?cs /if ?>
+        </td>
+      </tr>
+    </table>
+  <?cs /if ?>
+<?cs /def ?>
+
 <?cs def:display_replies(messages) ?>
   <?cs each:message = messages ?>
     <li class="message<?cs if:message.new ?> new<?cs /if ?>">
@@ -200,6 +218,7 @@
   <?cs if:discussion.messages.0.id || (args.discussion_action == 'add') || (args.discussion_action == 'quote') || (args.discussion_action == 'post-add') ?>
     <div class="replies <?cs if:discussion.topic.new ?>new<?cs /if ?>">
       <?cs call:display_set_display() ?>
+      <?cs call:display_message_pages() ?>
       <ul class="reply">
         <?cs if:discussion.messages.0.id ?>
           <?cs call:display_replies(discussion.messages) ?>
@@ -211,6 +230,7 @@
           <?cs call:display_reply_form() ?>
         <?cs /if ?>
       </ul>
+      <?cs call:display_message_pages() ?>
       <?cs call:display_set_display() ?>
     </div>
   <?cs /if ?>
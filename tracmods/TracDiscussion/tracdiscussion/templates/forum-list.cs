@@ -62,6 +62,7 @@
               <div class="topics">
                 <a href="<?cs var:discussion.href ?>/<?cs var:forum.id ?>">
                   <?cs var:forum.topics ?>
+                  <?cs if:forum.unread ?>(<?cs var:forum.unread ?> new)<?cs /if ?>
               </a>
               </div>
             </td>
@@ -20,7 +20,7 @@
     </thead>
     <tbody>
       <?cs each:topic = discussion.topics ?>
-        <tr class="<?cs if:name(topic) % #2 ?>even<?cs else ?>odd<?cs /if ?>">
+        <tr class="<?cs if:name(topic) % #2 ?>even<?cs else ?>odd<?cs /if ?><?cs if:topic.new ?> new<?cs /if ?>">
           <td class="id">
             <div class="id">
               <a href="<?cs var:discussion.href ?>/<?cs var:discussion.forum.id ?>/<?cs var:topic.id ?>">
@@ -1,5 +1,6 @@
 # -*- coding: utf8 -*-
 
+from tracdiscussion.api import *
 from trac.core import *
 from trac.Timeline import ITimelineEventProvider
 from trac.wiki import wiki_to_html, wiki_to_oneliner
@@ -25,100 +26,78 @@ class DiscussionTimeline(Component):
             format = req.args.get('format')
             self.log.debug("format: %s" % (format))
 
-            # Get forum events
-            for forum in self._get_changed_forums(cursor, start, stop):
-                self.log.debug("forum: %s" % (forum))
-                kind = 'changeset'
-                title = Markup('New forum %s created by %s' %
-                  (forum['name'], forum['author']))
-                time = forum['time']
-                author = forum['author']
-                if format == 'rss':
-                    href = req.abs_href.discussion(forum['id'])
-                    message = wiki_to_html('%s - %s' % (forum['subject'],
-                      forum['description']), self.env, req, db)
-                else:
-                    href = req.href.discussion(forum['id'])
-                    message = wiki_to_oneliner('%s - %s' % (forum['subject'],
-                      forum['description']), self.env, db)  
-                yield kind, href, title, time, author, message
+            # Get the events of the period from the event log. The timeline
+            # keeps only the newest `max` events, if given.
+            api = DiscussionApi(self, req)
+            events = api.get_events(cursor, start, stop,
+              int(req.args.get('max') or 0))
 
-            # Get topic events
-            for topic in self._get_changed_topics(cursor, start, stop):
-                self.log.debug("topic: %s" % (topic))
-                kind = 'newticket'
-                title = Markup("[%s Forum] %s (%s)" % \
-                  (topic['forum_name'], topic['subject'], topic['author']))
-                time = topic['time']
-                author = topic['author']
-                if format == 'rss':
-                    href = req.abs_href.discussion(topic['forum'],
-                      topic['id'])
-                    wikitext = '== ' + topic['subject'] + " ==\n\n" + topic['body']
-                    message = wiki_to_html(wikitext, self.env, req, db)
-#                    message = wiki_to_html(topic['subject'], self.env, req, db)
-                else:
-                    href = req.href.discussion(topic['forum'], topic['id'])
-                    message = wiki_to_oneliner(topic['subject'], self.env, db)
-                yield kind, href, title, time, author, message
+            # Feeds display the bodies of topics and messages.
+            if format == 'rss':
+                for type in ('topic', 'message'):
+                    items = [{'id' : event[type], 'author' : event['author'],
+                      'body' : event['body']} for event in events
+                      if event['type'] == type]
+                    api.render_items(req, cursor, type, items, True)
+                    bodies = dict([(item['id'], item['body']) for item in
+                      items])
+                    for event in events:
+                        if event['type'] == type:
+                            event['body'] = bodies[event[type]]
+                db.commit()
 
-            # Get message events
-            for message in self._get_changed_messages(cursor, start, stop):
-                self.log.debug("message: %s" % (message))
-                kind = 'editedticket'
-                title = Markup("[%s Forum] Re: %s (%s)" % \
-                  (message['forum_name'], message['topic_subject'], message['author']))
-                time = message['time']
-                author = message['author']
-                if format == 'rss':
-                    href = req.abs_href.discussion(message['forum'],
-                      message['topic'], message['id']) + '#%s' % (message['id'])
-                    wikitext = '== ' + message['topic_subject'] + " ==\n\n" + message['body']
-#                    message = wiki_to_html(message['topic_subject'], self.env,
-                    message = wiki_to_html(wikitext, self.env, req, db)
+            for event in events:
+                self.log.debug("event: %s" % (event))
+                time = event['time']
+                author = event['author']
+                if event['type'] == 'forum':
+                    # Forum events
+                    kind = 'changeset'
+                    title = Markup('New forum %s created by %s' %
+                      (event['forum_name'], author))
+                    if format == 'rss':
+                        href = req.abs_href.discussion(event['forum'])
+                        message = wiki_to_html('%s - %s' % (event['subject'],
+                          event['description']), self.env, req, db)
+                    else:
+                        href = req.href.discussion(event['forum'])
+                        message = wiki_to_oneliner('%s - %s' %
+                          (event['subject'], event['description']), self.env,
+                          db)
+                elif event['type'] == 'topic':
+                    # Topic events
+                    kind = 'newticket'
+                    title = Markup("[%s Forum] %s (%s)" % \
+                      (event['forum_name'], event['subject'], author))
+                    if format == 'rss':
+                        href = req.abs_href.discussion(event['forum'],
+                          event['topic'])
+                        message = Markup('<h2>%s</h2>\n%s', event['subject'],
+                          event['body'])
+                    else:
+                        href = req.href.discussion(event['forum'],
+                          event['topic'])
+                        message = wiki_to_oneliner(event['subject'], self.env,
+                          db)
                 else:
-                    href = req.href.discussion(message['forum'],
-                      message['topic'], message['id']) + '#%s' % (message['id'])
-                    message = wiki_to_oneliner(message['topic_subject'],
-                      self.env, db)
+                    # Message events
+                    kind = 'editedticket'
+                    title = Markup("[%s Forum] Re: %s (%s)" % \
+                      (event['forum_name'], event['subject'], author))
+                    if format == 'rss':
+                        href = req.abs_href.discussion(event['forum'],
+                          event['topic'], event['message']) + '#%s' % \
+                          (event['message'])
+                        message = Markup('<h2>%s</h2>\n%s', event['subject'],
+                          event['body'])
+                    else:
+                        href = req.href.discussion(event['forum'],
+                          event['topic'], event['message']) + '#%s' % \
+                          (event['message'])
+                        message = wiki_to_oneliner(event['subject'], self.env,
+                          db)
                 yield kind, href, title, time, author, message
 
     def get_timeline_filters(self, req):
         if req.perm.has_permission('DISCUSSION_VIEW'):
             yield ('discussion', 'Discussion changes')
-
-    def _get_changed_forums(self, cursor, start, stop):
-        columns = ('id', 'name', 'author', 'subject', 'description', 'time')
-        sql = "SELECT f.id, f.name, f.author, f.subject, f.description," \
-          " f.time FROM forum f WHERE f.time BETWEEN %s AND %s"
-        self.log.debug(sql % (start, stop))
-        cursor.execute(sql, (start, stop))
-        for row in cursor:
-            row = dict(zip(columns, row))
-            yield row
-
-    def _get_changed_topics(self, cursor, start, stop):
-        columns = ('id', 'subject', 'author', 'time', 'forum', 'forum_name', 'body')
-        sql = "SELECT t.id, t.subject, t.author, t.time, t.forum, f.name, t.body" \
-          " FROM topic t LEFT JOIN (SELECT id, name FROM forum)" \
-          " f ON t.forum = f.id WHERE t.time BETWEEN %s AND %s"
-
-        self.log.debug(sql % (start, stop))
-        cursor.execute(sql, (start, stop))
-        for row in cursor:
-            row = dict(zip(columns, row))
-            yield row
-
-    def _get_changed_messages(self, cursor, start, stop):
-        columns = ('id', 'author', 'time', 'forum', 'topic', 'forum_name',
-          'topic_subject', 'body')
-        sql = "SELECT m.id, m.author, m.time, m.forum, m.topic, f.name," \
-          " t.subject, m.body FROM message m, (SELECT id, name FROM forum) f, (SELECT" \
-          " id, subject FROM topic) t WHERE t.id = m.topic AND f.id = m.forum" \
-          " AND time BETWEEN %s AND %s"
-
-        self.log.debug(sql % (start, stop))
-        cursor.execute(sql, (start, stop))
-        for row in cursor:
-            row = dict(zip(columns, row))
-            yield row
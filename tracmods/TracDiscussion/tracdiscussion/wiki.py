@@ -3,7 +3,7 @@
 from tracdiscussion.api import *
 from tracdiscussion.core import *
 from trac.core import *
-from trac.wiki import IWikiSyntaxProvider, IWikiMacroProvider
+from trac.wiki import IWikiSyntaxProvider, IWikiMacroProvider, wiki_to_oneliner
 from trac.web.main import IRequestHandler, IRequestFilter
 from trac.web.chrome import add_stylesheet
 from trac.util import format_datetime
@@ -36,7 +36,7 @@ class DiscussionWiki(Component):
         yield 'ViewTopic'
 
     def get_macro_description(self, name):
-        if name == 'VisitCounter':
+        if name == 'ViewTopic':
             return view_topic_doc
         else:
             return ""
@@ -61,6 +61,14 @@ class DiscussionWiki(Component):
             self.log.debug('subject: %s' % (subject,))
             self.log.debug('topic: %s' % (topic,))
 
+            # Plain views of existing topics don't need the modes and actions
+            # of the full discussion, forms are still handled by it.
+            if topic and req.perm.has_permission('DISCUSSION_VIEW') and not \
+              req.args.get('discussion_action'):
+                content = self._render_topic(req, cursor, api, topic)
+                db.commit()
+                return content
+
             # Return macro content
             req.args['component'] = 'wiki'
             if topic:
@@ -70,6 +78,25 @@ class DiscussionWiki(Component):
         else:
             raise TracError('Not implemented macro %s' % (name))
 
+    def _render_topic(self, req, cursor, api, topic):
+        # The topic is displayed with the message list template of the
+        # discussion, its page of messages comes from the list cache and the
+        # bodies from the rendering cache.
+        add_stylesheet(req, 'discussion/css/discussion.css')
+        forum = api.get_forum(cursor, topic['forum'])
+        req.hdf['discussion.href'] = req.href(req.path_info)
+        req.hdf['discussion.component'] = 'wiki'
+        req.hdf['discussion.authname'] = req.authname
+        req.hdf['discussion.is_moderator'] = bool(forum and \
+          req.authname in forum['moderators']) or \
+          req.perm.has_permission('DISCUSSION_ADMIN')
+        api._prepare_message_list(req, cursor, topic)
+        topic['subject'] = wiki_to_oneliner(topic['subject'], self.env)
+        api.render_items(req, cursor, 'topic', [topic])
+        topic['time'] = format_datetime(topic['time'])
+        req.hdf['discussion.topic'] = topic
+        return to_unicode(req.hdf.render('wiki-message-list.cs'))
+
     # IRequestFilter methods
     def pre_process_request(self, req, handler):
         # Change method from POST to GET.
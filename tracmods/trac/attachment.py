@@ -584,9 +584,16 @@ class AttachmentModule(Component):
             self.log.debug("Rendering preview of file %s with mime-type %s"
                            % (attachment.filename, mime_type))
 
+            def page_href(offset):
+                return attachment.href(req, offset=offset or None)
+            try:
+                offset = int(req.args.get('offset') or 0)
+            except ValueError:
+                offset = 0
             req.hdf['attachment'] = mimeview.preview_to_hdf(
                 req, fd, os.fstat(fd.fileno()).st_size, mime_type,
-                attachment.filename, raw_href, annotations=['lineno'])
+                attachment.filename, raw_href, annotations=['lineno'],
+                offset=offset, page_href=page_href)
         finally:
             fd.close()
 
@@ -161,6 +161,10 @@ class MySQLConnection(ConnectionWrapper):
     def get_last_id(self, cursor, table, column='id'):
         return self.cnx.insert_id()
 
+    def update_sequence(self, cursor, table, column='id'):
+        # AUTO_INCREMENT columns always continue after the highest value
+        pass
+
     def rollback(self):
         self.cnx.rollback()
         self.cnx.ping()
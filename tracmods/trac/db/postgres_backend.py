@@ -140,6 +140,10 @@ class PostgreSQLConnection(ConnectionWrapper):
         cursor.execute("SELECT CURRVAL('%s_%s_seq')" % (table, column))
         return cursor.fetchone()[0]
 
+    def update_sequence(self, cursor, table, column='id'):
+        cursor.execute("SELECT SETVAL('%s_%s_seq', (SELECT MAX(%s) FROM %s))"
+                       % (table, column, column, table))
+
     def rollback(self):
         self.cnx.rollback()
         if self.schema:
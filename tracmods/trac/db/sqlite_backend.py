@@ -211,3 +211,7 @@ class SQLiteConnection(ConnectionWrapper):
     else:
         def get_last_id(self, cursor, table, column='id'):
             return self.cnx.db.sqlite_last_insert_rowid()
+
+    def update_sequence(self, cursor, table, column='id'):
+        # INTEGER PRIMARY KEY columns always continue after the highest value
+        pass
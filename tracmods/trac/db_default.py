@@ -17,7 +17,7 @@
 from trac.db import Table, Column, Index
 
 # Database version identifier. Used for automatic upgrades.
-db_version = 19
+db_version = 27
 
 def __mkreports(reports):
     """Utility function used to create report data in same syntax as the
@@ -57,6 +57,16 @@ schema = [
         Column('authenticated', type='int'),
         Column('name'),
         Column('value')],
+    Table('notify_queue', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int'),
+        Column('next_attempt', type='int'),
+        Column('attempts', type='int'),
+        Column('sender'),
+        Column('recipients'),
+        Column('message'),
+        Column('error'),
+        Index(['next_attempt'])],
 
     # Attachments
     Table('attachment', key=('type', 'id', 'filename'))[
@@ -96,6 +106,19 @@ schema = [
         Column('base_path'),
         Column('base_rev'),
         Index(['rev'])],
+    Table('node_listing', key=('path', 'rev', 'name'))[
+        Column('path'),
+        Column('rev'),
+        Column('name'),
+        Column('node_type', size=1),
+        Column('size', type='int'),
+        Column('created_rev')],
+    Table('node_history', key=('path', 'rev'))[
+        Column('path'),
+        Column('rev', type='int'),
+        Column('change_type', size=1),
+        Column('base_path'),
+        Column('base_rev', type='int')],
 
     # Ticket system
     Table('ticket', key='id')[
@@ -131,6 +154,16 @@ schema = [
         Column('ticket', type='int'),
         Column('name'),
         Column('value')],
+    Table('milestone_stats', key=('milestone', 'status'))[
+        Column('milestone'),
+        Column('status'),
+        Column('tickets', type='int')],
+    Table('ticket_comment_cache', key=('ticket', 'cnum'))[
+        Column('ticket', type='int'),
+        Column('cnum', type='int'),
+        Column('hash'),
+        Column('html'),
+        Column('dependencies')],
     Table('enum', key=('type', 'name'))[
         Column('type'),
         Column('name'),
@@ -386,7 +419,8 @@ def get_data(db):
                 ('anonymous', 'MILESTONE_VIEW'))),
            ('system',
              ('name', 'value'),
-               (('database_version', str(db_version)),)),
+               (('database_version', str(db_version)),
+                ('milestone_stats_generation', '0'))),
            ('report',
              ('author', 'title', 'query', 'description'),
                __mkreports(get_reports(db))))
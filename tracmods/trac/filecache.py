@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2006 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import cPickle
+import md5
+import os
+import tempfile
+import threading
+import zlib
+
+from trac.core import *
+
+__all__ = ['FileCache']
+
+
+class FileCache(Component):
+    """Base class for the components keeping computed values on disk.
+
+    Each value is stored in a file named after its key, so that several
+    processes can share the cache without any locking.  The total size of
+    the cache is kept below `max_size` by removing the least recently used
+    files.
+
+    Subclasses define the `cache_dir` (relative to the environment
+    directory) and `max_size` options; a `max_size` of `0` disables the
+    cache.
+    """
+
+    abstract = True
+
+    cache_dir = None
+    max_size = 0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._written = None # bytes written since the last cleanup
+
+    # Public API
+
+    def make_key(self, *parts):
+        """Return a cache key for the given parts, which must have a stable
+        `repr()`."""
+        return md5.new(repr(parts)).hexdigest()
+
+    def get(self, key, compute):
+        """Return the value cached for `key`, or the value returned by
+        `compute()`, which is then stored in the cache."""
+        try:
+            return self.load(key)
+        except KeyError:
+            value = compute()
+            self.store(key, value)
+            return value
+
+    def load(self, key):
+        """Return the value cached for `key`, raise `KeyError` if there is
+        none."""
+        if self.max_size <= 0:
+            raise KeyError(key)
+        path = self._get_path(key)
+        try:
+            fileobj = open(path, 'rb')
+            try:
+                value = cPickle.loads(zlib.decompress(fileobj.read()))
+            finally:
+                fileobj.close()
+            os.utime(path, None) # mark as recently used
+            return value
+        except (IOError, OSError):
+            pass
+        except Exception, e:
+            self.log.warning('Invalid cache file %s: %s', path, e)
+        raise KeyError(key)
+
+    def store(self, key, value):
+        """Store a value in the cache."""
+        if self.max_size <= 0:
+            return
+        path = self._get_path(key)
+        try:
+            self._store(path, zlib.compress(cPickle.dumps(value, 2)))
+        except (IOError, OSError), e:
+            self.log.warning('Failed to write cache file %s: %s', path, e)
+
+    def clear(self):
+        """Remove all the cached values."""
+        for path, size, mtime in self._get_files():
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    # Internal methods
+
+    def _get_dir(self):
+        return os.path.join(self.env.path, self.cache_dir)
+
+    def _get_path(self, key):
+        return os.path.join(self._get_dir(), key[:2], key[2:])
+
+    def _store(self, path, data):
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                if not os.path.isdir(dirname): # created by another process
+                    raise
+        # Write to a temporary file first, so that a cached value being read
+        # is always complete
+        fd, tmpname = tempfile.mkstemp(dir=dirname)
+        try:
+            os.write(fd, data)
+            os.close(fd)
+            if os.name == 'nt' and os.path.exists(path):
+                os.unlink(path)
+            os.rename(tmpname, path)
+        except:
+            os.unlink(tmpname)
+            raise
+
+        # The size of the cache is checked when the process starts writing to
+        # it, then each time a tenth of the maximum size has been written
+        self._lock.acquire()
+        try:
+            if self._written is not None:
+                self._written += len(data)
+                if self._written < self.max_size / 10:
+                    return
+            self._written = 0
+        finally:
+            self._lock.release()
+        self._cleanup()
+
+    def _cleanup(self):
+        files = self._get_files()
+        total = sum([size for path, size, mtime in files])
+        if total <= self.max_size:
+            return
+        files.sort(lambda a, b: cmp(a[2], b[2]))
+        limit = self.max_size * 8 / 10
+        removed = 0
+        for path, size, mtime in files:
+            if total <= limit:
+                break
+            try:
+                os.unlink(path)
+                removed += 1
+            except OSError:
+                pass # removed by another process
+            total -= size
+        self.log.info('Removed %d files from %s', removed, self._get_dir())
+
+    def _get_files(self):
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self._get_dir()):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                files.append((path, st.st_size, st.st_mtime))
+        return files
@@ -56,18 +56,22 @@ but it can also be the raw byte string (`str`) object, or simply
 an object that can be `read()`.
 """
 
+import md5
 import re
 from StringIO import StringIO
 
 from trac.config import IntOption, ListOption, Option
 from trac.core import *
+from trac.filecache import FileCache
 from trac.util import sorted
 from trac.util.text import to_utf8, to_unicode
 from trac.util.html import escape, Markup, Fragment, html
 
 
 __all__ = ['get_mimetype', 'is_binary', 'detect_unicode', 'Mimeview',
-           'content_to_unicode']
+           'PreviewCache', 'content_to_unicode']
+
+CHUNK_SIZE = 65536
 
 
 # Some common MIME types and their associated keywords and/or file extensions
@@ -228,6 +232,14 @@ class IHTMLPreviewRenderer(Interface):
     # support text content where Trac should expand tabs into spaces
     expand_tabs = False
 
+    # implementing classes should set this property to True if the XHTML
+    # they generate only depends on the `mimetype` and the `content`, so
+    # that it can be kept in the `PreviewCache`; if it also depends on their
+    # configuration or on the version of an external tool, they should
+    # define a `get_cache_signature()` method returning a string which
+    # identifies them, and which is part of the cache key
+    cacheable = False
+
     def get_quality_ratio(mimetype):
         """Return the level of support this renderer provides for the `content`
         of the specified MIME type. The return value must be a number between
@@ -258,6 +270,11 @@ class IHTMLPreviewAnnotator(Interface):
     """Extension point interface for components that can annotate an XHTML
     representation of file contents with additional information."""
 
+    # implementing classes should set this property to True if the markup
+    # they generate only depends on the line number and content, so that
+    # the annotated previews can be kept in the `PreviewCache`
+    cacheable = False
+
     def get_annotation_type():
         """Return a (type, label, description) tuple that defines the type of
         annotation and provides human readable names. The `type` element should
@@ -328,6 +345,12 @@ class Mimeview(Component):
     max_preview_size = IntOption('mimeviewer', 'max_preview_size', 262144,
         """Maximum file size for HTML preview. (''since 0.9'').""")
 
+    max_preview_lines = IntOption('mimeviewer', 'max_preview_lines', 5000,
+        """Maximum number of lines of a text file rendered at once in a
+        preview, the following lines being rendered on demand. Larger
+        text files are then previewed regardless of `max_preview_size`
+        (''since 0.10'').""")
+
     mime_map = ListOption('mimeviewer', 'mime_map',
         'text/x-dylan:dylan,text/x-idl:ice,text/x-ada:ads:adb',
         doc="""List of additional MIME types and keyword mappings.
@@ -393,12 +416,25 @@ class Mimeview(Component):
         for annotator in self.annotators:
             yield annotator.get_annotation_type()
 
+    def get_preview_renderers(self, mimetype):
+        """Return the `IHTMLPreviewRenderer`s able to render the given MIME
+        type, the most appropriate first."""
+        mimetype = mimetype.split(';')[0].strip()
+        candidates = []
+        for renderer in self.renderers:
+            qr = renderer.get_quality_ratio(mimetype)
+            if qr > 0:
+                candidates.append((qr, renderer))
+        candidates.sort(lambda x,y: cmp(y[0], x[0]))
+        return [renderer for qr, renderer in candidates]
+
     def render(self, req, mimetype, content, filename=None, url=None,
-               annotations=None):
+               annotations=None, offset=0):
         """Render an XHTML preview of the given `content`.
 
         `content` is the same as an `IHTMLPreviewRenderer.render`'s
-        `content` argument.
+        `content` argument.  `offset` is the number of lines preceding
+        `content` in the file, which is taken into account by the annotations.
 
         The specified `mimetype` will be used to select the most appropriate
         `IHTMLPreviewRenderer` implementation available for this MIME type.
@@ -421,18 +457,38 @@ class Mimeview(Component):
         else:
             mimetype = full_mimetype = 'text/plain' # fallback if not binary
 
-        # Determine candidate `IHTMLPreviewRenderer`s
-        candidates = []
-        for renderer in self.renderers:
-            qr = renderer.get_quality_ratio(mimetype)
-            if qr > 0:
-                candidates.append((qr, renderer))
-        candidates.sort(lambda x,y: cmp(y[0], x[0]))
+        # The annotations must be cacheable too
+        cacheable = True
+        for annotator in self.annotators:
+            if annotator.get_annotation_type()[0] in (annotations or []) and \
+                    not getattr(annotator, 'cacheable', False):
+                cacheable = False
 
         # First candidate which renders successfully wins.
         # Also, we don't want to expand tabs more than once.
         expanded_content = None
-        for qr, renderer in candidates:
+        content_hash = None
+        for renderer in self.get_preview_renderers(mimetype):
+            cache_key = None
+            if cacheable and getattr(renderer, 'cacheable', False):
+                if content_hash is None:
+                    if hasattr(content, 'read'):
+                        content = content.read(self.max_preview_size)
+                    data = content
+                    if isinstance(data, unicode):
+                        data = data.encode('utf-8')
+                    content_hash = md5.new(data).hexdigest()
+                signature = ''
+                if hasattr(renderer, 'get_cache_signature'):
+                    signature = renderer.get_cache_signature()
+                cache_key = PreviewCache(self.env).make_key(
+                    content_hash, full_mimetype, self.default_charset,
+                    renderer.__class__.__name__, signature, self.tab_width,
+                    annotations, offset)
+                try:
+                    return Markup(PreviewCache(self.env).load(cache_key))
+                except KeyError:
+                    pass
             try:
                 self.log.debug('Trying to render HTML preview using %s'
                                % renderer.__class__.__name__)
@@ -449,23 +505,78 @@ class Mimeview(Component):
                 if not result:
                     continue
                 elif isinstance(result, Fragment):
-                    return result
+                    output = result
                 elif isinstance(result, basestring):
-                    return Markup(to_unicode(result))
+                    output = Markup(to_unicode(result))
                 elif annotations:
-                    return Markup(self._annotate(result, annotations))
+                    output = Markup(self._annotate(result, annotations,
+                                                   offset))
                 else:
                     buf = StringIO()
                     buf.write('<div class="code"><pre>')
                     for line in result:
                         buf.write(line + '\n')
                     buf.write('</pre></div>')
-                    return Markup(buf.getvalue())
+                    output = Markup(buf.getvalue())
+                if cache_key:
+                    PreviewCache(self.env).store(cache_key, unicode(output))
+                return output
             except Exception, e:
                 self.log.warning('HTML preview using %s failed (%s)'
                                  % (renderer, e), exc_info=True)
 
-    def _annotate(self, lines, annotations):
+    def _page_to_hdf(self, req, chunk, content, mimetype, filename, url,
+                     annotations, offset, page_href):
+        offset = max(offset, 0)
+        before = [] # the lines of the page preceding the current one
+        before_size = 0
+        lines = []
+        size = 0
+        more = False
+        num = 0
+        for line in _read_lines(chunk, content, self.max_preview_size):
+            num += 1
+            if num <= offset:
+                before.append(line)
+                before_size += len(line)
+                while len(before) > 1 and \
+                        (0 < self.max_preview_lines < len(before) or
+                         before_size > self.max_preview_size):
+                    before_size -= len(before.pop(0))
+                continue
+            if lines and (0 < self.max_preview_lines <= len(lines) or
+                          size + len(line) > self.max_preview_size):
+                more = True
+                break
+            lines.append(line)
+            size += len(line)
+        offset = min(offset, num)
+        if offset and len(before) == offset and not more and \
+                (self.max_preview_lines <= 0 or
+                 offset + len(lines) <= self.max_preview_lines) and \
+                before_size + size <= self.max_preview_size:
+            # The whole file fits in a single page
+            lines = before + lines
+            offset = 0
+        end = offset + len(lines)
+        preview = self.render(req, mimetype, ''.join(lines), filename, url,
+                              annotations, offset)
+        info = {'preview': preview, 'raw_href': url, 'offset': offset}
+        if offset or more:
+            links = []
+            if offset:
+                # The previous page ends right before the current one
+                links.append(html.A('Previous lines',
+                                    href=page_href(offset - len(before))))
+            if more:
+                info['more_href'] = page_href(end)
+                links.append(html.A('Following lines', href=page_href(end)))
+            info['preview'] = html(preview, html.P(class_='preview-pages')(
+                'Lines %d to %d of the file are shown. ' % (offset + 1, end),
+                links[0], links[1:] and [' | ', links[1]] or []))
+        return info
+
+    def _annotate(self, lines, annotations, offset=0):
         buf = StringIO()
         buf.write('<table class="code"><thead><tr>')
         annotators = []
@@ -490,7 +601,8 @@ class Mimeview(Component):
         for num, line in enumerate(_html_splitlines(lines)):
             cells = []
             for annotator in annotators:
-                cells.append(annotator.annotate_line(num + 1, line))
+                cells.append(annotator.annotate_line(offset + num + 1,
+                                                     line))
             cells.append('<td>%s</td>\n' % space_re.sub(htmlify, line))
             buf.write('<tr>' + '\n'.join(cells) + '</tr>')
         else:
@@ -581,11 +693,26 @@ class Mimeview(Component):
         return types
     
     def preview_to_hdf(self, req, content, length, mimetype, filename,
-                       url=None, annotations=None):
+                       url=None, annotations=None, offset=0, page_href=None):
         """Prepares a rendered preview of the given `content`.
 
         Note: `content` will usually be an object with a `read` method.
-        """        
+
+        If `page_href` is given, text files are rendered by pages of at most
+        `max_preview_lines` lines, starting after the first `offset` lines,
+        and only the current page is read into memory.  `page_href(offset)`
+        must return the URL of the page starting after `offset` lines, for
+        the links to the other pages.
+        """
+        if page_href:
+            if not hasattr(content, 'read'):
+                content = StringIO(content)
+            chunk = content.read(CHUNK_SIZE)
+            if not is_binary(chunk):
+                return self._page_to_hdf(req, chunk, content, mimetype,
+                                         filename, url, annotations, offset,
+                                         page_href)
+            content = _ChunkedContent(chunk, content)
         if length >= self.max_preview_size:
             return {'max_file_size_reached': True,
                     'max_file_size': self.max_preview_size,
@@ -611,6 +738,69 @@ class Mimeview(Component):
         raise RequestDone        
         
 
+def _read_lines(chunk, fileobj, maxlen):
+    """Generate the lines (with their end of line) of the content made of
+    `chunk` followed by the remainder of `fileobj`, read by chunks.
+
+    Lines longer than `maxlen` are split.
+    """
+    pending = chunk
+    while 1:
+        chunk = fileobj.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        lines = (pending + chunk).splitlines(True)
+        # The last line may continue in the next chunk
+        pending = lines.pop()
+        if len(pending) > maxlen:
+            lines.append(pending)
+            pending = ''
+        for line in lines:
+            yield line
+    for line in pending.splitlines(True):
+        yield line
+
+
+class _ChunkedContent(object):
+    """File-like object returning `chunk` before the remainder of
+    `fileobj`."""
+
+    def __init__(self, chunk, fileobj):
+        self.chunk = chunk
+        self.fileobj = fileobj
+
+    def read(self, size=-1):
+        chunk, self.chunk = self.chunk, ''
+        if size < 0:
+            return chunk + self.fileobj.read()
+        if len(chunk) < size:
+            chunk += self.fileobj.read(size - len(chunk))
+        elif len(chunk) > size:
+            chunk, self.chunk = chunk[:size], chunk[size:]
+        return chunk
+
+
+class PreviewCache(FileCache):
+    """Keep the XHTML previews rendered by `Mimeview` on disk.
+
+    Syntax highlighters such as Enscript or PHP run an external process for
+    each preview, but their output only depends on the content and on the
+    way it is rendered.  The previews generated by the renderers flagged as
+    `cacheable` are stored under a hash of the content, the MIME type, the
+    `[trac] default_charset` used to decode the content, the renderer and its
+    signature, the tab width and the annotations.  Only previews with
+    `cacheable` annotators are kept.
+    """
+
+    cache_dir = Option('mimeviewer', 'preview_cache_dir', 'cache/preview',
+        """Directory where the rendered previews of files are cached,
+        relative to the environment directory (''since 0.10'').""")
+
+    max_size = IntOption('mimeviewer', 'preview_cache_size', 20000000,
+        """Maximum total size in bytes of the cached previews, `0` disables
+        the cache (''since 0.10'').""")
+
+
 def _html_splitlines(lines):
     """Tracks open and close tags in lines of HTML text and yields lines that
     have no tags spanning more than one line."""
@@ -650,6 +840,8 @@ class LineNumberAnnotator(Component):
     """Text annotator that adds a column with line numbers."""
     implements(IHTMLPreviewAnnotator)
 
+    cacheable = True
+
     # ITextAnnotator methods
 
     def get_annotation_type(self):
@@ -669,6 +861,7 @@ class PlainTextRenderer(Component):
     implements(IHTMLPreviewRenderer)
 
     expand_tabs = True
+    cacheable = True
 
     TREAT_AS_BINARY = [
         'application/pdf',
@@ -15,11 +15,13 @@
 #
 # Author: Daniel Lundin <daniel@edgewall.com>
 
-from trac.config import Option, ListOption
+import threading
+
+from trac.config import IntOption, Option, ListOption
 from trac.core import *
 from trac.mimeview.api import IHTMLPreviewRenderer, Mimeview
-from trac.util import NaivePopen
 from trac.util.html import escape, Deuglifier
+from trac.util.workers import run_command
 
 __all__ = ['EnscriptRenderer']
 
@@ -98,6 +100,7 @@ class EnscriptRenderer(Component):
     implements(IHTMLPreviewRenderer)
 
     expand_tabs = True
+    cacheable = True
 
     path = Option('mimeviewer', 'enscript_path', 'enscript',
         """Path to the Enscript executable.""")
@@ -114,8 +117,18 @@ class EnscriptRenderer(Component):
         quality ratio used by the Enscript render, which is 2
         (''since 0.10'').""")
 
+    max_workers = IntOption('mimeviewer', 'enscript_workers', 2,
+        """Maximum number of Enscript processes running at once
+        (''since 0.10'').""")
+
+    timeout = IntOption('mimeviewer', 'enscript_timeout', 10,
+        """Number of seconds after which an Enscript process is killed, and
+        the file rendered as plain text instead (''since 0.10'').""")
+
     def __init__(self):
         self._types = None
+        self._semaphore = threading.BoundedSemaphore(max(self.max_workers,
+                                                         1))
 
     # IHTMLPreviewRenderer methods
 
@@ -128,6 +141,9 @@ class EnscriptRenderer(Component):
                 Mimeview(self.env).configured_modes_mapping('enscript'))
         return self._types.get(mimetype, (None, 0))[1]
 
+    def get_cache_signature(self):
+        return '%s %s' % (self.path, ','.join(self.enscript_modes))
+
     def render(self, req, mimetype, content, filename=None, rev=None):
         cmdline = self.path
         mimetype = mimetype.split(';', 1)[0] # strip off charset
@@ -135,12 +151,18 @@ class EnscriptRenderer(Component):
         cmdline += ' --color -h -q --language=html -p - -E%s' % mode
         self.env.log.debug("Enscript command line: %s" % cmdline)
 
-        np = NaivePopen(cmdline, content.encode('utf-8'), capturestderr=1)
-        if np.errorlevel or np.err:
-            err = 'Running (%s) failed: %s, %s.' % (cmdline, np.errorlevel,
-                                                    np.err)
+        # Enscript can't serve several requests, so it is run once for each
+        # preview, but the number of processes and their duration are bounded
+        self._semaphore.acquire()
+        try:
+            errorlevel, odata, err = run_command(cmdline,
+                                                 content.encode('utf-8'),
+                                                 self.timeout)
+        finally:
+            self._semaphore.release()
+        if errorlevel or err:
+            err = 'Running (%s) failed: %s, %s.' % (cmdline, errorlevel, err)
             raise Exception, err
-        odata = np.out
 
         # Strip header and footer
         i = odata.find('<PRE>')
@@ -20,16 +20,32 @@ import os
 import re
 
 from trac.core import *
-from trac.config import Option
+from trac.config import IntOption, Option
 from trac.mimeview.api import IHTMLPreviewRenderer, content_to_unicode
-from trac.util import NaivePopen
 from trac.util.html import Deuglifier
+from trac.util.workers import WorkerPool, PERSISTENT_WORKERS
 
 __all__ = ['PHPRenderer']
 
 php_types = ('text/x-php', 'application/x-httpd-php',
              'application/x-httpd-php4', 'application/x-httpd-php1')
 
+# Highlights the sources sent by `WorkerPool` until its input is closed; the
+# output is the same as the one of `php -s` (the script is quoted for the
+# shell, so it must not contain any single quote)
+worker_script = r"""
+while (($line = fgets(STDIN)) !== false) {
+    $size = (int)$line;
+    $source = "";
+    while (strlen($source) < $size && !feof(STDIN)) {
+        $source .= fread(STDIN, $size - strlen($source));
+    }
+    $html = highlight_string($source, true);
+    fwrite(STDOUT, "0 " . strlen($html) . "\n" . $html);
+    fflush(STDOUT);
+}
+"""
+
 
 class PhpDeuglifier(Deuglifier):
 
@@ -64,9 +80,29 @@ class PHPRenderer(Component):
 
     implements(IHTMLPreviewRenderer)
 
+    cacheable = True
+
     path = Option('mimeviewer', 'php_path', 'php',
         """Path to the PHP executable (''since 0.9'').""")
 
+    max_workers = IntOption('mimeviewer', 'php_workers', 2,
+        """Maximum number of PHP processes highlighting files at once; they
+        are kept running between requests where possible
+        (''since 0.10'').""")
+
+    timeout = IntOption('mimeviewer', 'php_timeout', 10,
+        """Number of seconds after which a PHP process is killed, and the
+        file rendered as plain text instead (''since 0.10'').""")
+
+    def __init__(self):
+        # -n to ignore php.ini so we're using default colors
+        if PERSISTENT_WORKERS:
+            cmdline = "%s -n -r '%s'" % (self.path, worker_script)
+        else:
+            cmdline = '%s -sn' % self.path
+        self._pool = WorkerPool(cmdline, self.max_workers, self.timeout,
+                                persistent=PERSISTENT_WORKERS)
+
     # IHTMLPreviewRenderer methods
 
     def get_quality_ratio(self, mimetype):
@@ -74,21 +110,21 @@ class PHPRenderer(Component):
             return 4
         return 0
 
+    def get_cache_signature(self):
+        return self._pool.command
+
     def render(self, req, mimetype, content, filename=None, rev=None):
-        # -n to ignore php.ini so we're using default colors
-        cmdline = '%s -sn' % self.path
+        cmdline = self._pool.command
         self.env.log.debug("PHP command line: %s" % cmdline)
 
         content = content_to_unicode(self.env, content, mimetype)
         content = content.encode('utf-8')
-        np = NaivePopen(cmdline, content, capturestderr=1)
-        if (os.name != 'nt' and np.errorlevel) or np.err:
-            msg = 'Running (%s) failed: %s, %s.' % (cmdline,
-                                                    np.errorlevel,
-                                                    np.err)
+        errorlevel, out, err = self._pool.run(content)
+        if (os.name != 'nt' and errorlevel) or err:
+            msg = 'Running (%s) failed: %s, %s.' % (cmdline, errorlevel, err)
             raise Exception(msg)
 
-        odata = ''.join(np.out.splitlines()[1:-1])
+        odata = ''.join(out.splitlines()[1:-1])
         if odata.startswith('X-Powered-By:') or \
                 odata.startswith('Content-type:'):
             raise TracError('You appear to be using the PHP CGI '
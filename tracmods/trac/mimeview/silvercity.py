@@ -76,6 +76,7 @@ class SilverCityRenderer(Component):
         (''since 0.10'').""")
 
     expand_tabs = True
+    cacheable = True
 
     def __init__(self):
         self._types = None
@@ -89,6 +90,14 @@ class SilverCityRenderer(Component):
                 Mimeview(self.env).configured_modes_mapping('silvercity'))
         return self._types.get(mimetype, (None, 0))[1]
 
+    def get_cache_signature(self):
+        try:
+            import SilverCity
+        except ImportError:
+            return ''
+        return '%s %s' % (getattr(SilverCity, '__version__', ''),
+                          ','.join(self.silvercity_modes))
+
     def render(self, req, mimetype, content, filename=None, rev=None):
         import SilverCity
         try:
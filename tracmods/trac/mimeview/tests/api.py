@@ -11,12 +11,16 @@
 # individuals. For the exact contribution history, see the revision
 # history and logs, available at http://trac.edgewall.org/log/.
 
+import shutil
+from StringIO import StringIO
+import tempfile
 import unittest
 
 from trac.core import *
 from trac.test import EnvironmentStub
 from trac.mimeview.api import get_mimetype, _html_splitlines, \
-                              Mimeview, IContentConverter
+                              Mimeview, IContentConverter, \
+                              IHTMLPreviewRenderer, LineNumberAnnotator
 
 class GetMimeTypeTestCase(unittest.TestCase):
 
@@ -108,10 +112,165 @@ class MimeviewTestCase(unittest.TestCase):
         self.assertEqual(Converter1(self.env), conversions[1][-1])
         self.assertEqual(Converter2(self.env), conversions[2][-1])
 
+
+class CountingRenderer(Component):
+    implements(IHTMLPreviewRenderer)
+    calls = 0
+    def get_quality_ratio(self, mimetype):
+        if mimetype in ('text/x-counted', 'text/x-uncached'):
+            return 9
+        return 0
+    def render(self, req, mimetype, content, filename=None, url=None):
+        self.calls += 1
+        return content.splitlines()
+
+class CacheableRenderer(CountingRenderer):
+    cacheable = True
+    def get_quality_ratio(self, mimetype):
+        if mimetype == 'text/x-counted':
+            return 10
+        return 0
+
+class PreviewCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.path = tempfile.mkdtemp()
+        self.mimeview = Mimeview(self.env)
+        self.renderer = CacheableRenderer(self.env)
+        self.renderer.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.env.path)
+
+    def test_cached_preview(self):
+        preview = self.mimeview.render(None, 'text/x-counted', 'a\nb',
+                                       annotations=['lineno'])
+        self.assert_('<th id="L2">' in preview)
+        self.assertEqual(preview, self.mimeview.render(None, 'text/x-counted',
+                                                       'a\nb',
+                                                       annotations=['lineno']))
+        self.assertEqual(1, self.renderer.calls)
+        self.mimeview.render(None, 'text/x-counted', 'a\nb')
+        self.mimeview.render(None, 'text/x-counted', 'a\nc',
+                             annotations=['lineno'])
+        self.assertEqual(3, self.renderer.calls)
+
+    def test_uncacheable_renderer(self):
+        renderer = CountingRenderer(self.env)
+        renderer.calls = 0
+        self.mimeview.render(None, 'text/x-uncached', 'a\nb')
+        self.mimeview.render(None, 'text/x-uncached', 'a\nb')
+        self.assertEqual(2, renderer.calls)
+
+    def test_renderer_signature(self):
+        self.renderer.get_cache_signature = lambda: 'version 1'
+        self.mimeview.render(None, 'text/x-counted', 'a\nb')
+        self.mimeview.render(None, 'text/x-counted', 'a\nb')
+        self.assertEqual(1, self.renderer.calls)
+        self.renderer.get_cache_signature = lambda: 'version 2'
+        self.mimeview.render(None, 'text/x-counted', 'a\nb')
+        self.assertEqual(2, self.renderer.calls)
+
+    def test_default_charset(self):
+        self.mimeview.render(None, 'text/x-counted', 'a\nb')
+        self.mimeview.render(None, 'text/x-counted', 'a\nb')
+        self.assertEqual(1, self.renderer.calls)
+        self.env.config.set('trac', 'default_charset', 'cp1252')
+        self.mimeview.render(None, 'text/x-counted', 'a\nb')
+        self.assertEqual(2, self.renderer.calls)
+
+    def test_uncacheable_annotator(self):
+        LineNumberAnnotator(self.env).cacheable = False
+        self.mimeview.render(None, 'text/x-counted', 'a\nb',
+                             annotations=['lineno'])
+        self.mimeview.render(None, 'text/x-counted', 'a\nb',
+                             annotations=['lineno'])
+        self.assertEqual(2, self.renderer.calls)
+
+    def test_disabled(self):
+        self.env.config.set('mimeviewer', 'preview_cache_size', 0)
+        self.mimeview.render(None, 'text/x-counted', 'a\nb')
+        self.mimeview.render(None, 'text/x-counted', 'a\nb')
+        self.assertEqual(2, self.renderer.calls)
+
+class PreviewPagesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.env.config.set('mimeviewer', 'preview_cache_size', 0)
+        self.env.config.set('mimeviewer', 'max_preview_lines', 3)
+        self.mimeview = Mimeview(self.env)
+
+    def _preview(self, content, offset=0):
+        return self.mimeview.preview_to_hdf(
+            None, StringIO(content), len(content), 'text/plain', 'README',
+            annotations=['lineno'], offset=offset,
+            page_href=lambda offset: '/README?offset=%d' % offset)
+
+    def test_first_page(self):
+        info = self._preview('a\nb\nc\nd\ne\n')
+        preview = unicode(info['preview'])
+        self.assert_('<th id="L3">' in preview)
+        self.assert_('<th id="L4">' not in preview)
+        self.assert_('<td>d</td>' not in preview)
+        self.assertEqual('/README?offset=3', info['more_href'])
+
+    def test_next_page(self):
+        info = self._preview('a\nb\nc\nd\ne\n', 3)
+        preview = unicode(info['preview'])
+        self.assert_('<th id="L4">' in preview)
+        self.assert_('<td>e</td>' in preview)
+        self.assert_('<th id="L3">' not in preview)
+        self.assert_('/README?offset=0' in preview)
+        self.assertEqual(None, info.get('more_href'))
+
+    def test_single_page(self):
+        info = self._preview('a\nb\n')
+        self.assert_('<th id="L2">' in info['preview'])
+        self.assert_('offset' not in unicode(info['preview']))
+
+    def test_large_file(self):
+        content = 'line\n' * 100000
+        info = self._preview(content)
+        self.assert_('<th id="L3">' in unicode(info['preview']))
+        self.assertEqual('/README?offset=3', info['more_href'])
+
+    def test_pages_limited_in_size(self):
+        self.env.config.set('mimeviewer', 'max_preview_size', 4)
+        info = self._preview('a\nb\nc\nd\ne\n')
+        self.assert_('<th id="L2">' in unicode(info['preview']))
+        self.assert_('<th id="L3">' not in unicode(info['preview']))
+        self.assertEqual('/README?offset=2', info['more_href'])
+        info = self._preview('a\nb\nc\nd\ne\n', 4)
+        self.assert_('<th id="L5">' in unicode(info['preview']))
+        # the previous page ends before the current one
+        self.assert_('/README?offset=2' in unicode(info['preview']))
+
+    def test_page_at_line(self):
+        info = self._preview('a\nb\nc\nd\ne\n', 1)
+        preview = unicode(info['preview'])
+        self.assert_('<th id="L2">' in preview)
+        self.assert_('<th id="L4">' in preview)
+        self.assert_('<th id="L1">' not in preview)
+        self.assert_('/README?offset=0' in preview)
+        self.assertEqual('/README?offset=4', info['more_href'])
+        # a file fitting in a page is shown from the start
+        info = self._preview('a\nb\n', 1)
+        self.assert_('<th id="L1">' in info['preview'])
+        self.assert_('offset' not in unicode(info['preview']))
+
+    def test_binary(self):
+        info = self._preview('\0\1' * 200000)
+        self.assertEqual(True, info['max_file_size_reached'])
+
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(GetMimeTypeTestCase, 'test'))
     suite.addTest(unittest.makeSuite(MimeviewTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(PreviewCacheTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(PreviewPagesTestCase, 'test'))
     return suite
 
 if __name__ == '__main__':
@@ -26,11 +26,20 @@ class TextileRenderer(Component):
     """Renders plain text in Textile format as HTML."""
     implements(IHTMLPreviewRenderer)
 
+    cacheable = True
+
     def get_quality_ratio(self, mimetype):
         if mimetype == 'text/x-textile':
             return 8
         return 0
 
+    def get_cache_signature(self):
+        try:
+            import textile
+        except ImportError:
+            return ''
+        return getattr(textile, '__version__', '')
+
     def render(self, req, mimetype, content, filename=None, rev=None):
         import textile
         return textile.textile(content.encode('utf-8'), encoding='utf-8')
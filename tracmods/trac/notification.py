@@ -15,7 +15,9 @@
 
 import time
 import smtplib
+import socket
 import re
+import threading
 
 from trac import __version__
 from trac.config import BoolOption, IntOption, Option
@@ -93,6 +95,260 @@ class NotificationSystem(Component):
         If no prefix is desired, then specifying an empty option 
         will disable it.(''since 0.10.1'').""")
 
+    smtp_queue = BoolOption('notification', 'smtp_queue', 'false',
+        """Store notification emails in the `notify_queue` table instead of
+        sending them while the request is being processed. They are delivered
+        by a background thread or by `trac-admin notify worker`
+        (''since 0.10'').""")
+
+    smtp_queue_thread = BoolOption('notification', 'smtp_queue_thread', 'true',
+        """Deliver queued emails from a background thread of the process
+        which queued them. Disable this when the emails are delivered by
+        `trac-admin notify worker`, e.g. with CGI (''since 0.10'').""")
+
+    smtp_batch_size = IntOption('notification', 'smtp_batch_size', 50,
+        """Maximum number of recipients of a single queued email; emails
+        with more recipients are split in several deliveries
+        (''since 0.10'').""")
+
+    smtp_max_attempts = IntOption('notification', 'smtp_max_attempts', 5,
+        """Number of failed delivery attempts after which a queued email is
+        left in the queue for inspection (''since 0.10'').""")
+
+    smtp_retry_delay = IntOption('notification', 'smtp_retry_delay', 60,
+        """Delay in seconds before retrying the delivery of a queued email,
+        doubled after each failed attempt (''since 0.10'').""")
+
+
+class SMTPConnection(object):
+    """Connection to the SMTP server configured in the `[notification]`
+    section, with optional STARTTLS and authentication."""
+
+    def __init__(self, env):
+        config = env.config
+        self.server = None
+        self.smtp_server = config.get('notification', 'smtp_server')
+        self.smtp_port = config.getint('notification', 'smtp_port')
+        self.user_name = config.get('notification', 'smtp_user')
+        self.password = config.get('notification', 'smtp_password')
+        self.use_tls = config.getbool('notification', 'use_tls')
+
+    def open(self):
+        self.server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+        # self.server.set_debuglevel(True)
+        if self.use_tls:
+            self.server.ehlo()
+            if not self.server.esmtp_features.has_key('starttls'):
+                raise TracError, "TLS enabled but server does not support TLS"
+            self.server.starttls()
+            self.server.ehlo()
+        if self.user_name:
+            self.server.login(self.user_name, self.password)
+
+    def sendmail(self, from_addr, recipients, msgtext):
+        self.server.sendmail(from_addr, recipients, msgtext)
+
+    def close(self):
+        if not self.server:
+            return
+        server, self.server = self.server, None
+        if self.use_tls:
+            # avoid false failure detection when the server closes
+            # the SMTP connection with TLS enabled
+            try:
+                server.quit()
+            except socket.sslerror:
+                pass
+        else:
+            server.quit()
+
+
+class NotificationQueue(Component):
+    """Queue of the notification emails waiting to be delivered.
+
+    Emails are queued by `NotifyEmail` when `[notification] smtp_queue` is
+    enabled, with at most `smtp_batch_size` recipients each.  `process()`
+    delivers the due emails over a single SMTP connection.  The emails
+    which can't be delivered are retried later, with an exponential backoff.
+
+    Several processes may deliver the emails of the same queue: each email
+    is claimed before being sent, by moving its `next_attempt` time
+    `lease_time` seconds ahead.
+    """
+
+    lease_time = 600 # seconds
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+
+    def enqueue(self, sender, recipients, message, db=None):
+        """Add an email to the queue, and wake up the delivery thread if
+        it is enabled."""
+        handle_ta = not db
+        if not db:
+            db = self.env.get_db_cnx()
+        now = int(time.time())
+        batch_size = max(1, self.config.getint('notification',
+                                               'smtp_batch_size'))
+        cursor = db.cursor()
+        cursor.executemany("INSERT INTO notify_queue (time,next_attempt,"
+                           "attempts,sender,recipients,message) "
+                           "VALUES (%s,%s,0,%s,%s,%s)",
+                           [(now, now, sender,
+                             ' '.join(recipients[i:i + batch_size]), message)
+                            for i in range(0, len(recipients), batch_size)])
+        if handle_ta:
+            db.commit()
+            if self.config.getbool('notification', 'smtp_queue_thread'):
+                self.start_thread()
+
+    def process(self, limit=None):
+        """Deliver the emails of the queue which are due, and return the
+        numbers of delivered and failed emails."""
+        db = self.env.get_db_cnx()
+        cursor = db.cursor()
+        sql = "SELECT id,next_attempt,sender,recipients,message,attempts " \
+              "FROM notify_queue WHERE next_attempt<=%s AND attempts<%s " \
+              "ORDER BY id"
+        args = [int(time.time()),
+                self.config.getint('notification', 'smtp_max_attempts')]
+        if limit:
+            sql += " LIMIT %s"
+            args.append(limit)
+        cursor.execute(sql, args)
+        emails = cursor.fetchall()
+
+        sent = failed = 0
+        connection = SMTPConnection(self.env)
+        try:
+            for id, next_attempt, sender, recipients, message, attempts \
+                    in emails:
+                if not self._claim(db, id, next_attempt):
+                    continue
+                try:
+                    if not connection.server:
+                        connection.open()
+                    connection.sendmail(sender, recipients.split(), message)
+                except (smtplib.SMTPException, socket.error, TracError), e:
+                    self.log.warning('Delivery of queued email %s failed: %s',
+                                     id, e)
+                    self._defer(db, id, attempts, e)
+                    failed += 1
+                    # Reconnect for the next email, the connection may be lost
+                    try:
+                        connection.close()
+                    except (smtplib.SMTPException, socket.error):
+                        connection.server = None
+                else:
+                    cursor = db.cursor()
+                    cursor.execute("DELETE FROM notify_queue WHERE id=%s",
+                                   (id,))
+                    db.commit()
+                    sent += 1
+        finally:
+            try:
+                connection.close()
+            except (smtplib.SMTPException, socket.error):
+                pass
+        if sent or failed:
+            self.log.info('Delivered %d queued emails, %d failed', sent,
+                          failed)
+        return sent, failed
+
+    def get_stats(self, db=None):
+        """Return a dictionary with the number of emails of the queue which
+        are `pending` delivery, `deferred` after a failed attempt or `failed`
+        too many times, and the time of the `oldest` one."""
+        if not db:
+            db = self.env.get_db_cnx()
+        max_attempts = self.config.getint('notification', 'smtp_max_attempts')
+        cursor = db.cursor()
+        cursor.execute("SELECT COUNT(*),MIN(time),"
+                       "SUM(CASE WHEN attempts>0 AND attempts<%s "
+                       "THEN 1 ELSE 0 END),"
+                       "SUM(CASE WHEN attempts>=%s THEN 1 ELSE 0 END) "
+                       "FROM notify_queue", (max_attempts, max_attempts))
+        total, oldest, deferred, failed = cursor.fetchone()
+        deferred, failed = int(deferred or 0), int(failed or 0)
+        return {'pending': total - deferred - failed, 'deferred': deferred,
+                'failed': failed, 'oldest': oldest}
+
+    def get_next_attempt(self, db=None):
+        """Return the time of the next delivery attempt of an email of the
+        queue, or `None` if there are no emails left to deliver."""
+        if not db:
+            db = self.env.get_db_cnx()
+        cursor = db.cursor()
+        cursor.execute("SELECT MIN(next_attempt) FROM notify_queue "
+                       "WHERE attempts<%s", (self.config.getint('notification',
+                                                'smtp_max_attempts'),))
+        row = cursor.fetchone()
+        return row and row[0]
+
+    def start_thread(self):
+        """Start the delivery thread, unless it is already running."""
+        self._lock.acquire()
+        try:
+            if self._thread and self._thread.isAlive():
+                self._thread.pending = True
+                self._wakeup.notify()
+                return
+            self._thread = threading.Thread(target=self._run)
+            self._thread.pending = False
+            self._thread.setDaemon(True)
+            self._thread.start()
+        finally:
+            self._lock.release()
+
+    # Internal methods
+
+    def _run(self):
+        thread = threading.currentThread()
+        while True:
+            next_attempt = None
+            try:
+                self.process()
+                next_attempt = self.get_next_attempt()
+            except Exception, e:
+                self.log.exception(e)
+                next_attempt = time.time() + \
+                               self.config.getint('notification',
+                                                  'smtp_retry_delay')
+            # Sleep until the next deferred email is due, or until another
+            # email is queued
+            self._lock.acquire()
+            try:
+                if not thread.pending:
+                    if next_attempt is None:
+                        self._thread = None
+                        return
+                    self._wakeup.wait(max(1, next_attempt - time.time()))
+                thread.pending = False
+            finally:
+                self._lock.release()
+
+    def _claim(self, db, id, next_attempt):
+        """Reserve the delivery of an email to this process, unless another
+        process already did."""
+        cursor = db.cursor()
+        cursor.execute("UPDATE notify_queue SET next_attempt=%s "
+                       "WHERE id=%s AND next_attempt=%s",
+                       (int(time.time()) + self.lease_time, id, next_attempt))
+        claimed = cursor.rowcount == 1
+        db.commit()
+        return claimed
+
+    def _defer(self, db, id, attempts, error):
+        delay = self.config.getint('notification', 'smtp_retry_delay')
+        cursor = db.cursor()
+        cursor.execute("UPDATE notify_queue SET attempts=%s,next_attempt=%s,"
+                       "error=%s WHERE id=%s",
+                       (attempts + 1, int(time.time()) + delay * 2 ** attempts,
+                        unicode(error), id))
+        db.commit()
+
 
 class Notify(object):
     """Generic notification class for Trac.
@@ -275,16 +531,12 @@ class NotifyEmail(Notify):
         return self.format_header(key, value)
 
     def begin_send(self):
-        self.server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-        # self.server.set_debuglevel(True)
-        if self._use_tls:
-            self.server.ehlo()
-            if not self.server.esmtp_features.has_key('starttls'):
-                raise TracError, "TLS enabled but server does not support TLS"
-            self.server.starttls()
-            self.server.ehlo()
-        if self.user_name:
-            self.server.login(self.user_name, self.password)
+        if self.config.getbool('notification', 'smtp_queue'):
+            # The emails are delivered later by the NotificationQueue
+            self.server = None
+            return
+        self.server = SMTPConnection(self.env)
+        self.server.open()
 
     def send(self, torcpts, ccrcpts, mime_headers={}):
         from email.MIMEText import MIMEText
@@ -365,16 +617,12 @@ class NotifyEmail(Notify):
         # Ensure the message complies with RFC2822: use CRLF line endings
         recrlf = re.compile("\r?\n")
         msgtext = "\r\n".join(recrlf.split(msgtext))
-        self.server.sendmail(msg['From'], recipients, msgtext)
+        if self.server:
+            self.server.sendmail(msg['From'], recipients, msgtext)
+        else:
+            NotificationQueue(self.env).enqueue(msg['From'], recipients,
+                                                msgtext)
 
     def finish_send(self):
-        if self._use_tls:
-            # avoid false failure detection when the server closes
-            # the SMTP connection with TLS enabled
-            import socket
-            try:
-                self.server.quit()
-            except socket.sslerror:
-                pass
-        else:
-            self.server.quit()
+        if self.server:
+            self.server.close()
@@ -26,7 +26,7 @@ import locale
 import trac
 from trac import perm, util, db_default
 from trac.config import default_dir
-from trac.core import TracError
+from trac.core import ExtensionPoint, Interface, TracError
 from trac.env import Environment
 from trac.perm import PermissionSystem
 from trac.ticket.model import *
@@ -64,6 +64,48 @@ def copytree(src, dst, symlinks=False, skip=[]):
         raise shutil.Error, errors
 
 
+class IAdminCommandProvider(Interface):
+    """Extension point interface for components providing additional
+    trac-admin commands."""
+
+    def get_admin_commands():
+        """Return an iterable of `(command, args, help, execute)` tuples.
+
+        `command` is the name of the command, possibly made of several words
+        like `"discussion recount"`, and `args` and `help` describe it for the
+        `help` command.  When the command is invoked, `execute` is called with
+        the remaining arguments as positional arguments.
+        """
+
+
+# `Component` is the ticket component model in this module
+class AdminCommandManager(trac.core.Component):
+    """Dispatch the trac-admin commands provided by plugins."""
+
+    providers = ExtensionPoint(IAdminCommandProvider)
+
+    def get_docs(self):
+        """Return the help of the provided commands, in the format of the
+        `TracAdmin._help_*` lists."""
+        docs = []
+        for provider in self.providers:
+            for command, args, help, execute in provider.get_admin_commands():
+                docs.append(((command + ' ' + args).strip(), help))
+        return docs
+
+    def execute_command(self, args):
+        """Execute the command matching the given argument list, and return
+        `True`, or `False` if there is no such command."""
+        for provider in self.providers:
+            for command, cmd_args, help, execute in \
+                    provider.get_admin_commands():
+                words = command.split()
+                if args[:len(words)] == words:
+                    execute(*args[len(words):])
+                    return True
+        return False
+
+
 class TracAdmin(cmd.Cmd):
     intro = ''
     license = trac.__license_long__
@@ -87,6 +129,11 @@ class TracAdmin(cmd.Cmd):
     def emptyline(self):
         pass
 
+    def default(self, line):
+        manager = self._get_command_manager()
+        if not manager or not manager.execute_command(self.arg_tokenize(line)):
+            cmd.Cmd.default(self, line)
+
     def onecmd(self, line):
         """`line` may be a `str` or an `unicode` object"""
         try:
@@ -141,6 +188,12 @@ class TracAdmin(cmd.Cmd):
     def db_open(self):
         return self.env_open().get_db_cnx()
 
+    def _get_command_manager(self):
+        if not self.__env and not (getattr(self, 'envname', None) and
+                                   self.env_check()):
+            return None
+        return AdminCommandManager(self.__env)
+
     def db_query(self, sql, cursor=None, params=None):
         if not cursor:
             cnx = self.db_open()
@@ -304,6 +357,7 @@ class TracAdmin(cmd.Cmd):
         return (cls._help_about + cls._help_help +
                 cls._help_initenv + cls._help_hotcopy +
                 cls._help_resync + cls._help_upgrade +
+                cls._help_notify + cls._help_preview +
                 cls._help_wiki +
 #               cls._help_config + cls._help_wiki +
                 cls._help_permission + cls._help_component +
@@ -320,7 +374,14 @@ class TracAdmin(cmd.Cmd):
                 doc = getattr(self, "_help_" + arg[0])
                 self.print_doc(doc)
             except AttributeError:
-                print "No documentation found for '%s'" % arg[0]
+                manager = self._get_command_manager()
+                doc = manager and [(name, text) for name, text
+                                   in manager.get_docs()
+                                   if name.split()[0] == arg[0]]
+                if doc:
+                    self.print_doc(doc)
+                else:
+                    print "No documentation found for '%s'" % arg[0]
         else:
             print 'trac-admin - The Trac Administration Console %s' \
                   % trac.__version__
@@ -330,6 +391,9 @@ class TracAdmin(cmd.Cmd):
                 print "Invoking trac-admin without command starts "\
                       "interactive mode."
             self.print_doc(self.all_docs())
+            manager = self._get_command_manager()
+            if manager:
+                self.print_doc(manager.get_docs())
 
     
     ## About / Version
@@ -681,6 +745,8 @@ Congratulations!
         cursor = cnx.cursor()
         cursor.execute("DELETE FROM revision")
         cursor.execute("DELETE FROM node_change")
+        cursor.execute("DELETE FROM node_listing")
+        cursor.execute("DELETE FROM node_history")
         cursor.executemany("DELETE FROM system WHERE name=%s",
                            [(k,) for k in CACHE_METADATA_KEYS])
         cursor.executemany("INSERT INTO system (name, value) VALUES (%s, %s)",
@@ -691,6 +757,98 @@ Congratulations!
             print cnt, 'revisions cached.',
         print 'Done.'
 
+    ## Notification
+    _help_notify = [('notify worker [once]',
+                     'Deliver the queued notification emails, until '
+                     'interrupted or once'),
+                    ('notify status',
+                     'Show the number of queued notification emails')]
+
+    _notify_poll_interval = 10 # seconds
+
+    def complete_notify(self, text, line, begidx, endidx):
+        argv = self.arg_tokenize(line)
+        argc = len(argv)
+        if line[-1] == ' ': # Space starts new argument
+            argc += 1
+        comp = []
+        if argc == 2:
+            comp = ['worker', 'status']
+        elif argc == 3 and argv[1] == 'worker':
+            comp = ['once']
+        return self.word_complete(text, comp)
+
+    def do_notify(self, line):
+        arg = self.arg_tokenize(line)
+        if arg[0] == 'worker' and arg[1:] in ([], ['once']):
+            self._do_notify_worker(len(arg) == 2)
+        elif arg[0] == 'status' and len(arg) == 1:
+            self._do_notify_status()
+        else:
+            self.do_help('notify')
+
+    def _do_notify_worker(self, once=False):
+        from trac.notification import NotificationQueue
+        queue = NotificationQueue(self.env_open())
+        try:
+            while True:
+                sent, failed = queue.process()
+                if sent or failed:
+                    print '%d emails delivered, %d failed.' % (sent, failed)
+                if once:
+                    break
+                time.sleep(self._notify_poll_interval)
+        except KeyboardInterrupt:
+            pass
+
+    def _do_notify_status(self):
+        from trac.notification import NotificationQueue
+        stats = NotificationQueue(self.env_open()).get_stats()
+        self.print_listing(['State', 'Emails'],
+                           [(state, str(stats[state])) for state
+                            in ('pending', 'deferred', 'failed')])
+        if stats['oldest']:
+            print 'Oldest email queued on %s' % \
+                  self._format_datetime(stats['oldest'])
+
+    ## Preview cache
+    _help_preview = [('preview warm <path> [rev]',
+                      'Render the previews of the repository files below '
+                      'path into the preview cache'),
+                     ('preview clear', 'Remove all the cached previews')]
+
+    def complete_preview(self, text, line, begidx, endidx):
+        argv = self.arg_tokenize(line)
+        argc = len(argv)
+        if line[-1] == ' ': # Space starts new argument
+            argc += 1
+        comp = []
+        if argc == 2:
+            comp = ['warm', 'clear']
+        return self.word_complete(text, comp)
+
+    def do_preview(self, line):
+        arg = self.arg_tokenize(line)
+        if arg[0] == 'warm' and len(arg) in (2, 3):
+            self._do_preview_warm(*arg[1:])
+        elif arg[0] == 'clear' and len(arg) == 1:
+            self._do_preview_clear()
+        else:
+            self.do_help('preview')
+
+    def _do_preview_warm(self, path, rev=None):
+        from trac.versioncontrol.web_ui.browser import BrowserModule
+        env = self.env_open()
+        repos = env.get_repository()
+        count = 0
+        for path in BrowserModule(env).warm_preview_cache(repos, path, rev):
+            count += 1
+        print '%d previews rendered.' % count
+
+    def _do_preview_clear(self):
+        from trac.mimeview.api import PreviewCache
+        PreviewCache(self.env_open()).clear()
+
     ## Wiki
     _help_wiki = [('wiki list', 'List wiki pages'),
                   ('wiki remove <name>', 'Remove wiki page'),
@@ -822,7 +980,13 @@ Congratulations!
                 self._do_wiki_import(filename, page, cursor, create_only)
 
     ## Ticket
-    _help_ticket = [('ticket remove <number>', 'Remove ticket')]
+    _help_ticket = [('ticket remove <number>', 'Remove ticket'),
+                    ('ticket import <file>',
+                     'Import tickets from a JSON-lines or CSV file (- for '
+                     'stdin)'),
+                    ('ticket export <file>',
+                     'Export tickets to a JSON-lines or CSV file (- for '
+                     'stdout)')]
 
     def complete_ticket(self, text, line, begidx, endidx):
         argv = self.arg_tokenize(line)
@@ -831,7 +995,9 @@ Congratulations!
             argc += 1
         comp = []
         if argc == 2:
-            comp = ['remove']
+            comp = ['remove', 'import', 'export']
+        elif argc == 3 and argv[1] in ('import', 'export'):
+            comp = self.get_dir_list(argv[-1])
         return self.word_complete(text, comp)
 
     def do_ticket(self, line):
@@ -843,6 +1009,10 @@ Congratulations!
                 print>>sys.stderr, "<number> must be a number"
                 return
             self._do_ticket_remove(number)
+        elif arg[0] == 'import' and len(arg)==2:
+            self._do_ticket_import(arg[1])
+        elif arg[0] == 'export' and len(arg)==2:
+            self._do_ticket_export(arg[1])
         else:    
             self.do_help ('ticket')
 
@@ -851,6 +1021,52 @@ Congratulations!
         ticket.delete()
         print "Ticket %d and all associated data removed." % number
 
+    def _do_ticket_import(self, filename):
+        from trac.ticket.bulk import TicketImporter, read_csv, read_json_lines
+        if filename == '-':
+            f = sys.stdin
+        elif not os.path.isfile(filename):
+            raise Exception, '%s is not a file' % filename
+        else:
+            f = open(filename, 'r')
+        try:
+            if filename.endswith('.csv'):
+                records = read_csv(f)
+            else:
+                records = read_json_lines(f)
+            importer = TicketImporter(self.env_open())
+            def progress(count):
+                print >> sys.stderr, '  %d tickets imported' % count
+            importer.import_tickets(records, progress)
+        finally:
+            if f is not sys.stdin:
+                f.close()
+        print >> sys.stderr, 'Imported %d tickets in %.1fs (%d tickets/s)' \
+              % (importer.count, importer.elapsed, importer.get_rate())
+
+    def _do_ticket_export(self, filename):
+        from trac.ticket.api import TicketSystem
+        from trac.ticket.bulk import export_tickets, write_csv, \
+                                     write_json_lines
+        env = self.env_open()
+        if filename == '-':
+            f = sys.stdout
+        elif os.path.isfile(filename):
+            raise Exception("File '%s' exists" % filename)
+        else:
+            f = open(filename, 'w')
+        try:
+            records = export_tickets(env)
+            if filename.endswith('.csv'):
+                fields = [field['name'] for field in
+                          TicketSystem(env).get_ticket_fields()]
+                write_csv(f, records, fields)
+            else:
+                write_json_lines(f, records)
+        finally:
+            if f is not sys.stdout:
+                f.close()
+
 
     ## (Ticket) Type
     _help_ticket_type = [('ticket_type list', 'Show possible ticket types'),
@@ -22,6 +22,7 @@ import time
 import unittest
 from StringIO import StringIO
 
+from trac.core import *
 from trac.env import Environment
 from trac.scripts import admin
 from trac.test import InMemoryDatabase, TestConfiguration
@@ -87,6 +88,16 @@ class SkipTest(Exception):
     pass
 
 
+class TestCommandProvider(Component):
+    implements(admin.IAdminCommandProvider)
+
+    def get_admin_commands(self):
+        yield ('test run', '<value>', 'Run the test command', self._do_run)
+
+    def _do_run(self, value):
+        print 'Ran with %s' % value
+
+
 class TracadminTestCase(unittest.TestCase):
     """
     Tests the output of trac-admin and is meant to be used with
@@ -969,6 +980,19 @@ Trac Admin Console %s
         self.assertEqual(2, rv)
         self.assertEqual(self.expected_results[test_name], output)
 
+    def test_plugin_command_ok(self):
+        self.env.is_component_enabled = lambda cls: True
+        rv, output = self._execute('test run foo')
+        self.assertEqual(0, rv)
+        self.assertEqual('Ran with foo\n', output)
+        rv, output = self._execute('help test')
+        self.assertEqual('test run <value>\n\t-- Run the test command\n\n',
+                         output)
+
+    def test_plugin_command_error_unknown(self):
+        rv, output = self._execute('test run foo')
+        self.assertEqual(-1, output.find('Ran with'))
+
     def test_backslash_use_ok(self):
         test_name = sys._getframe().f_code.co_name
         self._execute('version add \\')
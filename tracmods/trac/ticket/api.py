@@ -43,6 +43,18 @@ class ITicketChangeListener(Interface):
         """Called when a ticket is deleted."""
 
 
+class ITicketBatchListener(Interface):
+    """Extension point interface for components that want to be notified once
+    for a whole batch of tickets created by a bulk import, rather than once per
+    ticket.
+
+    The components implementing this interface are not notified of the
+    individual tickets of the batch through `ITicketChangeListener`."""
+
+    def tickets_created(tickets):
+        """Called after a batch of tickets has been imported and committed."""
+
+
 class ITicketManipulator(Interface):
     """Miscellaneous manipulation of ticket workflow features."""
 
@@ -62,6 +74,7 @@ class TicketSystem(Component):
     implements(IPermissionRequestor, IWikiSyntaxProvider, ISearchSource)
 
     change_listeners = ExtensionPoint(ITicketChangeListener)
+    batch_listeners = ExtensionPoint(ITicketBatchListener)
 
     restrict_owner = BoolOption('ticket', 'restrict_owner', 'false',
         """Make the owner field of tickets use a drop-down menu. See
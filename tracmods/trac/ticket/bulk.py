@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2006 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+"""Bulk import and export of tickets.
+
+Tickets are exchanged as dictionaries holding the values of the ticket fields,
+plus the `id`, `time` and `changetime` of the ticket and, optionally, its
+`changes` as a list of `[time, author, field, oldvalue, newvalue]` lists.
+
+Two file formats are supported: JSON-lines, with one JSON object per ticket,
+and CSV, with one row per ticket (the CSV format doesn't include the ticket
+changes).
+"""
+
+import cPickle
+import csv
+import tempfile
+import time
+
+from trac.core import TracError
+from trac.ticket.api import TicketSystem
+from trac.ticket.model import Ticket, invalidate_milestone_stats
+from trac.ticket.pivot import CustomFieldPivot
+
+try:
+    import json
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        json = None
+
+__all__ = ['TicketImporter', 'export_tickets', 'read_csv', 'read_json_lines',
+           'write_csv', 'write_json_lines']
+
+
+class TicketImporter(object):
+    """Insert tickets into the database in batches.
+
+    Unlike `Ticket.insert()`, which commits each ticket on its own, the
+    tickets are written with `executemany` in one transaction per batch of
+    `batch_size` tickets.  The change listeners are notified once a batch
+    has been committed, through `ITicketBatchListener.tickets_created()` for
+    the listeners supporting it.
+    """
+
+    def __init__(self, env, batch_size=1000):
+        self.env = env
+        self.batch_size = batch_size
+        self.fields = TicketSystem(env).get_ticket_fields()
+        self.std_fields = [f['name'] for f in self.fields if not f.get('custom')]
+        self.custom_fields = [f['name'] for f in self.fields if f.get('custom')]
+        self.count = 0
+        self.elapsed = 0
+
+    def import_tickets(self, records, progress=None):
+        """Import the tickets described by the `records` dictionaries.
+
+        Tickets without an `id` are numbered after the highest existing
+        ticket number.  The records are read once to collect their ids and
+        are spooled to a temporary file, from which they are imported, so
+        that they are never all held in memory.  A `TracError` listing the
+        conflicting ids is raised without importing anything if an `id` is
+        used by an existing ticket or by several records.  If given,
+        `progress` is called with the number of tickets imported so far after
+        each batch.  Returns the number of imported tickets.
+        """
+        start = time.time()
+        db = self.env.get_db_cnx()
+        spool = tempfile.TemporaryFile()
+        try:
+            ids = self._spool_records(db, records, spool)
+            spool.seek(0)
+            self._import_records(db, _load_records(spool), ids, progress)
+        finally:
+            spool.close()
+        self.elapsed += time.time() - start
+        return self.count
+
+    def get_rate(self):
+        """Return the number of tickets imported per second."""
+        return self.count / max(self.elapsed, 0.001)
+
+    # Internal methods
+
+    def _spool_records(self, db, records, spool):
+        ids = {}
+        duplicates = {}
+        for record in records:
+            tkt_id = record.get('id')
+            if tkt_id:
+                tkt_id = int(tkt_id)
+                if tkt_id in ids:
+                    duplicates[tkt_id] = True
+                ids[tkt_id] = True
+            cPickle.dump(record, spool, cPickle.HIGHEST_PROTOCOL)
+        errors = []
+        if duplicates:
+            errors.append('Duplicate ticket ids in the imported tickets: %s'
+                          % _format_ids(duplicates.keys()))
+        existing = self._get_existing_ids(db, ids.keys())
+        if existing:
+            errors.append('Tickets already in the database: %s'
+                          % _format_ids(existing))
+        if errors:
+            raise TracError('. '.join(errors), 'Conflicting Ticket Ids')
+        return ids
+
+    def _import_records(self, db, records, ids, progress):
+        cursor = db.cursor()
+        cursor.execute("SELECT MAX(id) FROM ticket")
+        next_id = (cursor.fetchone()[0] or 0) + 1
+
+        batch = []
+        for record in records:
+            tkt_id = record.get('id')
+            if tkt_id:
+                tkt_id = int(tkt_id)
+            else:
+                while next_id in ids:
+                    next_id += 1
+                tkt_id = next_id
+            next_id = max(next_id, tkt_id + 1)
+            batch.append((tkt_id, record))
+            if len(batch) >= self.batch_size:
+                self._insert_batch(db, batch)
+                batch = []
+                if progress:
+                    progress(self.count)
+        if batch:
+            self._insert_batch(db, batch)
+            if progress:
+                progress(self.count)
+
+        cursor = db.cursor()
+        db.update_sequence(cursor, 'ticket')
+        db.commit()
+
+    def _get_existing_ids(self, db, ids):
+        existing = []
+        cursor = db.cursor()
+        for i in xrange(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            cursor.execute("SELECT id FROM ticket WHERE id IN (%s)"
+                           % ','.join(['%s'] * len(chunk)), chunk)
+            existing += [int(row[0]) for row in cursor]
+        return existing
+
+    def _insert_batch(self, db, batch):
+        now = int(time.time())
+        created_tickets, tickets, custom, changes = [], [], [], []
+        for tkt_id, record in batch:
+            values = {}
+            for name in self.std_fields + self.custom_fields:
+                if record.get(name) is not None:
+                    values[name] = record[name]
+            created = int(record.get('time') or now)
+            changed = int(record.get('changetime') or created)
+            tickets.append([tkt_id] + [values.get(name)
+                                       for name in self.std_fields] +
+                           [created, changed])
+            custom += [(tkt_id, name, values[name])
+                       for name in self.custom_fields if name in values]
+            changes += [[tkt_id] + list(change)
+                        for change in record.get('changes') or []]
+
+            ticket = Ticket.__new__(Ticket)
+            ticket.env, ticket.fields = self.env, self.fields
+            ticket.id, ticket.values, ticket._old = tkt_id, values, {}
+            ticket.time_created, ticket.time_changed = created, changed
+            created_tickets.append(ticket)
+
+        cursor = db.cursor()
+        cursor.executemany("INSERT INTO ticket (id,%s,time,changetime) "
+                           "VALUES (%s)" % (','.join(self.std_fields),
+                           ','.join(['%s'] * (len(self.std_fields) + 3))),
+                           tickets)
+        if custom:
+            cursor.executemany("INSERT INTO ticket_custom (ticket,name,value) "
+                               "VALUES (%s,%s,%s)", custom)
+        if changes:
+            cursor.executemany("INSERT INTO ticket_change "
+                               "(ticket,time,author,field,oldvalue,newvalue) "
+                               "VALUES (%s,%s,%s,%s,%s,%s)", changes)
+        CustomFieldPivot(self.env).update_tickets(db, [(t.id, t.values) for t
+                                                       in created_tickets])
+        invalidate_milestone_stats(db, [t.values.get('milestone') for t
+                                        in created_tickets])
+        db.commit()
+        self.count += len(created_tickets)
+
+        # Notify the listeners once the batch is safely committed
+        ticket_system = TicketSystem(self.env)
+        batch_listeners = ticket_system.batch_listeners
+        for listener in batch_listeners:
+            listener.tickets_created(created_tickets)
+        for listener in ticket_system.change_listeners:
+            if listener not in batch_listeners:
+                for ticket in created_tickets:
+                    listener.ticket_created(ticket)
+
+
+def export_tickets(env, db=None):
+    """Generate a dictionary for each ticket in the database, in the format
+    expected by `TicketImporter`.
+
+    The tickets, their custom fields and their changes are read with one
+    query each, so that the whole ticket table is never held in memory.
+    """
+    if not db:
+        db = env.get_db_cnx()
+    fields = TicketSystem(env).get_ticket_fields()
+    std_fields = [f['name'] for f in fields if not f.get('custom')]
+    custom_fields = [f['name'] for f in fields if f.get('custom')]
+
+    cursor = db.cursor()
+    cursor.execute("SELECT id,%s,time,changetime FROM ticket ORDER BY id"
+                   % ','.join(std_fields))
+    custom_cursor = db.cursor()
+    custom_cursor.execute("SELECT ticket,name,value FROM ticket_custom "
+                          "ORDER BY ticket")
+    change_cursor = db.cursor()
+    change_cursor.execute("SELECT ticket,time,author,field,oldvalue,newvalue "
+                          "FROM ticket_change ORDER BY ticket,time")
+    custom_rows = iter(custom_cursor)
+    change_rows = iter(change_cursor)
+    custom_row = _next(custom_rows)
+    change_row = _next(change_rows)
+
+    for row in cursor:
+        tkt_id = int(row[0])
+        record = {'id': tkt_id}
+        for idx, name in enumerate(std_fields):
+            if row[idx + 1] is not None:
+                record[name] = row[idx + 1]
+        record['time'] = int(row[-2])
+        record['changetime'] = int(row[-1])
+
+        # The custom fields and changes are ordered by ticket too, so they
+        # can be merged with the tickets as they are read
+        while custom_row and custom_row[0] <= tkt_id:
+            if custom_row[0] == tkt_id and custom_row[1] in custom_fields:
+                record[custom_row[1]] = custom_row[2]
+            custom_row = _next(custom_rows)
+        changes = []
+        while change_row and change_row[0] <= tkt_id:
+            if change_row[0] == tkt_id:
+                changes.append([int(change_row[1])] + list(change_row[2:]))
+            change_row = _next(change_rows)
+        if changes:
+            record['changes'] = changes
+        yield record
+
+def _format_ids(ids):
+    ids = list(ids)
+    ids.sort()
+    return ', '.join(['#%d' % tkt_id for tkt_id in ids])
+
+def _next(rows):
+    for row in rows:
+        return row
+    return None
+
+def _load_records(fileobj):
+    while True:
+        try:
+            yield cPickle.load(fileobj)
+        except EOFError:
+            return
+
+
+# File formats
+
+def read_json_lines(fileobj):
+    """Generate the ticket dictionaries read from a JSON-lines file."""
+    if json is None:
+        raise TracError('The JSON format requires Python 2.6 or simplejson')
+    for line in fileobj:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+def write_json_lines(fileobj, records):
+    """Write the ticket dictionaries to a JSON-lines file."""
+    if json is None:
+        raise TracError('The JSON format requires Python 2.6 or simplejson')
+    for record in records:
+        fileobj.write(json.dumps(record) + '\n')
+
+def read_csv(fileobj):
+    """Generate the ticket dictionaries read from a CSV file, whose first row
+    holds the field names."""
+    reader = csv.reader(fileobj)
+    names = None
+    for row in reader:
+        row = [unicode(value, 'utf-8') for value in row]
+        if names is None:
+            names = row
+            continue
+        yield dict([(name, value) for name, value in zip(names, row)
+                    if value])
+
+def write_csv(fileobj, records, fields):
+    """Write the ticket dictionaries to a CSV file, with a column for each of
+    the given field names.  The ticket changes are not written."""
+    names = ['id'] + list(fields) + ['time', 'changetime']
+    writer = csv.writer(fileobj)
+    writer.writerow(names)
+    for record in records:
+        writer.writerow([unicode(record.get(name, '')).encode('utf-8')
+                         for name in names])
@@ -24,11 +24,33 @@ import time
 from trac.attachment import Attachment
 from trac.core import TracError
 from trac.ticket import TicketSystem
-from trac.util import sorted, embedded_numbers
+from trac.ticket.pivot import CustomFieldPivot
+from trac.util import sorted, embedded_numbers, hex_entropy
 
 __all__ = ['Ticket', 'Type', 'Status', 'Resolution', 'Priority', 'Severity',
            'Component', 'Milestone', 'Version']
 
+MILESTONE_STATS_GENERATION = 'milestone_stats_generation' # key in `system`
+
+
+def invalidate_milestone_stats(db, milestones):
+    """Drop the ticket statistics of the given milestones cached by
+    `trac.ticket.roadmap.MilestoneStatsCache`.
+
+    This has to be done in the transaction changing the tickets.
+    """
+    milestones = dict([(m, True) for m in milestones if m]).keys()
+    if not milestones:
+        return
+    cursor = db.cursor()
+    # Changing the generation first ensures that statistics computed before
+    # this transaction is committed don't get stored
+    cursor.execute("UPDATE system SET value=%s WHERE name=%s",
+                   (hex_entropy(16), MILESTONE_STATS_GENERATION))
+    cursor.execute("DELETE FROM milestone_stats WHERE milestone IN (%s)"
+                   % ','.join(['%s'] * len(milestones)), milestones)
+
+
 
 class Ticket(object):
 
@@ -169,6 +191,8 @@ class Ticket(object):
             cursor.executemany("INSERT INTO ticket_custom (ticket,name,value) "
                                "VALUES (%s,%s,%s)", [(tkt_id, name, self[name])
                                                      for name in custom_fields])
+        CustomFieldPivot(self.env).update_ticket(db, tkt_id, self.values)
+        invalidate_milestone_stats(db, [self.values.get('milestone')])
 
         if handle_ta:
             db.commit()
@@ -223,6 +247,7 @@ class Ticket(object):
             self.values['cc'] = ', '.join(cclist)
 
         custom_fields = [f['name'] for f in self.fields if f.get('custom')]
+        custom_changed = False
         for name in self._old.keys():
             if name in custom_fields:
                 cursor.execute("SELECT * FROM ticket_custom " 
@@ -235,6 +260,7 @@ class Ticket(object):
                     cursor.execute("INSERT INTO ticket_custom (ticket,name,"
                                    "value) VALUES(%s,%s,%s)",
                                    (self.id, name, self[name]))
+                custom_changed = True
             else:
                 cursor.execute("UPDATE ticket SET %s=%%s WHERE id=%%s" % name,
                                (self[name], self.id))
@@ -243,6 +269,8 @@ class Ticket(object):
                            "VALUES (%s, %s, %s, %s, %s, %s)",
                            (self.id, when, author, name, self._old[name],
                             self[name]))
+        if custom_changed:
+            CustomFieldPivot(self.env).update_ticket(db, self.id, self.values)
         # always save comment, even if empty (numbering support for timeline)
         cursor.execute("INSERT INTO ticket_change "
                        "(ticket,time,author,field,oldvalue,newvalue) "
@@ -251,6 +279,9 @@ class Ticket(object):
 
         cursor.execute("UPDATE ticket SET changetime=%s WHERE id=%s",
                        (when, self.id))
+        if 'milestone' in self._old or 'status' in self._old:
+            invalidate_milestone_stats(db, [self._old.get('milestone'),
+                                            self.values.get('milestone')])
 
         if handle_ta:
             db.commit()
@@ -307,6 +338,10 @@ class Ticket(object):
         cursor.execute("DELETE FROM ticket WHERE id=%s", (self.id,))
         cursor.execute("DELETE FROM ticket_change WHERE ticket=%s", (self.id,))
         cursor.execute("DELETE FROM ticket_custom WHERE ticket=%s", (self.id,))
+        cursor.execute("DELETE FROM ticket_comment_cache WHERE ticket=%s",
+                       (self.id,))
+        CustomFieldPivot(self.env).delete_ticket(db, self.id)
+        invalidate_milestone_stats(db, [self.values.get('milestone')])
 
         if handle_ta:
             db.commit()
@@ -403,6 +438,13 @@ class AbstractEnum(object):
             cursor.execute("UPDATE ticket SET %s=%%s WHERE %s=%%s" %
                            (self.ticket_col, self.ticket_col),
                            (self.name, self._old_name))
+            if self.ticket_col == 'status':
+                # Drop the statistics counting the old status
+                cursor.execute("SELECT DISTINCT milestone "
+                               "FROM milestone_stats WHERE status=%s",
+                               (self._old_name,))
+                invalidate_milestone_stats(db, [row[0] for row
+                                                in cursor.fetchall()])
 
         if handle_ta:
             db.commit()
@@ -586,6 +628,7 @@ class Milestone(object):
         cursor = db.cursor()
         self.env.log.info('Deleting milestone %s' % self.name)
         cursor.execute("DELETE FROM milestone WHERE name=%s", (self.name,))
+        invalidate_milestone_stats(db, [self.name])
 
         # Retarget/reset tickets associated with this milestone
         now = time.time()
@@ -637,6 +680,7 @@ class Milestone(object):
                           'associated with milestone "%s"' % self.name)
         cursor.execute("UPDATE ticket SET milestone=%s WHERE milestone=%s",
                        (self.name, self._old_name))
+        invalidate_milestone_stats(db, [self.name, self._old_name])
         self._old_name = self.name
 
         if handle_ta:
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2006 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.config import BoolOption
+from trac.core import *
+from trac.db import Table, Column, Index, DatabaseManager
+from trac.env import IEnvironmentSetupParticipant
+from trac.ticket.api import TicketSystem
+
+__all__ = ['CustomFieldPivot', 'PIVOT_TABLE']
+
+PIVOT_TABLE = 'ticket_custom_pivot'
+PIVOT_COLUMNS = 'ticket_custom_pivot_columns' # key in the `system` table
+
+
+class CustomFieldPivot(Component):
+    """Maintain the optional `ticket_custom_pivot` table.
+
+    That table is a wide projection of `ticket_custom`, with one indexed column
+    per custom ticket field, so that queries can fetch all the custom fields of
+    a ticket with a single join instead of one join per field.
+
+    The columns of the table follow the `[ticket-custom]` configuration: when
+    custom fields are added or removed, the environment needs to be upgraded
+    (`trac-admin upgrade`) for the table to be rebuilt.  In the meantime, the
+    fields not yet present in the table are still read from `ticket_custom`.
+    """
+
+    implements(IEnvironmentSetupParticipant)
+
+    enabled = BoolOption('ticket', 'custom_pivot', 'false',
+        """Maintain a `ticket_custom_pivot` table holding all the custom
+        field values of a ticket in a single row, and use it for queries
+        (''since 0.10'').  The environment has to be upgraded after changing
+        this option or the set of custom fields.""")
+
+    # IEnvironmentSetupParticipant methods
+
+    def environment_created(self):
+        pass
+
+    def environment_needs_upgrade(self, db):
+        if self.enabled:
+            return self.get_columns(db) != self._get_custom_fields()
+        # Drop the table when the option gets disabled, so that it doesn't
+        # get out of sync
+        return self.get_columns(db) is not None
+
+    def upgrade_environment(self, db):
+        if self.enabled:
+            self.rebuild(db)
+        else:
+            self._drop(db)
+
+    # Public API
+
+    def get_columns(self, db=None):
+        """Return the names of the custom fields stored in the pivot table,
+        or `None` if the table doesn't exist.
+
+        The columns are read from the `system` table on each call, so that a
+        rebuild of the table by another process is taken into account.
+        """
+        if not db:
+            db = self.env.get_db_cnx()
+        cursor = db.cursor()
+        cursor.execute("SELECT value FROM system WHERE name=%s",
+                       (PIVOT_COLUMNS,))
+        row = cursor.fetchone()
+        if row:
+            return filter(None, row[0].split(','))
+        return None
+
+    def get_fields(self, db=None):
+        """Return the names of the custom fields that can be read from the
+        pivot table, or an empty list if the pivot table isn't in use."""
+        if not self.enabled:
+            return []
+        return self.get_columns(db) or []
+
+    def rebuild(self, db):
+        """(Re-)create the pivot table from the content of `ticket_custom`."""
+        self._drop(db)
+        fields = self._get_custom_fields()
+        table = Table(PIVOT_TABLE, key='ticket')[
+            [Column('ticket', type='int')] +
+            [Column(name) for name in fields] +
+            [Index([name]) for name in fields]]
+        db_connector, _ = DatabaseManager(self.env)._get_connector()
+        cursor = db.cursor()
+        for stmt in db_connector.to_sql(table):
+            cursor.execute(stmt)
+
+        if fields:
+            cursor.execute("INSERT INTO %s (ticket,%s) SELECT ticket,%s "
+                           "FROM ticket_custom GROUP BY ticket"
+                           % (PIVOT_TABLE, ','.join(fields),
+                              ','.join(["MAX(CASE WHEN name='%s' THEN value "
+                                        "END)" % name for name in fields])))
+        cursor.execute("INSERT INTO system (name,value) VALUES (%s,%s)",
+                       (PIVOT_COLUMNS, ','.join(fields)))
+        self.log.info('Rebuilt %s table for custom fields %s', PIVOT_TABLE,
+                      ', '.join(fields))
+
+    def update_ticket(self, db, tkt_id, values):
+        """Store the custom field values of a ticket in the pivot table.
+
+        Does nothing if the pivot table isn't in use.
+        """
+        self.update_tickets(db, [(tkt_id, values)])
+
+    def update_tickets(self, db, tickets):
+        """Store the custom field values of several tickets at once, given as
+        a list of `(id, values)` tuples."""
+        columns = self.enabled and self.get_columns(db)
+        if not columns or not tickets:
+            return
+        cursor = db.cursor()
+        cursor.executemany("DELETE FROM %s WHERE ticket=%%s" % PIVOT_TABLE,
+                           [(tkt_id,) for tkt_id, values in tickets])
+        cursor.executemany("INSERT INTO %s (ticket,%s) VALUES (%s)"
+                           % (PIVOT_TABLE, ','.join(columns),
+                              ','.join(['%s'] * (len(columns) + 1))),
+                           [[tkt_id] + [values.get(name) for name in columns]
+                            for tkt_id, values in tickets])
+
+    def delete_ticket(self, db, tkt_id):
+        """Remove the row of the given ticket from the pivot table."""
+        if self.enabled and self.get_columns(db) is not None:
+            cursor = db.cursor()
+            cursor.execute("DELETE FROM %s WHERE ticket=%%s" % PIVOT_TABLE,
+                           (tkt_id,))
+
+    # Internal methods
+
+    def _get_custom_fields(self):
+        return [f['name'] for f in TicketSystem(self.env).get_ticket_fields()
+                if f.get('custom')]
+
+    def _drop(self, db):
+        if self.get_columns(db) is None:
+            return
+        cursor = db.cursor()
+        cursor.execute("DROP TABLE %s" % PIVOT_TABLE)
+        cursor.execute("DELETE FROM system WHERE name=%s", (PIVOT_COLUMNS,))
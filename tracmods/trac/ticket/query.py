@@ -19,10 +19,12 @@ import re
 from StringIO import StringIO
 import time
 
+from trac.config import IntOption
 from trac.core import *
 from trac.db import get_column_names
 from trac.perm import IPermissionRequestor
 from trac.ticket import Ticket, TicketSystem
+from trac.ticket.pivot import CustomFieldPivot, PIVOT_TABLE
 from trac.util.datefmt import format_datetime, http_date
 from trac.util.html import escape, html, unescape
 from trac.util.text import shorten_line, CRLF
@@ -40,7 +42,7 @@ class QuerySyntaxError(Exception):
 class Query(object):
 
     def __init__(self, env, constraints=None, order=None, desc=0, group=None,
-                 groupdesc = 0, verbose=0):
+                 groupdesc = 0, verbose=0, max=0, page=1):
         self.env = env
         self.constraints = constraints or {}
         self.order = order
@@ -51,6 +53,19 @@ class Query(object):
         self.fields = TicketSystem(self.env).get_ticket_fields()
         self.cols = [] # lazily initialized
 
+        # Pagination: a `max` of 0 means that all matching tickets are
+        # returned by `execute()`
+        try:
+            self.max = int(max or 0)
+            self.page = int(page or 1)
+        except ValueError:
+            raise QuerySyntaxError, 'Query max and page must be integers'
+        if self.max < 0:
+            self.max = 0
+        if self.page < 1:
+            self.page = 1
+        self.num_items = 0 # total number of matches, set by `execute()`
+
         if self.order != 'id' \
                 and self.order not in [f['name'] for f in self.fields]:
             # order by priority by default
@@ -61,7 +76,7 @@ class Query(object):
 
     def from_string(cls, env, string, **kw):
         filters = string.split('&')
-        kw_strs = ['order', 'group']
+        kw_strs = ['order', 'group', 'max', 'page']
         kw_bools = ['desc', 'groupdesc', 'verbose']
         constraints = {}
         for filter in filters:
@@ -145,15 +160,68 @@ class Query(object):
 
         return self.cols
 
+    def get_offset(self):
+        """Return the index of the first ticket of the current page."""
+        return self.max * (self.page - 1)
+
+    def get_num_pages(self):
+        """Return the number of result pages, as of the last `execute()`."""
+        if not self.max:
+            return 1
+        return max((self.num_items - 1) / self.max + 1, 1)
+
+    def count(self, db=None):
+        """Return the total number of tickets matching the constraints."""
+        sql, args = self.get_count_sql()
+        self.env.log.debug("Count SQL: " + sql % tuple([repr(a) for a in args]))
+
+        if not db:
+            db = self.env.get_db_cnx()
+        cursor = db.cursor()
+        cursor.execute(sql, args)
+        row = cursor.fetchone()
+        cursor.close()
+        return row and int(row[0]) or 0
+
+    def count_groups(self, db=None):
+        """Return a dictionary mapping each value of the `group` field to the
+        total number of matching tickets having that value.
+
+        Unlike counting the results of `execute()`, this takes all the pages
+        of a paginated query into account.
+        """
+        if not self.group:
+            return {}
+        sql, args = self.get_count_sql(self.group)
+        self.env.log.debug("Count SQL: " + sql % tuple([repr(a) for a in args]))
+
+        if not db:
+            db = self.env.get_db_cnx()
+        cursor = db.cursor()
+        cursor.execute(sql, args)
+        groups = {}
+        for value, cnt in cursor:
+            value = value or 'None'
+            groups[value] = groups.get(value, 0) + int(cnt)
+        cursor.close()
+        return groups
+
     def execute(self, req, db=None):
         if not self.cols:
             self.get_columns()
 
+        if not db:
+            db = self.env.get_db_cnx()
+
         sql, args = self.get_sql()
+        if self.max:
+            self.num_items = self.count(db)
+            if self.get_offset() >= self.num_items > 0:
+                raise TracError('Page %d is beyond the number of pages in the '
+                                'query' % self.page)
+            sql += "\nLIMIT %d OFFSET %d" % (self.max, self.get_offset())
         self.env.log.debug("Query SQL: " + sql % tuple([repr(a) for a in args]))
 
-        if not db:
-            db = self.env.get_db_cnx()
         cursor = db.cursor()
         cursor.execute(sql, args)
         columns = get_column_names(cursor)
@@ -174,19 +242,26 @@ class Query(object):
                 result[name] = val
             results.append(result)
         cursor.close()
+        if not self.max:
+            self.num_items = len(results)
         return results
 
-    def get_href(self, req, order=None, desc=None, format=None):
+    def get_href(self, req, order=None, desc=None, format=None, page=None):
         # FIXME: only use .href from that 'req' for now
         if desc is None:
             desc = self.desc
         if order is None:
             order = self.order
+        args = self.constraints.copy()
+        if self.max:
+            args['max'] = self.max
+        if page and page != 1:
+            args['page'] = page
         return req.href.query(order=order, desc=desc and 1 or None,
                               group=self.group or None,
                               groupdesc=self.groupdesc and 1 or None,
                               verbose=self.verbose and 1 or None,
-                              format=format, **self.constraints)
+                              format=format, **args)
 
     def get_sql(self):
         """Return a (sql, params) tuple for the query."""
@@ -206,20 +281,18 @@ class Query(object):
         add_cols('priority', 'time', 'changetime', self.order)
         cols.extend([c for c in self.constraints.keys() if not c in cols])
 
-        custom_fields = [f['name'] for f in self.fields if f.has_key('custom')]
+        custom_fields = self._get_custom_fields()
 
         sql = []
         sql.append("SELECT " + ",".join(['t.%s AS %s' % (c, c) for c in cols
                                          if c not in custom_fields]))
         sql.append(",priority.value AS priority_value")
         for k in [k for k in cols if k in custom_fields]:
-            sql.append(",%s.value AS %s" % (k, k))
+            sql.append(",%s AS %s" % (custom_fields[k], k))
         sql.append("\nFROM ticket AS t")
 
         # Join with ticket_custom table as necessary
-        for k in [k for k in cols if k in custom_fields]:
-           sql.append("\n  LEFT OUTER JOIN ticket_custom AS %s ON " \
-                      "(id=%s.ticket AND %s.name='%s')" % (k, k, k, k))
+        sql += self._get_custom_joins([k for k in cols if k in custom_fields])
 
         # Join with the enum table for proper sorting
         for col in [c for c in ('status', 'resolution', 'priority', 'severity')
@@ -234,11 +307,122 @@ class Query(object):
             sql.append("\n  LEFT OUTER JOIN %s ON (%s.name=%s)"
                        % (col, col, col))
 
+        clauses, args = self._get_constraint_clauses(custom_fields)
+        if clauses:
+            sql.append("\nWHERE " + " AND ".join(clauses))
+
+        sql.append("\nORDER BY ")
+        order_cols = [(self.order, self.desc)]
+        if self.group and self.group != self.order:
+            order_cols.insert(0, (self.group, self.groupdesc))
+        for name, desc in order_cols:
+            if name not in custom_fields:
+                col = 't.' + name
+            else:
+                col = custom_fields[name]
+            if name == 'id':
+                # FIXME: This is a somewhat ugly hack.  Can we also have the
+                #        column type for this?  If it's an integer, we do first
+                #        one, if text, we do 'else'
+                if desc:
+                    sql.append("COALESCE(%s,0)=0 DESC," % col)
+                else:
+                    sql.append("COALESCE(%s,0)=0," % col)
+            else:
+                if desc:
+                    sql.append("COALESCE(%s,'')='' DESC," % col)
+                else:
+                    sql.append("COALESCE(%s,'')=''," % col)
+            if name in ['status', 'resolution', 'priority', 'severity']:
+                if desc:
+                    sql.append("%s.value DESC" % name)
+                else:
+                    sql.append("%s.value" % name)
+            elif col in ['t.milestone', 't.version']:
+                time_col = name == 'milestone' and 'milestone.due' or 'version.time'
+                if desc:
+                    sql.append("COALESCE(%s,0)=0 DESC,%s DESC,%s DESC"
+                               % (time_col, time_col, col))
+                else:
+                    sql.append("COALESCE(%s,0)=0,%s,%s"
+                               % (time_col, time_col, col))
+            else:
+                if desc:
+                    sql.append("%s DESC" % col)
+                else:
+                    sql.append("%s" % col)
+            if name == self.group and not name == self.order:
+                sql.append(",")
+        if self.order != 'id':
+            sql.append(",t.id")
+
+        return "".join(sql), args
+
+    def get_count_sql(self, group=None):
+        """Return a (sql, params) tuple for counting the tickets matched by
+        the query.
+
+        If `group` is given, the tickets are counted per value of that field.
+        """
+        custom_fields = self._get_custom_fields()
+
+        sql = []
+        if group:
+            if group in custom_fields:
+                group_col = custom_fields[group]
+            else:
+                group_col = 't.' + group
+            sql.append("SELECT %s,COUNT(*)" % group_col)
+        else:
+            sql.append("SELECT COUNT(*)")
+        sql.append("\nFROM ticket AS t")
+
+        # Only join with the ticket_custom table for the fields we filter on
+        sql += self._get_custom_joins([k for k in custom_fields
+                                       if k in self.constraints or k == group])
+
+        clauses, args = self._get_constraint_clauses(custom_fields)
+        if clauses:
+            sql.append("\nWHERE " + " AND ".join(clauses))
+        if group:
+            sql.append("\nGROUP BY %s" % group_col)
+
+        return "".join(sql), args
+
+    def _get_custom_fields(self):
+        """Return a dictionary mapping the names of the custom fields to the
+        SQL expression of their value."""
+        pivot_fields = CustomFieldPivot(self.env).get_fields()
+        custom_fields = {}
+        for name in [f['name'] for f in self.fields if f.has_key('custom')]:
+            if name in pivot_fields:
+                custom_fields[name] = '%s.%s' % (PIVOT_TABLE, name)
+            else:
+                custom_fields[name] = name + '.value'
+        return custom_fields
+
+    def _get_custom_joins(self, names):
+        """Return the joins needed for reading the given custom fields.
+
+        The fields present in the pivot table are all read through a single
+        join, the others need a join with `ticket_custom` each.
+        """
+        joins = []
+        pivot_fields = CustomFieldPivot(self.env).get_fields()
+        if [k for k in names if k in pivot_fields]:
+            joins.append("\n  LEFT OUTER JOIN %s ON (id=%s.ticket)"
+                         % (PIVOT_TABLE, PIVOT_TABLE))
+        for k in [k for k in names if k not in pivot_fields]:
+            joins.append("\n  LEFT OUTER JOIN ticket_custom AS %s ON " \
+                         "(id=%s.ticket AND %s.name='%s')" % (k, k, k, k))
+        return joins
+
+    def _get_constraint_clauses(self, custom_fields):
         def get_constraint_sql(name, value, mode, neg):
             if name not in custom_fields:
                 name = 't.' + name
             else:
-                name = name + '.value'
+                name = custom_fields[name]
             value = value[len(mode) + neg:]
 
             if mode == '':
@@ -271,7 +455,7 @@ class Query(object):
                 if k not in custom_fields:
                     col = 't.' + k
                 else:
-                    col = k + '.value'
+                    col = custom_fields[k]
                 clauses.append("COALESCE(%s,'') %sIN (%s)"
                                % (col, neg and 'NOT ' or '',
                                   ','.join(['%s' for val in v])))
@@ -293,56 +477,7 @@ class Query(object):
                     clauses.append(constraint_sql[0])
                     args.append(constraint_sql[1])
 
-        clauses = filter(None, clauses)
-        if clauses:
-            sql.append("\nWHERE " + " AND ".join(clauses))
-
-        sql.append("\nORDER BY ")
-        order_cols = [(self.order, self.desc)]
-        if self.group and self.group != self.order:
-            order_cols.insert(0, (self.group, self.groupdesc))
-        for name, desc in order_cols:
-            if name not in custom_fields:
-                col = 't.' + name
-            else:
-                col = name + '.value'
-            if name == 'id':
-                # FIXME: This is a somewhat ugly hack.  Can we also have the
-                #        column type for this?  If it's an integer, we do first
-                #        one, if text, we do 'else'
-                if desc:
-                    sql.append("COALESCE(%s,0)=0 DESC," % col)
-                else:
-                    sql.append("COALESCE(%s,0)=0," % col)
-            else:
-                if desc:
-                    sql.append("COALESCE(%s,'')='' DESC," % col)
-                else:
-                    sql.append("COALESCE(%s,'')=''," % col)
-            if name in ['status', 'resolution', 'priority', 'severity']:
-                if desc:
-                    sql.append("%s.value DESC" % name)
-                else:
-                    sql.append("%s.value" % name)
-            elif col in ['t.milestone', 't.version']:
-                time_col = name == 'milestone' and 'milestone.due' or 'version.time'
-                if desc:
-                    sql.append("COALESCE(%s,0)=0 DESC,%s DESC,%s DESC"
-                               % (time_col, time_col, col))
-                else:
-                    sql.append("COALESCE(%s,0)=0,%s,%s"
-                               % (time_col, time_col, col))
-            else:
-                if desc:
-                    sql.append("%s DESC" % col)
-                else:
-                    sql.append("%s" % col)
-            if name == self.group and not name == self.order:
-                sql.append(",")
-        if self.order != 'id':
-            sql.append(",t.id")
-
-        return "".join(sql), args
+        return filter(None, clauses), args
 
 
 class QueryModule(Component):
@@ -350,6 +485,12 @@ class QueryModule(Component):
     implements(IRequestHandler, INavigationContributor, IWikiSyntaxProvider,
                IContentConverter)
 
+    items_per_page = IntOption('query', 'items_per_page', 0,
+        """Number of tickets displayed per page in ticket queries, by default
+        (''since 0.10'').  The pages are only linked from the `next` and `prev`
+        navigation links of the page, so this is 0 by default, which displays
+        all matching tickets at once.""")
+
     # IContentConverter methods
     def get_supported_conversions(self):
         yield ('rss', 'RSS Feed', 'xml',
@@ -401,10 +542,19 @@ class QueryModule(Component):
                 if email or name:
                     constraints['cc'] = ('~%s' % email or name,)
 
-        query = Query(self.env, constraints, req.args.get('order'),
-                      req.args.has_key('desc'), req.args.get('group'),
-                      req.args.has_key('groupdesc'),
-                      req.args.has_key('verbose'))
+        # Only the HTML view is paginated by default, the exported formats
+        # contain all the matching tickets unless explicitly asked otherwise
+        max = req.args.get('max')
+        if max is None and not req.args.get('format'):
+            max = self.items_per_page
+        try:
+            query = Query(self.env, constraints, req.args.get('order'),
+                          req.args.has_key('desc'), req.args.get('group'),
+                          req.args.has_key('groupdesc'),
+                          req.args.has_key('verbose'),
+                          max, req.args.get('page'))
+        except QuerySyntaxError, e:
+            raise TracError(e, 'Invalid Query')
 
         if req.args.has_key('update'):
             # Reset session vars
@@ -550,12 +700,28 @@ class QueryModule(Component):
             req.hdf['query.verbose'] = True
 
         tickets = query.execute(req, db)
-        req.hdf['query.num_matches'] = len(tickets)
+        req.hdf['query.num_matches'] = query.num_items
+
+        if query.max:
+            num_pages = query.get_num_pages()
+            req.hdf['query.page'] = query.page
+            req.hdf['query.max'] = query.max
+            req.hdf['query.num_pages'] = num_pages
+            req.hdf['query.page_href'] = query.get_href(req)
+            if query.page < num_pages:
+                add_link(req, 'next', query.get_href(req, page=query.page + 1),
+                         'Next Page')
+            if query.page > 1:
+                add_link(req, 'prev', query.get_href(req, page=query.page - 1),
+                         'Previous Page')
 
         # The most recent query is stored in the user session
         orig_list = rest_list = None
         orig_time = int(time.time())
         query_constraints = unicode(query.constraints)
+        if query.max:
+            # Each page of the results is tracked separately
+            query_constraints += u' page=%d max=%d' % (query.page, query.max)
         if query_constraints != req.session.get('query_constraints') \
                 or int(req.session.get('query_time', 0)) < orig_time - 3600:
             # New or outdated query, (re-)initialize session vars
@@ -565,7 +731,7 @@ class QueryModule(Component):
             orig_list = [int(id) for id in req.session.get('query_tickets', '').split()]
             rest_list = orig_list[:]
             orig_time = int(req.session.get('query_time', 0))
-        req.session['query_href'] = query.get_href(req)
+        req.session['query_href'] = query.get_href(req, page=query.page)
         req.session['query_time'] = orig_time
 
         # Find out which tickets originally in the query results no longer
@@ -585,7 +751,12 @@ class QueryModule(Component):
                             'summary': html.EM(e)}
                 tickets.insert(orig_list.index(rest_id), data)
 
+        # When the results are paginated, a group may span several pages, so
+        # its size has to be counted in the database
         num_matches_group = {}
+        if query.group and query.get_num_pages() > 1:
+            num_matches_group = query.count_groups(db)
+        count_groups = not num_matches_group
         for ticket in tickets:
             if orig_list:
                 # Mark tickets added or changed since the query was first
@@ -595,7 +766,7 @@ class QueryModule(Component):
                 elif int(ticket['changetime']) > orig_time:
                     ticket['changed'] = True
             for field, value in ticket.items():
-                if field == query.group:
+                if field == query.group and count_groups:
                     num_matches_group[value] = num_matches_group.get(value, 0)+1
                 if field == 'time':
                     ticket[field] = format_datetime(value)
@@ -686,6 +857,10 @@ class TicketQueryMacro(WikiMacroBase):
      - '''compact''' -- the tickets are presented as a comma-separated
        list of ticket IDs. 
      - '''count''' -- only the count of matching tickets is displayed
+
+    If `[query] items_per_page` is set, at most that many tickets are
+    listed, followed by a link to the complete query results.  Another limit
+    can be set by adding a `max=N` filter to the query (''since 0.10'').
     """
 
     def render_macro(self, req, name, content):
@@ -704,6 +879,14 @@ class TicketQueryMacro(WikiMacroBase):
 
         query = Query.from_string(self.env, query_string)
         query.order = 'id'
+        if count:
+            cnt = query.count()
+            return html.SPAN(cnt, title='%d tickets for which %s' %
+                             (cnt, query_string))
+
+        if not query.max:
+            query.max = QueryModule(self.env).items_per_page
+        query.page = 1
         tickets = query.execute(req)
         if tickets:
             def ticket_anchor(ticket):
@@ -711,14 +894,23 @@ class TicketQueryMacro(WikiMacroBase):
                               class_=ticket['status'],
                               href=req.href.ticket(int(ticket['id'])),
                               title=shorten_line(ticket['summary']))
+            more = None
+            if query.num_items > len(tickets):
+                query.max = 0
+                more = html.A('%d more tickets...'
+                              % (query.num_items - len(tickets)),
+                              class_='query', href=query.get_href(req),
+                              title='All %d tickets for which %s'
+                              % (query.num_items, query_string))
             if compact:
                 alist = [ticket_anchor(ticket) for ticket in tickets]
+                if more:
+                    alist.append(more)
                 return html.SPAN(alist[0], *[(', ', a) for a in alist[1:]])
-            elif count:
-                cnt = len(tickets)
-                return html.SPAN(cnt, title='%d tickets for which %s' % 
-                                 (cnt, query_string))
             else:
-                return html.DL([(html.DT(ticket_anchor(ticket)),
-                                 html.DD(ticket['summary']))
-                                for ticket in tickets], class_='wiki compact')
+                dl = html.DL([(html.DT(ticket_anchor(ticket)),
+                               html.DD(ticket['summary']))
+                              for ticket in tickets], class_='wiki compact')
+                if more:
+                    return html.DIV(dl, html.P(more))
+                return dl
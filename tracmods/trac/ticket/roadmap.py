@@ -21,11 +21,15 @@ from time import localtime, strftime, time
 from trac import __version__
 from trac.core import *
 from trac.perm import IPermissionRequestor
+from trac.util import hex_entropy
 from trac.util.datefmt import format_date, format_datetime, parse_date, \
                                pretty_timedelta
 from trac.util.html import html, unescape, Markup
 from trac.util.text import shorten_line, CRLF, to_unicode
 from trac.ticket import Milestone, Ticket, TicketSystem
+from trac.ticket.model import invalidate_milestone_stats, \
+                              MILESTONE_STATS_GENERATION
+from trac.ticket.pivot import CustomFieldPivot, PIVOT_TABLE
 from trac.Timeline import ITimelineEventProvider
 from trac.web import IRequestHandler
 from trac.web.chrome import add_link, add_stylesheet, INavigationContributor
@@ -38,6 +42,11 @@ def get_tickets_for_milestone(env, db, milestone, field='component'):
     if field in [f['name'] for f in fields if not f.get('custom')]:
         cursor.execute("SELECT id,status,%s FROM ticket WHERE milestone=%%s "
                        "ORDER BY %s" % (field, field), (milestone,))
+    elif field in CustomFieldPivot(env).get_fields(db):
+        cursor.execute("SELECT id,status,%s FROM ticket LEFT OUTER JOIN %s "
+                       "ON (id=%s.ticket) WHERE milestone=%%s ORDER BY %s"
+                       % (field, PIVOT_TABLE, PIVOT_TABLE, field),
+                       (milestone,))
     else:
         cursor.execute("SELECT id,status,value FROM ticket LEFT OUTER "
                        "JOIN ticket_custom ON (id=ticket AND name=%s) "
@@ -47,6 +56,51 @@ def get_tickets_for_milestone(env, db, milestone, field='component'):
         tickets.append({'id': tkt_id, 'status': status, field: fieldval})
     return tickets
 
+def get_ticket_stats(env, db, milestones, field=None):
+    """Return the number of tickets per status for each of the given
+    milestones, counted with a single aggregate query.
+
+    The result is a dictionary of the form `{milestone: {status: count}}`, or
+    `{milestone: {value: {status: count}}}` if `field` is specified, in which
+    case the tickets are also counted per value of that field.
+    """
+    stats = {}
+    if not milestones:
+        return stats
+
+    fields = TicketSystem(env).get_ticket_fields()
+    join, args = '', []
+    if not field:
+        col = None
+    elif field in [f['name'] for f in fields if not f.get('custom')]:
+        col = 't.' + field
+    elif field in CustomFieldPivot(env).get_fields(db):
+        col = '%s.%s' % (PIVOT_TABLE, field)
+        join = " LEFT OUTER JOIN %s ON (t.id=%s.ticket)" % (PIVOT_TABLE,
+                                                             PIVOT_TABLE)
+    else:
+        col = 'c.value'
+        join = " LEFT OUTER JOIN ticket_custom AS c " \
+               "ON (t.id=c.ticket AND c.name=%s)"
+        args.append(field)
+
+    cols = col and col + ',' or ''
+    cursor = db.cursor()
+    cursor.execute("SELECT t.milestone,%sCOALESCE(t.status,''),COUNT(*) "
+                   "FROM ticket AS t%s WHERE t.milestone IN (%s) "
+                   "GROUP BY t.milestone,%sCOALESCE(t.status,'')"
+                   % (cols, join, ','.join(['%s'] * len(milestones)), cols),
+                   args + list(milestones))
+    for row in cursor:
+        if col:
+            milestone, value, status, cnt = row
+            counts = stats.setdefault(milestone, {}).setdefault(value, {})
+        else:
+            milestone, status, cnt = row
+            counts = stats.setdefault(milestone, {})
+        counts[status] = counts.get(status, 0) + int(cnt)
+    return stats
+
 def get_query_links(req, milestone, grouped_by='component', group=None):
     q = {}
     if not group:
@@ -66,10 +120,17 @@ def get_query_links(req, milestone, grouped_by='component', group=None):
     return q
 
 def calc_ticket_stats(tickets):
-    total_cnt = len(tickets)
-    active = [ticket for ticket in tickets if ticket['status'] != 'closed']
-    active_cnt = len(active)
-    closed_cnt = total_cnt - active_cnt
+    counts = {}
+    for ticket in tickets:
+        counts[ticket['status']] = counts.get(ticket['status'], 0) + 1
+    return calc_status_stats(counts)
+
+def calc_status_stats(counts):
+    """Compute the statistics displayed for a set of tickets, given the number
+    of tickets per status as returned by `get_ticket_stats`."""
+    total_cnt = sum(counts.values())
+    closed_cnt = counts.get('closed', 0)
+    active_cnt = total_cnt - closed_cnt
 
     percent_active, percent_closed = 0, 0
     if total_cnt > 0:
@@ -108,14 +169,108 @@ def _get_groups(env, db, by='component'):
         if field['name'] == by:
             if field.has_key('options'):
                 return field['options']
-            else:
-                cursor = db.cursor()
+            cursor = db.cursor()
+            if not field.get('custom'):
                 cursor.execute("SELECT DISTINCT %s FROM ticket ORDER BY %s"
                                % (by, by))
-                return [row[0] for row in cursor]
+            elif by in CustomFieldPivot(env).get_fields(db):
+                cursor.execute("SELECT DISTINCT %s FROM %s ORDER BY %s"
+                               % (by, PIVOT_TABLE, by))
+            else:
+                cursor.execute("SELECT DISTINCT value FROM ticket_custom "
+                               "WHERE name=%s ORDER BY value", (by,))
+            return [row[0] for row in cursor]
     return []
 
 
+class MilestoneStatsCache(Component):
+    """Cache of the number of tickets per status of each milestone, kept in the
+    `milestone_stats` table.
+
+    The entries of a milestone are dropped by `invalidate_milestone_stats()`
+    in the transaction adding a ticket to or removing a ticket from that
+    milestone, or changing its status, and are computed again the next time
+    they are requested.  That function also changes a generation number, so
+    that statistics computed concurrently with a ticket change don't get
+    stored.
+    """
+
+    # Public API
+
+    def get_stats(self, db, milestones):
+        """Return the number of tickets per status for each of the given
+        milestones, as a dictionary of the form `{milestone: {status: count}}`.
+        """
+        stats = {}
+        if not milestones:
+            return stats
+
+        # The row with an empty status holds the total number of tickets, and
+        # marks the milestone as cached
+        totals = {}
+        cursor = db.cursor()
+        cursor.execute("SELECT value FROM system WHERE name=%s",
+                       (MILESTONE_STATS_GENERATION,))
+        row = cursor.fetchone()
+        generation = row and row[0]
+        cursor.execute("SELECT milestone,status,tickets FROM milestone_stats "
+                       "WHERE milestone IN (%s)"
+                       % ','.join(['%s'] * len(milestones)), list(milestones))
+        for milestone, status, cnt in cursor:
+            counts = stats.setdefault(milestone, {})
+            if status:
+                counts[status] = int(cnt)
+            else:
+                totals[milestone] = int(cnt)
+        for milestone, total in totals.items():
+            counts = stats[milestone]
+            remainder = total - sum(counts.values())
+            if remainder > 0:
+                counts[''] = remainder
+
+        missing = [m for m in milestones if m not in totals]
+        if missing:
+            self.log.debug('Computing ticket statistics for milestones %s',
+                           ', '.join(missing))
+            computed = get_ticket_stats(self.env, db, missing)
+            rows = []
+            for milestone in missing:
+                counts = computed.get(milestone, {})
+                stats[milestone] = counts
+                rows.append((milestone, '', sum(counts.values())))
+                rows += [(milestone, status, cnt)
+                         for status, cnt in counts.items() if status]
+            if generation is not None:
+                self._store(db, generation, missing, rows)
+        return stats
+
+    # Internal methods
+
+    def _store(self, db, generation, milestones, rows):
+        cursor = db.cursor()
+        try:
+            # Changing the generation waits for the transactions invalidating
+            # statistics to complete, and fails if one of them has completed
+            # since the statistics were computed
+            cursor.execute("UPDATE system SET value=%s "
+                           "WHERE name=%s AND value=%s",
+                           (hex_entropy(16), MILESTONE_STATS_GENERATION,
+                            generation))
+            if cursor.rowcount != 1:
+                db.rollback()
+                return
+            cursor.execute("DELETE FROM milestone_stats WHERE milestone IN (%s)"
+                           % ','.join(['%s'] * len(milestones)), milestones)
+            cursor.executemany("INSERT INTO milestone_stats "
+                               "(milestone,status,tickets) VALUES (%s,%s,%s)",
+                               rows)
+            db.commit()
+        except Exception, e:
+            self.log.warning('Ticket statistics of milestones %s not cached: '
+                             '%s', ', '.join(milestones), e)
+            db.rollback()
+
+
 class RoadmapModule(Component):
 
     implements(INavigationContributor, IPermissionRequestor, IRequestHandler)
@@ -153,19 +308,24 @@ class RoadmapModule(Component):
                       for m in Milestone.select(self.env, showall, db)]
         req.hdf['roadmap.milestones'] = milestones        
 
+        if req.args.get('format') == 'ics':
+            for milestone in milestones:
+                milestone_name = unescape(milestone['name']) # Kludge
+                milestone['tickets'] = get_tickets_for_milestone(self.env, db,
+                                                                 milestone_name,
+                                                                 'owner')
+            self.render_ics(req, db, milestones)
+            return
+
+        stats = MilestoneStatsCache(self.env).get_stats(db,
+                [unescape(milestone['name']) for milestone in milestones])
         for idx, milestone in enumerate(milestones):
             milestone_name = unescape(milestone['name']) # Kludge
             prefix = 'roadmap.milestones.%d.' % idx
-            tickets = get_tickets_for_milestone(self.env, db, milestone_name,
-                                                'owner')
-            req.hdf[prefix + 'stats'] = calc_ticket_stats(tickets)
+            req.hdf[prefix + 'stats'] = \
+                    calc_status_stats(stats.get(milestone_name, {}))
             for k, v in get_query_links(req, milestone_name).items():
                 req.hdf[prefix + 'queries.' + k] = v
-            milestone['tickets'] = tickets # for the iCalendar view
-
-        if req.args.get('format') == 'ics':
-            self.render_ics(req, db, milestones)
-            return
 
         add_stylesheet(req, 'common/css/roadmap.css')
 
@@ -414,6 +574,7 @@ class MilestoneModule(Component):
                 cursor.execute("UPDATE ticket SET milestone=%s WHERE "
                                "milestone=%s and status != 'closed'",
                                 (retarget_to, milestone.name))
+                invalidate_milestone_stats(db, [milestone.name, retarget_to])
                 self.env.log.info('Tickets associated with milestone %s '
                                   'retargeted to %s' % 
                                   (milestone.name, retarget_to))
@@ -487,28 +648,34 @@ class MilestoneModule(Component):
             by = req.args.get('by', available_groups[0]['name'])
         req.hdf['milestone.stats.grouped_by'] = by
 
-        tickets = get_tickets_for_milestone(self.env, db, milestone.name, by)
-        stats = calc_ticket_stats(tickets)
+        group_stats = get_ticket_stats(self.env, db, [milestone.name],
+                                       by).get(milestone.name, {})
+        counts = {}
+        for group_counts in group_stats.values():
+            for status, cnt in group_counts.items():
+                counts[status] = counts.get(status, 0) + cnt
+        stats = calc_status_stats(counts)
         req.hdf['milestone.stats'] = stats
         for key, value in get_query_links(req, milestone.name).items():
             req.hdf['milestone.queries.' + key] = value
 
+        total_cnt = stats['total_tickets']
         groups = _get_groups(self.env, db, by)
         group_no = 0
         max_percent_total = 0
         for group in groups:
-            group_tickets = [t for t in tickets if t[by] == group]
-            if not group_tickets:
+            group_counts = group_stats.get(group)
+            if not group_counts:
                 continue
             prefix = 'milestone.stats.groups.%s' % group_no
             req.hdf['%s.name' % prefix] = group
             percent_total = 0
-            if len(tickets) > 0:
-                percent_total = float(len(group_tickets)) / float(len(tickets))
+            if total_cnt > 0:
+                percent_total = float(sum(group_counts.values())) / total_cnt
                 if percent_total > max_percent_total:
                     max_percent_total = percent_total
             req.hdf['%s.percent_total' % prefix] = percent_total * 100
-            stats = calc_ticket_stats(group_tickets)
+            stats = calc_status_stats(group_counts)
             req.hdf[prefix] = stats
             for key, value in \
                     get_query_links(req, milestone.name, by, group).items():
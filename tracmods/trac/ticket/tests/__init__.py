@@ -1,7 +1,8 @@
 import unittest
 
 from trac.ticket.tests import api, model, query, wikisyntax, notification, \
-                              conversion, report
+                              conversion, report, pivot, roadmap, bulk, \
+                              web_ui
 
 def suite():
     suite = unittest.TestSuite()
@@ -12,6 +13,10 @@ def suite():
     suite.addTest(notification.suite())
     suite.addTest(conversion.suite())
     suite.addTest(report.suite())
+    suite.addTest(pivot.suite())
+    suite.addTest(roadmap.suite())
+    suite.addTest(bulk.suite())
+    suite.addTest(web_ui.suite())
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,184 @@
+from StringIO import StringIO
+
+from trac.core import *
+from trac.test import EnvironmentStub
+from trac.ticket.api import ITicketBatchListener, ITicketChangeListener, \
+                           TicketSystem
+from trac.ticket.bulk import TicketImporter, export_tickets, json, \
+                             read_csv, read_json_lines, write_csv, \
+                             write_json_lines
+from trac.ticket.model import Ticket
+
+import unittest
+
+
+class TestBatchListener(Component):
+    implements(ITicketBatchListener, ITicketChangeListener)
+
+    def __init__(self):
+        self.batches = []
+        self.created = []
+
+    def tickets_created(self, tickets):
+        self.batches.append([t.id for t in tickets])
+
+    def ticket_created(self, ticket):
+        self.created.append(ticket.id)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        pass
+
+    def ticket_deleted(self, ticket):
+        pass
+
+
+class TestChangeListener(Component):
+    implements(ITicketChangeListener)
+
+    def __init__(self):
+        self.created = []
+
+    def ticket_created(self, ticket):
+        self.created.append(ticket.id)
+
+    def ticket_changed(self, ticket, comment, author, old_values):
+        pass
+
+    def ticket_deleted(self, ticket):
+        pass
+
+
+class TicketImporterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        self.db = self.env.get_db_cnx()
+
+    def _get_records(self):
+        return [{'summary': 'First', 'milestone': 'milestone1', 'foo': 'bar',
+                 'time': 100, 'changetime': 200,
+                 'changes': [[200, 'joe', 'comment', '1', 'Fixed']]},
+                {'summary': 'Second', 'status': 'new', 'time': 300}]
+
+    def test_import(self):
+        importer = TicketImporter(self.env, batch_size=1)
+        self.assertEqual(2, importer.import_tickets(self._get_records()))
+        ticket = Ticket(self.env, 1)
+        self.assertEqual('First', ticket['summary'])
+        self.assertEqual('bar', ticket['foo'])
+        self.assertEqual(100, ticket.time_created)
+        self.assertEqual(200, ticket.time_changed)
+        self.assertEqual([(200, 'joe', 'comment', '1', 'Fixed', 1)],
+                         ticket.get_changelog())
+        ticket = Ticket(self.env, 2)
+        self.assertEqual('Second', ticket['summary'])
+        self.assertEqual(300, ticket.time_changed)
+
+    def test_import_after_existing_tickets(self):
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'Existing'
+        ticket.insert()
+        TicketImporter(self.env).import_tickets(self._get_records())
+        self.assertEqual('First', Ticket(self.env, 2)['summary'])
+        self.assertEqual('Second', Ticket(self.env, 3)['summary'])
+
+    def test_export_roundtrip(self):
+        TicketImporter(self.env).import_tickets(self._get_records())
+        records = list(export_tickets(self.env, self.db))
+        self.assertEqual([1, 2], [r['id'] for r in records])
+        self.assertEqual('bar', records[0]['foo'])
+        self.assertEqual([[200, 'joe', 'comment', '1', 'Fixed']],
+                         records[0]['changes'])
+        self.assertEqual(None, records[1].get('changes'))
+
+        env = EnvironmentStub(default_data=True)
+        env.config.set('ticket-custom', 'foo', 'text')
+        TicketImporter(env).import_tickets(records)
+        self.assertEqual(records, list(export_tickets(env)))
+
+    def test_csv(self):
+        TicketImporter(self.env).import_tickets(self._get_records())
+        out = StringIO()
+        write_csv(out, export_tickets(self.env, self.db),
+                  ['summary', 'milestone', 'foo'])
+        records = list(read_csv(StringIO(out.getvalue())))
+        self.assertEqual([{'id': '1', 'summary': 'First', 'foo': 'bar',
+                           'milestone': 'milestone1', 'time': '100',
+                           'changetime': '200'},
+                          {'id': '2', 'summary': 'Second', 'time': '300',
+                           'changetime': '300'}], records)
+
+    def test_json_lines(self):
+        if json is None:
+            return
+        out = StringIO()
+        write_json_lines(out, self._get_records())
+        self.assertEqual(2, len(out.getvalue().splitlines()))
+        self.assertEqual(self._get_records(),
+                         list(read_json_lines(StringIO(out.getvalue()))))
+
+    def test_existing_ids(self):
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'Existing'
+        ticket.insert()
+        records = self._get_records()
+        records[1]['id'] = 1
+        try:
+            TicketImporter(self.env).import_tickets(records)
+            self.fail('Expected TracError')
+        except TracError, e:
+            self.assert_('#1' in e.message, e.message)
+        self.assertEqual([1], [r['id'] for r in export_tickets(self.env)])
+
+    def test_duplicate_ids(self):
+        records = self._get_records() + [{'id': 3, 'summary': 'Third'},
+                                         {'id': '3', 'summary': 'Fourth'}]
+        try:
+            TicketImporter(self.env).import_tickets(iter(records))
+            self.fail('Expected TracError')
+        except TracError, e:
+            self.assert_('#3' in e.message, e.message)
+        self.assertEqual([], list(export_tickets(self.env)))
+
+    def test_stream(self):
+        def records():
+            for i in xrange(5):
+                yield {'summary': 'Ticket %d' % i}
+        importer = TicketImporter(self.env, batch_size=2)
+        counts = []
+        self.assertEqual(5, importer.import_tickets(records(), counts.append))
+        self.assertEqual([2, 4, 5], counts)
+        self.assertEqual('Ticket 4', Ticket(self.env, 5)['summary'])
+
+    def test_numbering_skips_ids(self):
+        records = [{'summary': 'First'}, {'id': 1, 'summary': 'Second'}]
+        TicketImporter(self.env).import_tickets(records)
+        self.assertEqual('First', Ticket(self.env, 2)['summary'])
+        self.assertEqual('Second', Ticket(self.env, 1)['summary'])
+
+
+class TicketImporterListenersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True,
+                                   enable=[TicketSystem, TestBatchListener,
+                                           TestChangeListener])
+
+    def test_listeners(self):
+        records = [{'summary': 'First'}, {'summary': 'Second'},
+                   {'summary': 'Third'}]
+        TicketImporter(self.env, batch_size=2).import_tickets(records)
+        self.assertEqual([[1, 2], [3]], TestBatchListener(self.env).batches)
+        self.assertEqual([], TestBatchListener(self.env).created)
+        self.assertEqual([1, 2, 3], TestChangeListener(self.env).created)
+
+
+def suite():
+    suite = unittest.TestSuite()
+    suite.addTest(unittest.makeSuite(TicketImporterTestCase, 'test'))
+    suite.addTest(unittest.makeSuite(TicketImporterListenersTestCase, 'test'))
+    return suite
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,6 +17,7 @@
 #
 
 from trac.core import TracError
+from trac.notification import NotificationQueue
 from trac.ticket.model import Ticket
 from trac.ticket.notification import TicketNotifyEmail
 from trac.test import EnvironmentStub, Mock
@@ -111,6 +112,70 @@ class NotificationTestCase(unittest.TestCase):
         for r in cc_list.replace(',', ' ').split():
             self.failIf(r not in recipients)
 
+    def test_queue(self):
+        """Queued notification, delivered in batches of recipients"""
+        self.env.config.set('notification', 'smtp_queue', 'true')
+        self.env.config.set('notification', 'smtp_queue_thread', 'false')
+        self.env.config.set('notification', 'smtp_batch_size', '2')
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'Foo'
+        ticket['cc'] = 'joe.user@example.com'
+        ticket.insert()
+        tn = TicketNotifyEmail(self.env)
+        tn.notify(ticket, newticket=True)
+        # checks that nothing has been sent yet
+        self.failIf(notifysuite.smtpd.get_message())
+        queue = NotificationQueue(self.env)
+        self.assertEqual({'pending': 2, 'deferred': 0, 'failed': 0,
+                          'oldest': ticket.time_created}, queue.get_stats())
+        self.assertEqual((2, 0), queue.process())
+        recipients = notifysuite.smtpd.get_recipients()
+        for r in ['joe.user@example.net', 'joe.bar@example.net',
+                  'joe.user@example.com']:
+            self.failIf(r not in recipients)
+        self.assertEqual(0, queue.get_stats()['pending'])
+
+    def test_queue_retry(self):
+        """Queued notification, with a failed delivery"""
+        self.env.config.set('notification', 'smtp_queue', 'true')
+        self.env.config.set('notification', 'smtp_queue_thread', 'false')
+        queue = NotificationQueue(self.env)
+        queue.enqueue('trac@localhost', ['joe.user@example.net'], 'Foo')
+        self.env.config.set('notification', 'smtp_port',
+                            str(SMTP_TEST_PORT + 1))
+        self.assertEqual((0, 1), queue.process())
+        self.assertEqual(1, queue.get_stats()['deferred'])
+        # checks that the email isn't retried before the delay
+        self.env.config.set('notification', 'smtp_port', str(SMTP_TEST_PORT))
+        self.assertEqual((0, 0), queue.process())
+        cursor = self.env.get_db_cnx().cursor()
+        cursor.execute("UPDATE notify_queue SET next_attempt=0")
+        self.assertEqual((1, 0), queue.process())
+        self.assertEqual(['joe.user@example.net'],
+                         notifysuite.smtpd.get_recipients())
+
+    def test_queue_claim(self):
+        """Queued notification, claimed by another process"""
+        self.env.config.set('notification', 'smtp_queue', 'true')
+        self.env.config.set('notification', 'smtp_queue_thread', 'false')
+        queue = NotificationQueue(self.env)
+        queue.enqueue('trac@localhost', ['joe.user@example.net'], 'Foo')
+        db = self.env.get_db_cnx()
+        cursor = db.cursor()
+        cursor.execute("SELECT id,next_attempt FROM notify_queue")
+        id, next_attempt = cursor.fetchone()
+        self.assertEqual(next_attempt, queue.get_next_attempt())
+        # checks that an email can only be claimed once
+        self.assertEqual(True, queue._claim(db, id, next_attempt))
+        self.assertEqual(False, queue._claim(db, id, next_attempt))
+        self.assertEqual((0, 0), queue.process())
+        self.failIf(notifysuite.smtpd.get_message())
+        # checks that the email is delivered once its lease has expired
+        self.failUnless(queue.get_next_attempt() > time.time())
+        cursor.execute("UPDATE notify_queue SET next_attempt=0")
+        self.assertEqual((1, 0), queue.process())
+        self.assertEqual(None, queue.get_next_attempt())
+
     def test_structure(self):
         """Basic SMTP message structure (headers, body)"""
         ticket = Ticket(self.env)
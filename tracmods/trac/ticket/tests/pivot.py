@@ -0,0 +1,103 @@
+from trac.test import Mock, EnvironmentStub
+from trac.ticket.model import Ticket
+from trac.ticket.pivot import CustomFieldPivot
+from trac.ticket.query import Query
+from trac.ticket.roadmap import get_tickets_for_milestone, _get_groups
+
+import unittest
+
+
+class CustomFieldPivotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        self.env.config.set('ticket-custom', 'bar', 'text')
+        self.env.config.set('ticket', 'custom_pivot', 'true')
+        self.db = self.env.get_db_cnx()
+        self.pivot = CustomFieldPivot(self.env)
+
+    def _insert_ticket(self, **kw):
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'Ticket'
+        ticket['milestone'] = 'milestone1'
+        for k, v in kw.items():
+            ticket[k] = v
+        ticket.insert()
+        return ticket
+
+    def _get_pivot_rows(self):
+        cursor = self.db.cursor()
+        cursor.execute("SELECT ticket,foo,bar FROM ticket_custom_pivot "
+                       "ORDER BY ticket")
+        return [tuple(row) for row in cursor]
+
+    def test_needs_upgrade(self):
+        self.assertEqual(True, self.pivot.environment_needs_upgrade(self.db))
+        self.pivot.upgrade_environment(self.db)
+        self.assertEqual(False, self.pivot.environment_needs_upgrade(self.db))
+        self.env.config.set('ticket-custom', 'baz', 'text')
+        self.assertEqual(True, self.pivot.environment_needs_upgrade(self.db))
+
+    def test_disabled(self):
+        self.env.config.set('ticket', 'custom_pivot', 'false')
+        self.assertEqual(False, self.pivot.environment_needs_upgrade(self.db))
+        self.assertEqual([], self.pivot.get_fields())
+
+    def test_rebuild(self):
+        self._insert_ticket(foo='one', bar='two')
+        self._insert_ticket(foo='three')
+        self.pivot.upgrade_environment(self.db)
+        self.assertEqual(['foo', 'bar'], self.pivot.get_fields())
+        self.assertEqual([(1, 'one', 'two'), (2, 'three', None)],
+                         self._get_pivot_rows())
+
+    def test_rebuilt_elsewhere(self):
+        self.assertEqual([], self.pivot.get_fields())
+        # Another process creates the table, then drops it
+        cursor = self.db.cursor()
+        cursor.execute("INSERT INTO system (name,value) "
+                       "VALUES ('ticket_custom_pivot_columns','foo,bar')")
+        self.assertEqual(['foo', 'bar'], self.pivot.get_fields())
+        cursor.execute("DELETE FROM system "
+                       "WHERE name='ticket_custom_pivot_columns'")
+        self.assertEqual([], self.pivot.get_fields())
+
+    def test_ticket_maintenance(self):
+        self.pivot.upgrade_environment(self.db)
+        ticket = self._insert_ticket(foo='one')
+        self.assertEqual([(1, 'one', None)], self._get_pivot_rows())
+        ticket['bar'] = 'two'
+        ticket.save_changes('joe', 'comment')
+        self.assertEqual([(1, 'one', 'two')], self._get_pivot_rows())
+        ticket.delete()
+        self.assertEqual([], self._get_pivot_rows())
+
+    def test_query_single_join(self):
+        self.pivot.upgrade_environment(self.db)
+        self._insert_ticket(foo='one', bar='two')
+        self._insert_ticket(foo='three')
+        query = Query.from_string(self.env, 'foo=one&bar=two', order='foo')
+        sql, args = query.get_sql()
+        self.assertEqual(1, sql.count('LEFT OUTER JOIN ticket_custom_pivot'))
+        self.assertEqual(-1, sql.find('LEFT OUTER JOIN ticket_custom AS'))
+        tickets = query.execute(Mock(href=self.env.href))
+        self.assertEqual([1], [t['id'] for t in tickets])
+        self.assertEqual(1, query.count())
+
+    def test_roadmap_helpers(self):
+        self.pivot.upgrade_environment(self.db)
+        self._insert_ticket(foo='one')
+        self._insert_ticket(foo='three')
+        tickets = get_tickets_for_milestone(self.env, self.db, 'milestone1',
+                                            'foo')
+        self.assertEqual(['one', 'three'], [t['foo'] for t in tickets])
+        self.assertEqual(['one', 'three'], _get_groups(self.env, self.db,
+                                                       'foo'))
+
+
+def suite():
+    return unittest.makeSuite(CustomFieldPivotTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main()
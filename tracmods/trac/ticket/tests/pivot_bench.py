@@ -0,0 +1,78 @@
+"""Benchmark of ticket queries on custom fields, comparing one join with
+`ticket_custom` per field against a single join with `ticket_custom_pivot`.
+
+This is not part of the test suite, run it with:
+
+    python -m trac.ticket.tests.pivot_bench [num_tickets] [num_fields]
+"""
+
+import random
+import sys
+import time
+
+from trac.test import Mock, EnvironmentStub
+from trac.ticket.pivot import CustomFieldPivot
+from trac.ticket.query import Query
+
+STATUSES = ('new', 'assigned', 'reopened', 'closed')
+VALUES = ('alpha', 'beta', 'gamma', 'delta', 'epsilon')
+
+QUERIES = ('status!=closed&order=id&max=100',
+           'c0=alpha&c1!=beta&order=c2&max=100',
+           'c3~=lph&c4=gamma|delta&group=c5&order=id&max=100',
+           'status=new&c6=epsilon&order=priority')
+
+
+def create_env(num_tickets, num_fields):
+    env = EnvironmentStub(default_data=True)
+    fields = ['c%d' % i for i in range(num_fields)]
+    for name in fields:
+        env.config.set('ticket-custom', name, 'text')
+
+    db = env.get_db_cnx()
+    cursor = db.cursor()
+    rand = random.Random(42)
+    now = int(time.time())
+    cursor.executemany("INSERT INTO ticket (id,summary,status,priority,"
+                       "time,changetime) VALUES (%s,%s,%s,%s,%s,%s)",
+                       [(i, 'Ticket %d' % i, rand.choice(STATUSES), 'major',
+                         now, now) for i in range(1, num_tickets + 1)])
+    for name in fields:
+        cursor.executemany("INSERT INTO ticket_custom (ticket,name,value) "
+                           "VALUES (%s,%s,%s)",
+                           [(i, name, rand.choice(VALUES))
+                            for i in range(1, num_tickets + 1)])
+    db.commit()
+    return env
+
+
+def run_queries(env, label):
+    req = Mock(href=env.href)
+    for query_string in QUERIES:
+        query = Query.from_string(env, query_string)
+        start = time.time()
+        tickets = query.execute(req)
+        print '%-8s %-50s %6d rows %8.3fs' % (label, query_string,
+                                              len(tickets),
+                                              time.time() - start)
+
+
+def main(num_tickets=100000, num_fields=12):
+    start = time.time()
+    env = create_env(num_tickets, num_fields)
+    print 'Created %d tickets with %d custom fields in %.1fs' \
+          % (num_tickets, num_fields, time.time() - start)
+
+    run_queries(env, 'joins')
+
+    env.config.set('ticket', 'custom_pivot', 'true')
+    db = env.get_db_cnx()
+    start = time.time()
+    CustomFieldPivot(env).upgrade_environment(db)
+    db.commit()
+    print 'Built ticket_custom_pivot in %.1fs' % (time.time() - start)
+
+    run_queries(env, 'pivot')
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
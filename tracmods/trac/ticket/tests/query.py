@@ -1,5 +1,7 @@
+from trac.core import TracError
 from trac.log import logger_factory
 from trac.test import Mock, EnvironmentStub
+from trac.ticket.model import Ticket
 from trac.ticket.query import Query, QueryModule
 from trac.wiki.formatter import LinkFormatter
 
@@ -310,6 +312,54 @@ ORDER BY COALESCE(t.id,0)=0,t.id""")
         self.assertEqual([], args)
         tickets = query.execute(Mock(href=self.env.href))
 
+    def test_count_constrained_by_custom_field(self):
+        self.env.config.set('ticket-custom', 'foo', 'text')
+        query = Query.from_string(self.env, 'foo=something', order='id')
+        sql, args = query.get_count_sql()
+        self.assertEqual(sql,
+"""SELECT COUNT(*)
+FROM ticket AS t
+  LEFT OUTER JOIN ticket_custom AS foo ON (id=foo.ticket AND foo.name='foo')
+WHERE COALESCE(foo.value,'')=%s""")
+        self.assertEqual(['something'], args)
+        self.assertEqual(0, query.count())
+
+    def test_count_grouped_by_milestone(self):
+        query = Query.from_string(self.env, 'status!=closed',
+                                  group='milestone')
+        sql, args = query.get_count_sql(query.group)
+        self.assertEqual(sql,
+"""SELECT t.milestone,COUNT(*)
+FROM ticket AS t
+WHERE COALESCE(t.status,'')!=%s
+GROUP BY t.milestone""")
+        self.assertEqual(['closed'], args)
+
+    def test_paginated_execute(self):
+        for i in range(5):
+            ticket = Ticket(self.env)
+            ticket['summary'] = 'Ticket %d' % i
+            ticket['status'] = 'new'
+            ticket['milestone'] = i % 2 and 'milestone1' or 'milestone2'
+            ticket.insert()
+        query = Query.from_string(self.env, 'status=new&max=2&page=3',
+                                  order='id', group='milestone')
+        tickets = query.execute(Mock(href=self.env.href))
+        self.assertEqual(5, query.num_items)
+        self.assertEqual(3, query.get_num_pages())
+        self.assertEqual(1, len(tickets))
+        self.assertEqual({'milestone1': 2, 'milestone2': 3},
+                         query.count_groups())
+
+        query.page = 4
+        self.assertRaises(TracError, query.execute, Mock(href=self.env.href))
+
+    def test_unpaginated_execute(self):
+        query = Query(self.env, order='id')
+        tickets = query.execute(Mock(href=self.env.href))
+        self.assertEqual(len(tickets), query.num_items)
+        self.assertEqual(1, query.get_num_pages())
+
 class QueryLinksTestCase(unittest.TestCase):
     def setUp(self):
         self.env = EnvironmentStub(default_data=True)
@@ -0,0 +1,131 @@
+from trac.test import EnvironmentStub
+from trac.ticket.model import Milestone, Status, Ticket
+from trac.ticket.roadmap import calc_status_stats, get_ticket_stats, \
+                                MilestoneStatsCache
+
+import unittest
+
+
+class TicketStatsTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.db = self.env.get_db_cnx()
+
+    def _insert_ticket(self, milestone, status, component='component1'):
+        ticket = Ticket(self.env)
+        ticket['summary'] = 'Ticket'
+        ticket['milestone'] = milestone
+        ticket['status'] = status
+        ticket['component'] = component
+        ticket.insert()
+        return ticket
+
+    def _get_cached_milestones(self):
+        cursor = self.db.cursor()
+        cursor.execute("SELECT DISTINCT milestone FROM milestone_stats "
+                       "ORDER BY milestone")
+        return [row[0] for row in cursor]
+
+    def test_calc_status_stats(self):
+        stats = calc_status_stats({'new': 2, 'assigned': 1, 'closed': 1})
+        self.assertEqual(4, stats['total_tickets'])
+        self.assertEqual(3, stats['active_tickets'])
+        self.assertEqual(1, stats['closed_tickets'])
+        self.assertEqual(75, stats['percent_active'])
+        self.assertEqual(25, stats['percent_closed'])
+
+    def test_get_ticket_stats(self):
+        self._insert_ticket('milestone1', 'new')
+        self._insert_ticket('milestone1', 'closed')
+        self._insert_ticket('milestone1', 'closed', 'component2')
+        self._insert_ticket('milestone2', 'assigned')
+        self._insert_ticket('milestone3', 'new')
+        self.assertEqual({'milestone1': {'new': 1, 'closed': 2},
+                          'milestone2': {'assigned': 1}},
+                         get_ticket_stats(self.env, self.db,
+                                          ['milestone1', 'milestone2']))
+        self.assertEqual({'milestone1': {'component1': {'new': 1, 'closed': 1},
+                                         'component2': {'closed': 1}}},
+                         get_ticket_stats(self.env, self.db, ['milestone1'],
+                                          'component'))
+
+    def test_cache(self):
+        cache = MilestoneStatsCache(self.env)
+        self._insert_ticket('milestone1', 'new')
+        ticket = self._insert_ticket('milestone1', 'new')
+        self.assertEqual({'milestone1': {'new': 2}, 'milestone2': {}},
+                         cache.get_stats(self.db, ['milestone1',
+                                                   'milestone2']))
+        self.assertEqual(['milestone1', 'milestone2'],
+                         self._get_cached_milestones())
+        self.assertEqual({'milestone1': {'new': 2}, 'milestone2': {}},
+                         cache.get_stats(self.db, ['milestone1',
+                                                   'milestone2']))
+
+        ticket['status'] = 'closed'
+        ticket.save_changes('joe', 'Closed', when=1)
+        self.assertEqual(['milestone2'], self._get_cached_milestones())
+        self.assertEqual({'milestone1': {'new': 1, 'closed': 1}},
+                         cache.get_stats(self.db, ['milestone1']))
+
+        ticket['milestone'] = 'milestone2'
+        ticket.save_changes('joe', 'Retargeted', when=2)
+        self.assertEqual([], self._get_cached_milestones())
+
+    def test_cache_milestone_renamed(self):
+        cache = MilestoneStatsCache(self.env)
+        self._insert_ticket('milestone1', 'new')
+        cache.get_stats(self.db, ['milestone1', 'milestone2'])
+        milestone = Milestone(self.env, 'milestone1')
+        milestone.name = 'milestone5'
+        milestone.update()
+        self.assertEqual(['milestone2'], self._get_cached_milestones())
+        self.assertEqual({'milestone5': {'new': 1}},
+                         cache.get_stats(self.db, ['milestone5']))
+
+    def test_cache_status_renamed(self):
+        cache = MilestoneStatsCache(self.env)
+        self._insert_ticket('milestone1', 'new')
+        self._insert_ticket('milestone2', 'closed')
+        cache.get_stats(self.db, ['milestone1', 'milestone2'])
+        status = Status(self.env, 'new')
+        status.name = 'open'
+        status.update()
+        self.assertEqual(['milestone2'], self._get_cached_milestones())
+        self.assertEqual({'milestone1': {'open': 1}},
+                         cache.get_stats(self.db, ['milestone1']))
+
+    def test_cache_invalidated_in_transaction(self):
+        cache = MilestoneStatsCache(self.env)
+        ticket = self._insert_ticket('milestone1', 'new')
+        cache.get_stats(self.db, ['milestone1', 'milestone2'])
+        milestone = Milestone(self.env, 'milestone1')
+        milestone.delete(retarget_to='milestone2', db=self.db)
+        self.assertEqual([], self._get_cached_milestones())
+        self.db.rollback()
+        self.assertEqual('milestone1', Ticket(self.env, ticket.id)['milestone'])
+        self.assertEqual(['milestone1', 'milestone2'],
+                         self._get_cached_milestones())
+
+    def test_cache_concurrent_change(self):
+        cache = MilestoneStatsCache(self.env)
+        cursor = self.db.cursor()
+        cursor.execute("SELECT value FROM system "
+                       "WHERE name='milestone_stats_generation'")
+        generation = cursor.fetchone()[0]
+        self._insert_ticket('milestone1', 'new')
+        # statistics computed before the ticket was added aren't stored
+        cache._store(self.db, generation, ['milestone1'],
+                     [('milestone1', '', 0)])
+        self.assertEqual([], self._get_cached_milestones())
+        self.assertEqual({'milestone1': {'new': 1}},
+                         cache.get_stats(self.db, ['milestone1']))
+        self.assertEqual(['milestone1'], self._get_cached_milestones())
+
+
+def suite():
+    return unittest.makeSuite(TicketStatsTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+from trac.test import Mock, EnvironmentStub
+from trac.ticket.model import Ticket
+from trac.ticket.web_ui import TicketCommentCache, TicketModule
+from trac.web.href import Href
+from trac.wiki.api import WikiSystem
+from trac.wiki.model import WikiPage
+
+import unittest
+
+
+class TicketCommentCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub(default_data=True)
+        self.db = self.env.get_db_cnx()
+        self.req = Mock(href=Href('/trac'), abs_href=Href('http://example.org/'))
+        self.env.config.set('ticket', 'cache_comments', 'true')
+        self.cache = TicketCommentCache(self.env)
+        self.ticket = Ticket(self.env)
+        self.ticket['summary'] = 'Ticket'
+        self.ticket.insert()
+
+    def _render(self):
+        changes = list(TicketModule(self.env).grouped_changelog_entries(
+            self.ticket, self.db))
+        self.cache.render_comments(self.req, self.db, self.ticket.id, changes)
+        return [unicode(c['comment']) for c in changes if 'comment' in c]
+
+    def _get_cached(self):
+        cursor = self.db.cursor()
+        cursor.execute("SELECT cnum,html FROM ticket_comment_cache "
+                       "WHERE ticket=%s ORDER BY cnum", (self.ticket.id,))
+        return [(int(cnum), html) for cnum, html in cursor]
+
+    def test_render_and_append(self):
+        self.ticket.save_changes('joe', "''first''", when=1)
+        self.assertEqual(['<p>\n<i>first</i>\n</p>\n'], self._render())
+        self.assertEqual([(1, '<p>\n<i>first</i>\n</p>\n')],
+                         self._get_cached())
+
+        # The cached HTML is used as is
+        cursor = self.db.cursor()
+        cursor.execute("UPDATE ticket_comment_cache SET html='cached'")
+        self.ticket.save_changes('joe', "'''second'''", when=2)
+        self.assertEqual(['cached', '<p>\n<strong>second</strong>\n</p>\n'],
+                         self._render())
+        self.assertEqual([1, 2], [cnum for cnum, html in self._get_cached()])
+
+    def test_hash_mismatch(self):
+        self.ticket.save_changes('joe', 'first', when=1)
+        self._render()
+        cursor = self.db.cursor()
+        cursor.execute("UPDATE ticket_comment_cache SET html='stale',hash=''")
+        self.assertEqual(['<p>\nfirst\n</p>\n'], self._render())
+
+    def test_disabled(self):
+        self.env.config.set('ticket', 'cache_comments', 'false')
+        self.ticket.save_changes('joe', 'first', when=1)
+        self.assertEqual(['<p>\nfirst\n</p>\n'], self._render())
+        self.assertEqual([], self._get_cached())
+
+    def test_rule_set_change(self):
+        self.ticket.save_changes('joe', 'first', when=1)
+        self._render()
+        cursor = self.db.cursor()
+        cursor.execute("UPDATE ticket_comment_cache SET html='stale'")
+        WikiSystem(self.env)._render_signature = 'other rules'
+        self.assertEqual(['<p>\nfirst\n</p>\n'], self._render())
+
+    def test_ticket_link_change(self):
+        other = Ticket(self.env)
+        other['summary'] = 'Other'
+        other['status'] = 'new'
+        other.insert()
+        self.ticket.save_changes('joe', 'See #%s' % other.id, when=1)
+        html = self._render()[0]
+        self.assert_('class="new ticket"' in html)
+        self.assertEqual([(1, html)], self._get_cached())
+        other['status'] = 'closed'
+        other.save_changes('joe', 'Closed', when=2)
+        html = self._render()[0]
+        self.assert_('class="closed ticket"' in html)
+        self.assertEqual([(1, html)], self._get_cached())
+
+    def test_wiki_link_change(self):
+        self.ticket.save_changes('joe', 'See SomePage', when=1)
+        self.assert_('class="missing wiki"' in self._render()[0])
+        page = WikiPage(self.env, 'SomePage')
+        page.text = 'Content'
+        page.save('joe', '', '::1', 1)
+        WikiSystem(self.env)._last_index_update = 0
+        self.failIf('missing' in self._render()[0])
+
+    def test_uncacheable(self):
+        self.ticket.save_changes('joe', '{{{\n#!TitleIndex\n}}}', when=1)
+        self._render()
+        self.assertEqual([], self._get_cached())
+
+    def test_ticket_deleted(self):
+        self.ticket.save_changes('joe', 'first', when=1)
+        self._render()
+        self.ticket.delete()
+        self.assertEqual([], self._get_cached())
+
+
+def suite():
+    return unittest.makeSuite(TicketCommentCacheTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main()
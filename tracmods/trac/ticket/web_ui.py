@@ -14,6 +14,7 @@
 #
 # Author: Jonas Borgström <jonas@edgewall.com>
 
+import md5
 import os
 import re
 import time
@@ -32,7 +33,8 @@ from trac.util.html import html, Markup
 from trac.util.text import CRLF
 from trac.web import IRequestHandler
 from trac.web.chrome import add_link, add_stylesheet, INavigationContributor
-from trac.wiki import wiki_to_html, wiki_to_oneliner
+from trac.wiki import WikiSystem, wiki_to_html, wiki_to_oneliner, \
+                      wiki_to_cacheable_html, get_dependencies_hash
 from trac.mimeview.api import Mimeview, IContentConverter
 
 
@@ -205,6 +207,97 @@ class NewticketModule(TicketModuleBase):
             req.redirect(req.href.ticket(ticket.id))
 
 
+class TicketCommentCache(Component):
+    """Cache of the rendered HTML of the ticket comments, kept in the
+    `ticket_comment_cache` table.
+
+    Comments are identified by their number in the ticket.  Along with the
+    HTML of a comment, the cache stores its links and macros, as returned by
+    `wiki_to_cacheable_html()`, and a hash of the comment text, of the
+    signature of the wiki rule set and of the current rendering of these
+    links and macros.  The cached HTML is only used as long as that hash
+    matches: the links are rendered again on each view, for the user viewing
+    the ticket, but not the rest of the comments.  A comment is rendered
+    again when the ticket it links to gets closed, when the wiki page it
+    links to gets created, or when the output of one of its macros changes.
+    """
+
+    enabled = BoolOption('ticket', 'cache_comments', 'true',
+        """Store the rendered HTML of the ticket comments in the database
+        instead of rendering all the comments each time a ticket is viewed
+        (''since 0.10'').""")
+
+    # Public API
+
+    def render_comments(self, req, db, tkt_id, changes):
+        """Replace the wiki text of the comments in the `changes` returned
+        by `TicketModule.grouped_changelog_entries()` by their HTML rendering,
+        using the cached rendering when possible.
+        """
+        cached = {}
+        if self.enabled:
+            cursor = db.cursor()
+            cursor.execute("SELECT cnum,hash,html,dependencies "
+                           "FROM ticket_comment_cache WHERE ticket=%s",
+                           (tkt_id,))
+            for cnum, hash, html, dependencies in cursor:
+                dependencies = filter(None, (dependencies or '').split('\n'))
+                cached[int(cnum)] = (hash, html, dependencies)
+
+        rows = []
+        rendered = {}
+        for change in changes:
+            if 'comment' not in change:
+                continue
+            comment = change['comment']
+            cnum = change['permanent'] and change.get('cnum')
+            if not self.enabled or not cnum:
+                change['comment'] = wiki_to_html(comment, self.env, req, db)
+                continue
+            if cnum in cached:
+                hash, html, dependencies = cached[cnum]
+                if hash == self._get_hash(req, db, comment, dependencies,
+                                          rendered):
+                    change['comment'] = Markup(html)
+                    continue
+            html, dependencies = wiki_to_cacheable_html(comment, self.env,
+                                                        req, db)
+            change['comment'] = html
+            if dependencies is not None:
+                rows.append((tkt_id, cnum,
+                             self._get_hash(req, db, comment, dependencies,
+                                            rendered),
+                             unicode(html), '\n'.join(dependencies)))
+
+        if rows:
+            self.log.debug('Caching %d comments of ticket #%s', len(rows),
+                           tkt_id)
+            cursor = db.cursor()
+            try:
+                cursor.executemany("DELETE FROM ticket_comment_cache "
+                                   "WHERE ticket=%s AND cnum=%s",
+                                   [row[:2] for row in rows])
+                cursor.executemany("INSERT INTO ticket_comment_cache "
+                                   "(ticket,cnum,hash,html,dependencies) "
+                                   "VALUES (%s,%s,%s,%s,%s)", rows)
+                db.commit()
+            except Exception, e:
+                # Another request viewing the ticket has just cached the
+                # same comments
+                self.log.debug('Comments of ticket #%s not cached: %s',
+                               tkt_id, e)
+                db.rollback()
+
+    # Internal methods
+
+    def _get_hash(self, req, db, comment, dependencies, rendered):
+        return md5.new('\n'.join([
+            WikiSystem(self.env).get_render_signature(req),
+            get_dependencies_hash(self.env, req, dependencies, db,
+                                  rendered=rendered),
+            comment.encode('utf-8')])).hexdigest()
+
+
 class TicketModule(TicketModuleBase):
 
     implements(INavigationContributor, IRequestHandler, ITimelineEventProvider,
@@ -618,11 +711,6 @@ class TicketModule(TicketModuleBase):
         description_lastmod = description_author = None
         for change in self.grouped_changelog_entries(ticket, db):
             changes.append(change)
-            # wikify comment
-            comment = ''
-            if 'comment' in change:
-                comment = change['comment']
-                change['comment'] = wiki_to_html(comment, self.env, req, db)
             if change['permanent']:
                 cnum = change['cnum']
                 # keep track of replies threading
@@ -630,13 +718,17 @@ class TicketModule(TicketModuleBase):
                     replies.setdefault(change['replyto'], []).append(cnum)
                 # eventually cite the replied to comment
                 if replyto == str(cnum):
-                    quote_original(change['author'], comment,
+                    quote_original(change['author'],
+                                   change.get('comment', ''),
                                    'comment:%s' % replyto)
             if 'description' in change['fields']:
                 change['fields']['description'] = ''
                 description_lastmod = change['date']
                 description_author = change['author']
-                
+        # wikify comments
+        TicketCommentCache(self.env).render_comments(req, db, ticket.id,
+                                                     changes)
+
         req.hdf['ticket'] = {
             'changes': changes,
             'replies': replies,
@@ -0,0 +1,13 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+def do_upgrade(env, ver, cursor):
+    """Add the `milestone_stats` table, caching the number of tickets per
+    milestone and status for the roadmap.
+    """
+    table = Table('milestone_stats', key=('milestone', 'status'))[
+        Column('milestone'),
+        Column('status'),
+        Column('tickets', type='int')]
+    db_connector, _ = DatabaseManager(env)._get_connector()
+    for stmt in db_connector.to_sql(table):
+        cursor.execute(stmt)
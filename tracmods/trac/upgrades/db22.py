@@ -0,0 +1,14 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+def do_upgrade(env, ver, cursor):
+    """Add the `ticket_comment_cache` table, holding the rendered HTML of the
+    ticket comments.
+    """
+    table = Table('ticket_comment_cache', key=('ticket', 'cnum'))[
+        Column('ticket', type='int'),
+        Column('cnum', type='int'),
+        Column('hash'),
+        Column('html')]
+    db_connector, _ = DatabaseManager(env)._get_connector()
+    for stmt in db_connector.to_sql(table):
+        cursor.execute(stmt)
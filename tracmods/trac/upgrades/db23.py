@@ -0,0 +1,19 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+def do_upgrade(env, ver, cursor):
+    """Add the `notify_queue` table, holding the notification emails waiting
+    to be delivered.
+    """
+    table = Table('notify_queue', key='id')[
+        Column('id', auto_increment=True),
+        Column('time', type='int'),
+        Column('next_attempt', type='int'),
+        Column('attempts', type='int'),
+        Column('sender'),
+        Column('recipients'),
+        Column('message'),
+        Column('error'),
+        Index(['next_attempt'])]
+    db_connector, _ = DatabaseManager(env)._get_connector()
+    for stmt in db_connector.to_sql(table):
+        cursor.execute(stmt)
@@ -0,0 +1,16 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+def do_upgrade(env, ver, cursor):
+    """Add the `node_listing` table, caching the entries of the directories
+    of the repository.
+    """
+    table = Table('node_listing', key=('path', 'rev', 'name'))[
+        Column('path'),
+        Column('rev'),
+        Column('name'),
+        Column('node_type', size=1),
+        Column('size', type='int'),
+        Column('created_rev')]
+    db_connector, _ = DatabaseManager(env)._get_connector()
+    for stmt in db_connector.to_sql(table):
+        cursor.execute(stmt)
@@ -0,0 +1,31 @@
+from trac.db import Table, Column, Index, DatabaseManager
+from trac.versioncontrol.cache import get_history_rows
+
+def do_upgrade(env, ver, cursor):
+    """Add the `node_history` table, indexing the history of every path of
+    the repository, and fill it from the `node_change` table.
+    """
+    table = Table('node_history', key=('path', 'rev'))[
+        Column('path'),
+        Column('rev', type='int'),
+        Column('change_type', size=1),
+        Column('base_path'),
+        Column('base_rev', type='int')]
+    db_connector, _ = DatabaseManager(env)._get_connector()
+    for stmt in db_connector.to_sql(table):
+        cursor.execute(stmt)
+
+    cursor.execute("SELECT rev,path,change_type,base_path,base_rev "
+                   "FROM node_change")
+    changes = {}
+    for rev, path, change, base_path, base_rev in cursor.fetchall():
+        try:
+            int(rev)
+        except ValueError:
+            continue # only numeric revisions are indexed
+        changes.setdefault(rev, []).append((path, change, base_path,
+                                            base_rev))
+    for rev, rev_changes in changes.items():
+        cursor.executemany("INSERT INTO node_history (path,rev,change_type,"
+                           "base_path,base_rev) VALUES (%s,%s,%s,%s,%s)",
+                           get_history_rows(rev, rev_changes))
@@ -0,0 +1,6 @@
+def do_upgrade(env, ver, cursor):
+    """Add the generation number of the `milestone_stats` table to the
+    `system` table.
+    """
+    cursor.execute("INSERT INTO system (name,value) VALUES "
+                   "('milestone_stats_generation','0')")
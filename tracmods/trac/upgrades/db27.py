@@ -0,0 +1,17 @@
+from trac.db import Table, Column, Index, DatabaseManager
+
+def do_upgrade(env, ver, cursor):
+    """Add the `dependencies` column to the `ticket_comment_cache` table.
+
+    The cached comments are dropped, they are rendered again when viewed.
+    """
+    cursor.execute("DROP TABLE ticket_comment_cache")
+    table = Table('ticket_comment_cache', key=('ticket', 'cnum'))[
+        Column('ticket', type='int'),
+        Column('cnum', type='int'),
+        Column('hash'),
+        Column('html'),
+        Column('dependencies')]
+    db_connector, _ = DatabaseManager(env)._get_connector()
+    for stmt in db_connector.to_sql(table):
+        cursor.execute(stmt)
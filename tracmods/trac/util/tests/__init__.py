@@ -1,11 +1,13 @@
 import unittest
 
-from trac.util.tests import html, text
+from trac.util.tests import html, text, workers, zipstream
 
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(html.suite())
     suite.addTest(text.suite())
+    suite.addTest(workers.suite())
+    suite.addTest(zipstream.suite())
     return suite
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+# -*- encoding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from trac.util.workers import WorkerError, WorkerPool, run_command, \
+                              PERSISTENT_WORKERS
+
+ECHO_SCRIPT = """
+import sys
+sys.stdout.write(sys.stdin.read().upper())
+sys.stderr.write(sys.argv[1])
+"""
+
+WORKER_SCRIPT = """
+import os, sys
+while 1:
+    line = sys.stdin.readline()
+    if not line:
+        break
+    data = sys.stdin.read(int(line))
+    if data == 'fail':
+        sys.stdout.write('1 6\\nfailed')
+    elif data == 'exit':
+        break
+    else:
+        out = '%d %s' % (os.getpid(), data.upper())
+        sys.stdout.write('0 %d\\n%s' % (len(out), out))
+    sys.stdout.flush()
+"""
+
+SLEEP_SCRIPT = """
+import time
+time.sleep(10)
+"""
+
+
+class WorkersTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _command(self, script, *args):
+        path = os.path.join(self.dir,
+                            'script%d.py' % len(os.listdir(self.dir)))
+        fileobj = open(path, 'w')
+        fileobj.write(script)
+        fileobj.close()
+        return ' '.join(['"%s"' % sys.executable, path] + list(args))
+
+    def test_run_command(self):
+        status, out, err = run_command(self._command(ECHO_SCRIPT, 'warning'),
+                                       'hello' * 100000)
+        self.assertEqual(0, status)
+        self.assertEqual('HELLO' * 100000, out)
+        self.assertEqual('warning', err)
+
+    def test_run_command_timeout(self):
+        if not PERSISTENT_WORKERS:
+            return
+        start = time.time()
+        self.assertRaises(WorkerError, run_command,
+                          self._command(SLEEP_SCRIPT), '', 0.5)
+        self.assert_(time.time() - start < 5)
+
+    def test_persistent_workers(self):
+        if not PERSISTENT_WORKERS:
+            return
+        pool = WorkerPool(self._command(WORKER_SCRIPT), persistent=True)
+        try:
+            status, out, err = pool.run('hello')
+            pid, out = out.split()
+            self.assertEqual((0, 'HELLO', ''), (status, out, err))
+            status, out, err = pool.run('world' * 100000)
+            self.assertEqual(pid + ' ' + 'WORLD' * 100000, out)
+            self.assertEqual((1, '', 'failed'), pool.run('fail'))
+            self.assertRaises(WorkerError, pool.run, 'exit')
+            status, out, err = pool.run('again')
+            self.assertNotEqual(pid, out.split()[0])
+        finally:
+            pool.close()
+
+    def test_persistent_worker_timeout(self):
+        if not PERSISTENT_WORKERS:
+            return
+        pool = WorkerPool(self._command(SLEEP_SCRIPT), timeout=0.5,
+                          persistent=True)
+        self.assertRaises(WorkerError, pool.run, 'hello')
+        self.assertEqual([], pool._idle)
+
+
+def suite():
+    return unittest.makeSuite(WorkersTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main()
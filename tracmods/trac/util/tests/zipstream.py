@@ -0,0 +1,66 @@
+# -*- encoding: utf-8 -*-
+
+from StringIO import StringIO
+import unittest
+import zipfile
+
+from trac.util.zipstream import ZipStream
+
+class ZipStreamTestCase(unittest.TestCase):
+
+    def _read_archive(self, files, zip64_limit=None):
+        writes = []
+        stream = ZipStream(writes.append)
+        stream.blocksize = 100
+        if zip64_limit:
+            stream.zip64_limit = zip64_limit
+        for name, content in files:
+            stream.add(name, StringIO(content), (2006, 10, 9, 13, 45, 30))
+        stream.close()
+        return zipfile.ZipFile(StringIO(''.join(writes)))
+
+    def test_empty(self):
+        archive = self._read_archive([])
+        self.assertEquals([], archive.namelist())
+
+    def test_files(self):
+        files = [(u'trunk/README', 'Hello\n' * 100),
+                 (u'trunk/empty', ''),
+                 (u'trunk/binary', ''.join([chr(i) for i in range(256)]))]
+        archive = self._read_archive(files)
+        self.assertEquals(None, archive.testzip())
+        self.assertEquals([name for name, content in files],
+                          archive.namelist())
+        for name, content in files:
+            self.assertEquals(content, archive.read(name))
+        info = archive.getinfo(u'trunk/README')
+        self.assertEquals((2006, 10, 9, 13, 45, 30), info.date_time)
+        self.assertEquals(zipfile.ZIP_DEFLATED, info.compress_type)
+        self.assertEquals(600, info.file_size)
+
+    def test_unicode_filename(self):
+        archive = self._read_archive([(u'trunk/\xe9t\xe9.txt', 'summer')])
+        self.assertEquals('summer', archive.read(u'trunk/\xe9t\xe9.txt'))
+
+    def test_zip64_count(self):
+        files = [(u'f%d' % i, chr(i % 256)) for i in xrange(65536)]
+        archive = self._read_archive(files)
+        self.assertEquals(65536, len(archive.namelist()))
+        self.assertEquals('\xff', archive.read(u'f65535'))
+
+    def test_zip64_sizes(self):
+        files = [(u'trunk/README', 'Hello\n' * 100),
+                 (u'trunk/small', 'Hi'),
+                 (u'trunk/empty', '')]
+        archive = self._read_archive(files, zip64_limit=100)
+        self.assertEquals(None, archive.testzip())
+        for name, content in files:
+            self.assertEquals(content, archive.read(name))
+        self.assertEquals(600, archive.getinfo(u'trunk/README').file_size)
+
+
+def suite():
+    return unittest.makeSuite(ZipStreamTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main()
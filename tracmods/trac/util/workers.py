@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2006 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import errno
+import os
+import select
+import signal
+import threading
+import time
+
+try:
+    import subprocess
+except ImportError:
+    subprocess = None # Python 2.3
+
+from trac.core import TracError
+from trac.util import NaivePopen
+
+__all__ = ['WorkerError', 'WorkerPool', 'run_command', 'PERSISTENT_WORKERS']
+
+# Pipes can only be waited on with `select()` on POSIX systems; elsewhere,
+# commands are run with `NaivePopen`, without timeout.
+PERSISTENT_WORKERS = subprocess is not None and os.name == 'posix'
+
+CHUNK_SIZE = 65536
+
+
+class WorkerError(TracError):
+    """Raised when an external command can't be run or doesn't answer in
+    time."""
+
+
+def run_command(command, input='', timeout=None):
+    """Run a shell command with the given `input` string, and return its
+    exit status, standard output and standard error.
+
+    The input and output are exchanged through pipes rather than temporary
+    files.  If the command doesn't exit within `timeout` seconds, it is
+    killed and a `WorkerError` is raised.
+    """
+    if not PERSISTENT_WORKERS:
+        np = NaivePopen(command, input, capturestderr=1)
+        return np.errorlevel, np.out, np.err
+    proc = _spawn(command, capture_stderr=True)
+    try:
+        out, err = _exchange(proc, input, _get_deadline(timeout),
+                             [proc.stdout, proc.stderr])
+    except:
+        _kill(proc)
+        raise
+    _close(proc)
+    return proc.wait(), out, err
+
+
+class WorkerPool(object):
+    """Run an external command on behalf of concurrent requests, with a
+    limit on the number of processes running at once and a timeout.
+
+    If `persistent` is set, the command is expected to serve requests in a
+    loop until its standard input is closed: each request is written as the
+    length of the input in decimal followed by a newline and the input
+    itself, and the command answers with its status and the length of its
+    output, separated by a space, on a line followed by the output itself
+    (or an error message, for a non-zero status).  The worker processes are
+    then kept running between requests.
+
+    Otherwise, or if the platform doesn't support it, the command is run
+    once for each request (see `run_command`).
+    """
+
+    def __init__(self, command, max_workers=1, timeout=None,
+                 persistent=False):
+        self.command = command
+        self.timeout = timeout
+        self.persistent = persistent and PERSISTENT_WORKERS
+        self._semaphore = threading.BoundedSemaphore(max(max_workers, 1))
+        self._lock = threading.Lock()
+        self._idle = []
+
+    def run(self, input):
+        """Process the given `input` string, and return the exit status,
+        the output and the error output of the command."""
+        self._semaphore.acquire()
+        try:
+            if not self.persistent:
+                return run_command(self.command, input, self.timeout)
+            proc = self._get_worker()
+            try:
+                result = _request(proc, input, _get_deadline(self.timeout))
+            except:
+                _kill(proc)
+                raise
+            self._lock.acquire()
+            try:
+                self._idle.append(proc)
+            finally:
+                self._lock.release()
+            return result
+        finally:
+            self._semaphore.release()
+
+    def close(self):
+        """Stop the idle worker processes."""
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        for proc in idle:
+            _close(proc)
+            proc.wait()
+
+    # Internal methods
+
+    def _get_worker(self):
+        self._lock.acquire()
+        try:
+            while self._idle:
+                proc = self._idle.pop()
+                if proc.poll() is None:
+                    return proc
+                _close(proc)
+        finally:
+            self._lock.release()
+        return _spawn(self.command)
+
+
+def _get_deadline(timeout):
+    if timeout:
+        return time.time() + timeout
+
+def _spawn(command, capture_stderr=False):
+    stderr = None
+    if capture_stderr:
+        stderr = subprocess.PIPE
+    # `exec` lets the command replace the shell, so that it can be killed
+    return subprocess.Popen('exec ' + command, shell=True, close_fds=True,
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=stderr)
+
+def _close(proc):
+    for pipe in (proc.stdin, proc.stdout, proc.stderr):
+        if pipe and not pipe.closed:
+            pipe.close()
+
+def _kill(proc):
+    try:
+        os.kill(proc.pid, signal.SIGKILL)
+    except OSError:
+        pass # already exited
+    _close(proc)
+    proc.wait()
+
+def _request(proc, input, deadline):
+    def parse_header(data):
+        i = data.find('\n')
+        if i < 0:
+            return None
+        try:
+            status, size = [int(f) for f in data[:i].split()]
+        except ValueError:
+            raise WorkerError('Unexpected output from worker: %r' % data[:80])
+        return status, i + 1, i + 1 + size
+
+    def complete(data):
+        header = parse_header(data)
+        return header is not None and len(data) >= header[2]
+
+    out, = _exchange(proc, '%d\n%s' % (len(input), input), deadline,
+                     [proc.stdout], complete)
+    header = parse_header(out)
+    if header is None or len(out) < header[2]:
+        raise WorkerError('Worker exited with status %s' % proc.poll())
+    status, start, end = header
+    if status:
+        return status, '', out[start:end]
+    return status, out[start:end], ''
+
+def _exchange(proc, input, deadline, streams, complete=None):
+    """Write `input` to the standard input of `proc` while reading from the
+    given `streams`, until they are all closed or until `complete` returns
+    true for the data read from the first stream.
+
+    Unless `complete` is given, the standard input is closed once `input`
+    has been written.
+    """
+    infd = proc.stdin.fileno()
+    buffers = [[] for stream in streams]
+    readers = dict([(stream.fileno(), buf)
+                    for stream, buf in zip(streams, buffers)])
+    if not input and complete is None:
+        proc.stdin.close()
+    while readers:
+        writers = []
+        if input:
+            writers = [infd]
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                raise WorkerError('Timed out waiting for the command')
+        try:
+            r, w, x = select.select(readers.keys(), writers, [], timeout)
+        except select.error, e:
+            if e.args[0] == errno.EINTR:
+                continue
+            raise
+        if w:
+            try:
+                written = os.write(infd, input[:CHUNK_SIZE])
+            except OSError, e:
+                if e.errno != errno.EPIPE:
+                    raise
+                written = len(input) # the process stopped reading
+            input = input[written:]
+            if not input and complete is None:
+                proc.stdin.close()
+        for fd in r:
+            data = os.read(fd, CHUNK_SIZE)
+            if data:
+                readers[fd].append(data)
+            else:
+                del readers[fd]
+        if r and complete and complete(''.join(buffers[0])):
+            break
+    return [''.join(buf) for buf in buffers]
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2006 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import struct
+import zlib
+
+__all__ = ['ZipStream']
+
+
+class ZipStream(object):
+    """Write a ZIP archive to a stream which can't seek, such as the response
+    to a request.
+
+    Unlike `zipfile.ZipFile`, the content of each file is compressed and
+    written block by block, so that the archive never needs to be held in
+    memory: the sizes and CRC of each file are written in a data descriptor
+    following its content, rather than in its local header.
+
+    The ZIP64 extensions are used for the sizes and offsets reaching
+    `zip64_limit`, and when the archive holds 65535 files or more.
+    """
+
+    blocksize = 65536
+    zip64_limit = 0xffffffff
+
+    def __init__(self, write):
+        self._write = write
+        self._offset = 0
+        self._entries = []
+
+    def add(self, filename, fileobj, date_time):
+        """Add a file to the archive.
+
+        `filename` is a `unicode` string, which is stored as UTF-8, `fileobj`
+        an object with a `read(size)` method returning the content of the file
+        and `date_time` its modification time, as a `(year, month, day, hour,
+        minute, second)` tuple.
+        """
+        name = filename.encode('utf-8')
+        flags = 0x08 | 0x800 # data descriptor, UTF-8 filename
+        year, month, day, hour, minute, second = date_time[:6]
+        dosdate = (year - 1980) << 9 | month << 5 | day
+        dostime = hour << 11 | minute << 5 | second / 2
+        offset = self._offset
+        self._emit(struct.pack('<4s5H3L2H', 'PK\x03\x04', 20, flags, 8,
+                               dostime, dosdate, 0, 0, 0, len(name), 0))
+        self._emit(name)
+
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                      zlib.DEFLATED, -15)
+        crc = size = compressed_size = 0
+        while 1:
+            data = fileobj.read(self.blocksize)
+            if not data:
+                break
+            crc = zlib.crc32(data, crc)
+            size += len(data)
+            data = compressor.compress(data)
+            compressed_size += len(data)
+            self._emit(data)
+        data = compressor.flush()
+        compressed_size += len(data)
+        self._emit(data)
+        crc &= 0xffffffff
+        if size >= self.zip64_limit or compressed_size >= self.zip64_limit:
+            self._emit(struct.pack('<4sL2Q', 'PK\x07\x08', crc,
+                                   compressed_size, size))
+        else:
+            self._emit(struct.pack('<4s3L', 'PK\x07\x08', crc,
+                                   compressed_size, size))
+        self._entries.append((name, flags, dostime, dosdate, crc,
+                              compressed_size, size, offset))
+
+    def close(self):
+        """Write the central directory which ends the archive."""
+        offset = self._offset
+        for name, flags, dostime, dosdate, crc, compressed_size, size, \
+                header_offset in self._entries:
+            # The values which don't fit are replaced by 0xffffffff, and
+            # stored in a ZIP64 extra field instead
+            values = []
+            if size >= self.zip64_limit:
+                values.append(size)
+                size = 0xffffffff
+            if compressed_size >= self.zip64_limit:
+                values.append(compressed_size)
+                compressed_size = 0xffffffff
+            if header_offset >= self.zip64_limit:
+                values.append(header_offset)
+                header_offset = 0xffffffff
+            extra = ''
+            version = 20
+            if values:
+                extra = struct.pack('<2H%dQ' % len(values), 1,
+                                    8 * len(values), *values)
+                version = 45
+            self._emit(struct.pack('<4s6H3L5H2L', 'PK\x01\x02', version,
+                                   version, flags, 8, dostime, dosdate, crc,
+                                   compressed_size, size, len(name),
+                                   len(extra), 0, 0, 0, 0644 << 16,
+                                   header_offset))
+            self._emit(name)
+            self._emit(extra)
+
+        count = len(self._entries)
+        size = self._offset - offset
+        if count >= 0xffff or size >= self.zip64_limit or \
+                offset >= self.zip64_limit:
+            # ZIP64 end of central directory record, and its locator
+            end_offset = self._offset
+            self._emit(struct.pack('<4sQ2H2L4Q', 'PK\x06\x06', 44, 45, 45,
+                                   0, 0, count, count, size, offset))
+            self._emit(struct.pack('<4sLQL', 'PK\x06\x07', 0, end_offset, 1))
+            count = min(count, 0xffff)
+            if size >= self.zip64_limit:
+                size = 0xffffffff
+            if offset >= self.zip64_limit:
+                offset = 0xffffffff
+        self._emit(struct.pack('<4s4H2LH', 'PK\x05\x06', 0, 0, count, count,
+                               size, offset, 0))
+
+    # Internal methods
+
+    def _emit(self, data):
+        if data:
+            self._write(data)
+            self._offset += len(data)
@@ -109,9 +109,15 @@ class RepositoryManager(Component):
             assert tid == threading._get_ident()
             try:
                 self._lock.acquire()
-                self._cache.pop(tid, None)
+                repos = self._cache.pop(tid, None)
             finally:
                 self._lock.release()
+            if repos:
+                # Let the connector release or reuse the connection
+                try:
+                    repos.close()
+                except NotImplementedError:
+                    pass
 
 
 class NoSuchChangeset(TracError):
@@ -182,6 +188,23 @@ class Repository(object):
         """
         raise NotImplementedError
 
+    def get_listing(self, node):
+        """Generator that yields the entries of the directory `node`, along
+        with the changesets in which they were last changed.
+
+        Each entry is a `(node, changeset)` tuple, where `changeset` is `None`
+        if the changeset of the entry's revision can't be retrieved.
+        The entries are returned in no particular order.
+        """
+        changesets = {}
+        for entry in node.get_entries():
+            if entry.rev not in changesets:
+                try:
+                    changesets[entry.rev] = self.get_changeset(entry.rev)
+                except NoSuchChangeset:
+                    changesets[entry.rev] = None
+            yield entry, changesets[entry.rev]
+
     def get_oldest_rev(self):
         """Return the oldest revision stored in the repository."""
         raise NotImplementedError
@@ -222,6 +245,13 @@ class Repository(object):
         row = cursor.fetchone()
         return row and row[0] or None
 
+    def get_node_history(self, path, rev=None, limit=None):
+        """Retrieve the history of the node at the given `path` and `rev`.
+
+        The result format is the same as the one of `Node.get_history()`.
+        """
+        return self.get_node(path, rev).get_history(limit)
+
     def get_path_history(self, path, rev=None, limit=None):
         """Retrieve all the revisions containing this path
 
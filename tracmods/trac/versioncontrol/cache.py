@@ -14,6 +14,8 @@
 #
 # Author: Christopher Lenz <cmlenz@gmx.de>
 
+import posixpath
+
 from trac.core import TracError
 from trac.versioncontrol import Changeset, Node, Repository, Authorizer, \
                                 NoSuchChangeset
@@ -30,6 +32,46 @@ CACHE_YOUNGEST_REV = 'youngest_rev'
 CACHE_METADATA_KEYS = (CACHE_REPOSITORY_DIR, CACHE_YOUNGEST_REV)
 
 
+def get_history_rows(rev, changes):
+    """Return the `node_history` rows for the changes of a revision.
+
+    `changes` is a list of `(path, change_type, base_path, base_rev)` tuples,
+    as stored in the `node_change` table.  Each changed path gets a row
+    describing its change, and each of its parent directories, up to the
+    root (the `''` path), gets an edit row.  The source of a move also gets
+    a deletion row, as `node_change` only records the destination.
+    Returns a list of `(path, rev, change_type, base_path, base_rev)` tuples.
+    """
+    priority = {'E': 0, 'D': 1, 'A': 2, 'C': 2, 'M': 2}
+    rows = {}
+    def add_row(path, change, base_path, base_rev):
+        if path not in rows or \
+               priority[change] >= priority[rows[path][0]]:
+            rows[path] = (change, base_path, base_rev)
+        while path:
+            path = '/' in path and path[:path.rindex('/')] or ''
+            if path in rows:
+                break
+            rows[path] = ('E', None, None)
+    for path, change, base_path, base_rev in changes:
+        path = path.strip('/')
+        if base_path is None or base_rev in (None, '', -1, '-1'):
+            base_path = base_rev = None
+        else:
+            base_path, base_rev = base_path.strip('/'), int(base_rev)
+        add_row(path, change, base_path, base_rev)
+        if change == 'M' and base_path is not None:
+            add_row(base_path, 'D', base_path, base_rev)
+    return [(path, int(rev)) + row for path, row in rows.items()]
+
+def _get_parent_paths(path):
+    paths = [path]
+    while '/' in path:
+        path = path[:path.rindex('/')]
+        paths.append(path)
+    return paths
+
+
 class CachedRepository(Repository):
 
     def __init__(self, db, repos, authz, log):
@@ -158,6 +200,7 @@ class CachedRepository(Repository):
                     # 1.2. now *only* one process was able to get there
                     #      (i.e. there *shouldn't* be any race condition here)
 
+                    changes = []
                     for path,kind,action,bpath,brev in cset.get_changes():
                         self.log.debug("Caching node change in [%s]: %s"
                                        % (next_youngest,
@@ -170,6 +213,17 @@ class CachedRepository(Repository):
                                        "VALUES (%s,%s,%s,%s,%s,%s)",
                                        (str(next_youngest),
                                         path, kind, action, bpath, brev))
+                        changes.append((path, action, bpath, brev))
+
+                    # 1.2.1. index the history of the changed paths
+                    #        (only for numeric revisions, see `get_history`)
+                    if changes and self._has_history_index(next_youngest):
+                        cursor.executemany("INSERT INTO node_history "
+                                           " (path,rev,change_type, "
+                                           "  base_path,base_rev) "
+                                           "VALUES (%s,%s,%s,%s,%s)",
+                                           get_history_rows(next_youngest,
+                                                            changes))
 
                     # 1.3. iterate (1.1 should always succeed now)
                     self.youngest = next_youngest                    
@@ -186,6 +240,72 @@ class CachedRepository(Repository):
     def get_node(self, path, rev=None):
         return self.repos.get_node(path, rev)
 
+    def get_listing(self, node):
+        """Yield the entries of the directory `node`, read from the
+        `node_listing` table.
+
+        As the content of a directory can't change without its revision
+        changing too, the listing is stored once for every `(path, rev)` pair
+        of the directory, the first time it is requested.  It is stored
+        without any permission checking, which is done when it is read.
+        """
+        path, rev = node.path, str(node.rev)
+        cursor = self.db.cursor()
+        for i in range(2):
+            cursor.execute("SELECT l.name,l.node_type,l.size,l.created_rev,"
+                           "r.time,r.author,r.message FROM node_listing l "
+                           " LEFT OUTER JOIN revision r ON r.rev=l.created_rev "
+                           "WHERE l.path=%s AND l.rev=%s", (path, rev))
+            rows = cursor.fetchall()
+            if rows:
+                break
+            self._cache_listing(cursor, node)
+
+        changesets = {}
+        for name, kind, size, created_rev, date, author, message in rows:
+            if not name: # the directory itself
+                continue
+            entry_path = posixpath.join(path, name)
+            if not self.authz.has_permission(entry_path):
+                continue
+            if created_rev not in changesets:
+                changeset = None
+                if date is not None:
+                    changeset = Changeset(self.repos.normalize_rev(created_rev),
+                                          message, author, int(date))
+                changesets[created_rev] = changeset
+            changeset = changesets[created_rev]
+            entry_rev = changeset and changeset.rev or \
+                        self.repos.normalize_rev(created_rev)
+            yield (CachedNode(self.repos, entry_path, entry_rev,
+                              _kindmap[kind], size, node.rev), changeset)
+
+    def _cache_listing(self, cursor, node):
+        authz = self.repos.authz
+        self.repos.authz = Authorizer() # remove permission checking
+        try:
+            node = self.repos.get_node(node.path, node.rev)
+            kindmap = dict(zip(_kindmap.values(), _kindmap.keys()))
+            path, rev = node.path, str(node.rev)
+            rows = [(path, rev, '', 'D', None, rev)]
+            for entry in node.get_entries():
+                size = None
+                if entry.isfile:
+                    size = entry.content_length
+                rows.append((path, rev, entry.name, kindmap[entry.kind], size,
+                             str(entry.rev)))
+        finally:
+            self.repos.authz = authz
+        try:
+            cursor.executemany("INSERT INTO node_listing (path,rev,name,"
+                               "node_type,size,created_rev) "
+                               "VALUES (%s,%s,%s,%s,%s,%s)", rows)
+            self.db.commit()
+        except Exception, e: # cached by another request in the meantime
+            self.log.warning('Listing of %s@%s already cached: %s' %
+                             (path, rev, e))
+            self.db.rollback()
+
     def has_node(self, path, rev):
         return self.repos.has_node(path, rev)
 
@@ -204,8 +324,145 @@ class CachedRepository(Repository):
     def rev_older_than(self, rev1, rev2):
         return self.repos.rev_older_than(rev1, rev2)
 
+    def get_node_history(self, path, rev=None, limit=None):
+        """Retrieve the history of the node at `path` in revision `rev`
+        from the `node_history` table."""
+        rev = self.normalize_rev(rev)
+        if not self._has_history_index(rev):
+            return self.repos.get_node_history(path, rev, limit)
+        return self._get_node_history(path.strip('/'), rev, limit)
+
+    def _get_node_history(self, path, rev, limit):
+        newer = None # 'newer' is the previously seen history tuple
+        for p, r in self._get_history(self.db.cursor(), path, rev, limit):
+            older = (p, r, Changeset.ADD)
+            if newer:
+                change = newer[0] == older[0] and Changeset.EDIT or \
+                         Changeset.COPY
+                yield self.normalize_path(newer[0]), newer[1], change
+            newer = older
+        if newer:
+            yield self.normalize_path(newer[0]), newer[1], newer[2]
+
     def get_path_history(self, path, rev=None, limit=None):
-        return self.repos.get_path_history(path, rev, limit)
+        """Retrieve the revisions in which `path` was added, copied or
+        deleted, from the `node_history` table."""
+        rev = self.normalize_rev(rev)
+        if not self._has_history_index(rev):
+            return self.repos.get_path_history(path, rev, limit)
+        return self._get_path_history(path.strip('/'), rev, limit)
+
+    def _get_path_history(self, path, rev, limit):
+        # Same logic as `SubversionRepository.get_path_history`, but jumping
+        # from one creation or deletion of the path to the previous one
+        cursor = self.db.cursor()
+        expect_deletion = False
+        while rev > 0:
+            event = self._get_last_event(cursor, path, rev)
+            if not self._exists(cursor, path, rev, event):
+                if not event:
+                    break
+                expect_deletion = True
+                rev = event[1] - 1
+                continue
+            if expect_deletion:
+                # it was missing, now it's there again:
+                #  rev+1 must be a delete
+                yield self.normalize_path(path), rev + 1, Changeset.DELETE
+            newer = None # 'newer' is the previously seen history tuple
+            older = None # 'older' is the currently examined history tuple
+            for p, r in self._get_history(cursor, path, rev, limit):
+                older = (p, r, Changeset.ADD)
+                rev = r - 1
+                if newer:
+                    if older[0] == path:
+                        # still on the path: 'newer' was an edit
+                        yield (self.normalize_path(newer[0]), newer[1],
+                               Changeset.EDIT)
+                    else:
+                        # the path changed: 'newer' was a copy
+                        rev = newer[1] - 1 # restart before the copy op
+                        yield (self.normalize_path(newer[0]), newer[1],
+                               Changeset.COPY)
+                        older = (older[0], older[1], 'unknown')
+                        break
+                newer = older
+            if not older:
+                break
+            # either a real ADD or the source of a COPY
+            yield self.normalize_path(older[0]), older[1], older[2]
+            expect_deletion = False
+
+    def _has_history_index(self, rev):
+        # The `node_history` table is only maintained for repositories with
+        # numeric revisions, as it relies on their ordering
+        try:
+            int(rev)
+            return True
+        except (TypeError, ValueError):
+            return False
+
+    def _get_history(self, cursor, path, rev, limit=None):
+        """Yield the `(path, rev)` pairs in which the node at `path` in
+        revision `rev` changed, following copies.
+
+        In each step, the node is looked up back to the revision in which it
+        (or one of its parent directories) was added or copied, then in the
+        source of the copy.
+        """
+        count = 0
+        while True:
+            event = self._get_last_event(cursor, path, rev)
+            created = event and event[1] or 0
+            sql = "SELECT rev FROM node_history WHERE path=%s AND rev<=%s " \
+                  "AND rev>=%s ORDER BY rev DESC"
+            args = [path, rev, created]
+            if limit:
+                sql += " LIMIT %s"
+                args.append(limit - count + 1)
+            cursor.execute(sql, args)
+            revs = [int(r) for r, in cursor]
+            if event and created not in revs:
+                revs.append(created) # created with a parent directory
+            if self.authz.has_permission(self.normalize_path(path)):
+                for r in revs:
+                    if limit and count >= limit:
+                        return
+                    yield path, r
+                    count += 1
+            if not event or event[2] not in ('C', 'M') or not event[3]:
+                return
+            path, rev = self._get_copy_source(path, event)
+
+    def _get_last_event(self, cursor, path, rev):
+        """Return the latest addition, copy, move or deletion of `path` or
+        of one of its parent directories, up to revision `rev`, as a
+        `(path, rev, change_type, base_path, base_rev)` tuple."""
+        paths = _get_parent_paths(path)
+        cursor.execute("SELECT path,rev,change_type,base_path,base_rev "
+                       "FROM node_history WHERE path IN (%s) AND rev<=%%s "
+                       "AND change_type IN ('A','C','M','D') "
+                       "ORDER BY rev DESC, LENGTH(path) DESC LIMIT 1"
+                       % ','.join(['%s'] * len(paths)), paths + [rev])
+        row = cursor.fetchone()
+        if row:
+            return row[0], int(row[1]), row[2], row[3], row[4]
+
+    def _get_copy_source(self, path, event):
+        base_path = event[3] + path[len(event[0]):]
+        return base_path.strip('/'), int(event[4])
+
+    def _exists(self, cursor, path, rev, event):
+        while path:
+            if not event or event[2] == 'D':
+                return False
+            if event[0] == path:
+                return True
+            if event[2] == 'A' or not event[3]:
+                return False
+            path, rev = self._get_copy_source(path, event)
+            event = self._get_last_event(cursor, path, rev)
+        return True
 
     def normalize_path(self, path):
         return self.repos.normalize_path(path)
@@ -217,6 +474,48 @@ class CachedRepository(Repository):
         return self.repos.get_changes(old_path, old_rev, new_path, new_rev, ignore_ancestry)
 
 
+class CachedNode(Node):
+    """Entry of a directory listing read from the `node_listing` table.
+
+    Only the name, kind, size and revision of the entry are known without
+    accessing the repository.
+    """
+
+    def __init__(self, repos, path, rev, kind, size, parent_rev):
+        Node.__init__(self, path, rev, kind)
+        self.created_rev = rev
+        self.repos = repos
+        self.size = size
+        self.parent_rev = parent_rev
+        self._node = None
+
+    def get_content(self):
+        return self._get_node().get_content()
+
+    def get_entries(self):
+        return self._get_node().get_entries()
+
+    def get_history(self, limit=None):
+        return self._get_node().get_history(limit)
+
+    def get_properties(self):
+        return self._get_node().get_properties()
+
+    def get_content_length(self):
+        return self.size
+
+    def get_content_type(self):
+        return self._get_node().get_content_type()
+
+    def get_last_modified(self):
+        return self._get_node().get_last_modified()
+
+    def _get_node(self):
+        if self._node is None:
+            self._node = self.repos.get_node(self.path, self.parent_rev)
+        return self._node
+
+
 class CachedChangeset(Changeset):
 
     def __init__(self, rev, db, authz):
@@ -19,7 +19,8 @@ from trac.util.html import escape, Markup
 from difflib import SequenceMatcher
 import re
 
-__all__ = ['get_diff_options', 'hdf_diff', 'unified_diff']
+__all__ = ['get_diff_algorithms', 'get_diff_options', 'hdf_diff',
+           'unified_diff']
 
 
 def _get_change_extent(str1, str2):
@@ -39,10 +40,153 @@ def _get_change_extent(str1, str2):
         end -= 1
     return (start, end + 1)
 
+class HistogramMatcher(object):
+    """Line matcher implementing the histogram diff algorithm.
+
+    The lines of each region to compare are matched around a sequence of
+    common lines containing the line which occurs the least in the old
+    region, and the regions before and after that sequence are compared in
+    turn.  Among such sequences, the one nearest the middle of the new region
+    is chosen, so that the regions are split evenly.  Lines are interned
+    first, so that they are compared as integers.  Regions where every
+    common line occurs more than `max_chain` times are handed to
+    `SequenceMatcher`.
+
+    Unlike `SequenceMatcher`, which is quadratic in the worst case, this runs
+    in about linear time on typical source files, and produces diffs which
+    better follow the structure of the code.  It offers the same
+    `get_matching_blocks()` and `get_opcodes()` methods.
+    """
+
+    max_chain = 64
+
+    def __init__(self, isjunk, a, b):
+        ids = {}
+        self.a = [ids.setdefault(line, len(ids)) for line in a]
+        self.b = [ids.setdefault(line, len(ids)) for line in b]
+        self.matching_blocks = None
+
+    def get_matching_blocks(self):
+        if self.matching_blocks is None:
+            blocks = []
+            regions = [(0, len(self.a), 0, len(self.b))]
+            while regions:
+                blocks += self._match_region(regions, *regions.pop())
+            blocks.sort()
+            # Join adjacent blocks
+            self.matching_blocks = []
+            i = j = n = 0
+            for i2, j2, n2 in blocks:
+                if i + n == i2 and j + n == j2:
+                    n += n2
+                else:
+                    if n:
+                        self.matching_blocks.append((i, j, n))
+                    i, j, n = i2, j2, n2
+            if n:
+                self.matching_blocks.append((i, j, n))
+            self.matching_blocks.append((len(self.a), len(self.b), 0))
+        return self.matching_blocks
+
+    def get_opcodes(self):
+        i = j = 0
+        opcodes = []
+        for ai, bj, size in self.get_matching_blocks():
+            tag = ''
+            if i < ai and j < bj:
+                tag = 'replace'
+            elif i < ai:
+                tag = 'delete'
+            elif j < bj:
+                tag = 'insert'
+            if tag:
+                opcodes.append((tag, i, ai, j, bj))
+            i, j = ai + size, bj + size
+            if size:
+                opcodes.append(('equal', ai, i, bj, j))
+        return opcodes
+
+    def _match_region(self, regions, alo, ahi, blo, bhi):
+        """Return the matching blocks found in a region, and append the
+        sub-regions remaining to be compared to `regions`."""
+        a, b = self.a, self.b
+        blocks = []
+
+        # Common prefix and suffix
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        if alo > start:
+            blocks.append((start, blo - (alo - start), alo - start))
+        end = ahi
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        if ahi < end:
+            blocks.append((ahi, bhi, end - ahi))
+        if alo == ahi or blo == bhi:
+            return blocks
+
+        # Histogram of the lines of the old region
+        occurrences = {}
+        for i in xrange(alo, ahi):
+            occurrences.setdefault(a[i], []).append(i)
+
+        # Common sequence around the least frequent line, nearest the middle
+        best = None # (count, distance to the middle, i, j, length)
+        middle = blo + bhi
+        j = blo
+        while j < bhi:
+            positions = occurrences.get(b[j])
+            if not positions or len(positions) > self.max_chain or \
+                   best and len(positions) > best[0]:
+                j += 1
+                continue
+            next_j = j + 1
+            for i in positions:
+                si, sj = i, j
+                while si > alo and sj > blo and a[si - 1] == b[sj - 1]:
+                    si -= 1
+                    sj -= 1
+                ei, ej = i + 1, j + 1
+                while ei < ahi and ej < bhi and a[ei] == b[ej]:
+                    ei += 1
+                    ej += 1
+                candidate = (len(positions), abs(sj + ej - middle), si, sj,
+                             ei - si)
+                if not best or candidate < best:
+                    best = candidate
+                next_j = max(next_j, ej)
+            j = next_j
+
+        if best:
+            count, distance, i, j, length = best
+            blocks.append((i, j, length))
+            regions.append((alo, i, blo, j))
+            regions.append((i + length, ahi, j + length, bhi))
+        else:
+            matcher = SequenceMatcher(None, a[alo:ahi], b[blo:bhi])
+            blocks += [(alo + i, blo + j, n) for i, j, n
+                       in matcher.get_matching_blocks() if n]
+        return blocks
+
+
+_matchers = {'difflib': SequenceMatcher, 'histogram': HistogramMatcher}
+
+def get_diff_algorithms():
+    """Return the names of the available line diff algorithms, for the
+    `[diff] algorithm` option."""
+    algorithms = _matchers.keys()
+    algorithms.sort()
+    return algorithms
+
 def _get_opcodes(fromlines, tolines, ignore_blank_lines=False,
-                 ignore_case=False, ignore_space_changes=False):
+                 ignore_case=False, ignore_space_changes=False,
+                 algorithm='difflib'):
     """
-    Generator built on top of SequenceMatcher.get_opcodes().
+    Generator built on top of SequenceMatcher.get_opcodes(), or on the
+    equivalent method of the matcher of another `algorithm`.
     
     This function detects line changes that should be ignored and emits them
     as tagged as 'equal', possibly joined with the preceding and/or following
@@ -70,7 +214,8 @@ def _get_opcodes(fromlines, tolines, ignore_blank_lines=False,
                     return False
             return True
 
-    matcher = SequenceMatcher(None, fromlines, tolines)
+    matcher = _matchers.get(algorithm, SequenceMatcher)(None, fromlines,
+                                                        tolines)
     previous = None
     for tag, i1, i2, j1, j2 in matcher.get_opcodes():
         if tag == 'equal':
@@ -128,7 +273,8 @@ def _group_opcodes(opcodes, n=3):
         yield group
 
 def hdf_diff(fromlines, tolines, context=None, tabwidth=8,
-             ignore_blank_lines=0, ignore_case=0, ignore_space_changes=0):
+             ignore_blank_lines=0, ignore_case=0, ignore_space_changes=0,
+             algorithm='difflib'):
     """
     Return an array that is adequate for adding the the HDF data set for HTML
     rendering of the differences.
@@ -173,7 +319,7 @@ def hdf_diff(fromlines, tolines, context=None, tabwidth=8,
 
     changes = []
     opcodes = _get_opcodes(fromlines, tolines, ignore_blank_lines, ignore_case,
-                           ignore_space_changes)
+                           ignore_space_changes, algorithm)
     for group in _group_opcodes(opcodes, context):
         blocks = []
         last_tag = None
@@ -210,9 +356,9 @@ def hdf_diff(fromlines, tolines, context=None, tabwidth=8,
     return changes
 
 def unified_diff(fromlines, tolines, context=None, ignore_blank_lines=0,
-                 ignore_case=0, ignore_space_changes=0):
+                 ignore_case=0, ignore_space_changes=0, algorithm='difflib'):
     opcodes = _get_opcodes(fromlines, tolines, ignore_blank_lines, ignore_case,
-                           ignore_space_changes)
+                           ignore_space_changes, algorithm)
     for group in _group_opcodes(opcodes, context):
         i1, i2, j1, j2 = group[0][1], group[-1][2], group[0][3], group[-1][4]
         if i1 == 0 and i2 == 0:
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2006 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+from trac.config import IntOption, Option
+from trac.filecache import FileCache
+from trac.mimeview.api import Mimeview
+
+__all__ = ['DiffCache']
+
+
+class DiffCache(FileCache):
+    """Keep the differences computed between file revisions on disk.
+
+    As the revisions of a repository never change, the differences between
+    two `path@rev` pairs, computed with the same options, can be reused by all
+    the subsequent views of a changeset.  Each result is stored in a file
+    named after a hash of the repository, the nodes and their content type,
+    the `[trac] default_charset` used to decode them and the options.
+
+    The total size of the cache is kept below `[changeset] diff_cache_size`
+    by removing the least recently used files.
+    """
+
+    cache_dir = Option('changeset', 'diff_cache_dir', 'cache/diff',
+        """Directory where the differences between file revisions are cached,
+        relative to the environment directory (''since 0.10'').""")
+
+    max_size = IntOption('changeset', 'diff_cache_size', 50000000,
+        """Maximum total size in bytes of the cached differences between file
+        revisions, `0` disables the cache (''since 0.10'').""")
+
+    # Public API
+
+    def make_key(self, repos, old_node, new_node, *options):
+        """Return the cache key for the differences between two nodes of the
+        given repository (any of which can be `None`), computed with the
+        given options."""
+        parts = [repos.name]
+        for node in (old_node, new_node):
+            if node:
+                parts += [node.path, node.rev, node.content_type]
+            else:
+                parts += [None, None, None]
+        parts.append(Mimeview(self.env).default_charset)
+        parts += list(options)
+        return FileCache.make_key(self, *parts)
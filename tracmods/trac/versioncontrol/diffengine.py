@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2006 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import threading
+import time
+
+from trac.config import IntOption
+from trac.core import *
+from trac.versioncontrol.diff import hdf_diff
+from trac.versioncontrol.diffcache import DiffCache
+
+try:
+    import multiprocessing
+except ImportError:
+    multiprocessing = None
+
+__all__ = ['DiffEngine']
+
+
+def _hdf_diff(old_content, new_content, context, tabwidth, options,
+              algorithm='difflib'):
+    # Runs in the worker processes, so it has to be a module level function
+    return hdf_diff(old_content.splitlines(), new_content.splitlines(),
+                    context, tabwidth,
+                    ignore_blank_lines='-B' in options,
+                    ignore_case='-i' in options,
+                    ignore_space_changes='-b' in options,
+                    algorithm=algorithm)
+
+
+class DiffEngine(Component):
+    """Compute the differences of several files for the changeset view.
+
+    The differences can be computed by a pool of worker processes, which
+    requires the `multiprocessing` module (Python 2.6 or later), and within a
+    deadline: the files whose differences are not ready in time are left out,
+    so that they can be viewed separately.  Their differences are still
+    stored in the `DiffCache` when they are ready.
+    """
+
+    workers = IntOption('changeset', 'diff_workers', 0,
+        """Number of worker processes computing the differences of the files
+        of a changeset, `0` computes them in the request thread
+        (''since 0.10'').""")
+
+    timeout = IntOption('changeset', 'diff_timeout', 0,
+        """Maximum time in seconds spent computing the differences of the
+        files of a changeset, `0` for no limit.  The differences of the
+        remaining files are replaced by links to view them separately
+        (''since 0.10'').""")
+
+    def __init__(self):
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def get_deadline(self):
+        """Return the time until which differences should be computed for a
+        request starting now, or `None` if there is no limit."""
+        if self.timeout > 0:
+            return time.time() + self.timeout
+        return None
+
+    def hdf_diffs(self, tasks, deadline=None):
+        """Compute the differences of several files, in the format returned
+        by `hdf_diff`.
+
+        `tasks` is a list of `(key, args)` tuples, where `key` is the
+        `DiffCache` key of the differences and `args` the `(old_content,
+        new_content, context, tabwidth, options, algorithm)` tuple describing
+        them.
+        Returns a dictionary of the differences computed before the
+        `deadline`, by key.
+        """
+        diff_cache = DiffCache(self.env)
+        results = {}
+        pool = self._get_pool()
+        if not pool or len(tasks) < 2:
+            for key, args in tasks:
+                if deadline and time.time() > deadline:
+                    break
+                results[key] = _hdf_diff(*args)
+                diff_cache.store(key, results[key])
+            return results
+
+        def store(key):
+            def callback(result):
+                diff_cache.store(key, result)
+            return callback
+        pending = [(key, pool.apply_async(_hdf_diff, args,
+                                          callback=store(key)))
+                   for key, args in tasks]
+        for key, result in pending:
+            timeout = None
+            if deadline:
+                timeout = max(deadline - time.time(), 0)
+            try:
+                results[key] = result.get(timeout)
+            except multiprocessing.TimeoutError:
+                pass
+        if len(results) < len(pending):
+            self.log.info('Differences of %d files not ready in time',
+                          len(pending) - len(results))
+        return results
+
+    # Internal methods
+
+    def _get_pool(self):
+        if self.workers <= 0 or not multiprocessing:
+            return None
+        self._lock.acquire()
+        try:
+            if self._pool is None:
+                self._pool = multiprocessing.Pool(self.workers)
+            return self._pool
+        finally:
+            self._lock.release()
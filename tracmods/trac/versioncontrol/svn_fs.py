@@ -43,9 +43,14 @@ import os.path
 import time
 import weakref
 import posixpath
+try:
+    import threading
+except ImportError:
+    import dummy_threading as threading
 
+from trac.config import IntOption
 from trac.core import *
-from trac.versioncontrol import Changeset, Node, Repository, \
+from trac.versioncontrol import Authorizer, Changeset, Node, Repository, \
                                 IRepositoryConnector, \
                                 NoSuchChangeset, NoSuchNode
 from trac.versioncontrol.cache import CachedRepository
@@ -72,6 +77,9 @@ _kindmap = {core.svn_node_dir: Node.DIRECTORY,
 
 
 application_pool = None
+
+# Maximum number of nodes shared by the calls to `get_node()` in a request
+MAX_CACHED_NODES = 1000
     
 def _get_history(svn_path, authz, fs_ptr, pool, start, end, limit=None):
     """`svn_path` is assumed to be a UTF-8 encoded string.
@@ -240,10 +248,65 @@ if has_subversion:
     Pool()
 
 
+class RevisionRootCache(object):
+    """Keep the revision roots of a repository open, so that they can be
+    shared by the nodes and changesets of that repository.
+
+    At most `size` roots are kept, in a dedicated pool; beyond that, the
+    roots are opened in the pool given by the caller.  As the roots handed
+    out must stay valid while they are in use, the cache is only emptied by
+    an explicit call to `recycle()`.
+    """
+
+    def __init__(self, fs_ptr, parent_pool, size, stats):
+        self.fs_ptr = fs_ptr
+        self.size = size
+        self.stats = stats
+        self.pool = Pool(parent_pool)
+        self._roots = {}
+
+    def get(self, rev, pool):
+        """Return the root of revision `rev`, opened in `pool` if it is
+        neither cached nor can be."""
+        root = self._roots.get(rev)
+        if root is not None:
+            self.stats['root_hits'] += 1
+            return root
+        self.stats['roots_opened'] += 1
+        if len(self._roots) < self.size:
+            root = fs.revision_root(self.fs_ptr, rev, self.pool())
+            self._roots[rev] = root
+        else:
+            root = fs.revision_root(self.fs_ptr, rev, pool())
+        return root
+
+    def recycle(self):
+        """Free the cached roots if the cache is full, so that it can be
+        filled again with the revisions used next."""
+        if self._roots and len(self._roots) >= self.size:
+            self._roots = {}
+            self.pool.clear()
+            self.stats['pool_recycles'] += 1
+
+
 class SubversionConnector(Component):
 
     implements(IRepositoryConnector)
 
+    cached_roots = IntOption('svn', 'cached_roots', 50,
+        """Maximum number of revision roots kept open by each connection to
+        the Subversion repository.  The connections are reused by the
+        following requests, along with their revision roots
+        (''since 0.10'').""")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {} # directory -> connections not in use
+        # The memory of the connections is bounded by `cached_roots` rather
+        # than measured, the bindings don't expose the size of APR pools
+        self.stats = {'repositories_opened': 0, 'repositories_reused': 0,
+                      'roots_opened': 0, 'root_hits': 0, 'pool_recycles': 0}
+
     def get_supported_types(self):
         global has_subversion
         if has_subversion:
@@ -256,13 +319,49 @@ class SubversionConnector(Component):
         The repository is generally wrapped in a `CachedRepository`,
         unless `direct-svn-fs` is the specified type.
         """
-        repos = SubversionRepository(dir, None, self.log)
+        repos = self._checkout(dir)
         crepos = CachedRepository(self.env.get_db_cnx(), repos, None, self.log)
         if authname:
             authz = SubversionAuthorizer(self.env, crepos, authname)
             repos.authz = crepos.authz = authz
         return crepos
-            
+
+    # Internal methods
+
+    def _checkout(self, dir):
+        self._lock.acquire()
+        try:
+            idle = self._idle.get(dir)
+            if idle:
+                repos = idle.pop()
+                self.stats['repositories_reused'] += 1
+            else:
+                repos = None
+                self.stats['repositories_opened'] += 1
+        finally:
+            self._lock.release()
+        if repos:
+            repos.authz = Authorizer()
+            repos.clear()
+        else:
+            repos = SubversionRepository(dir, None, self.log,
+                                         self.cached_roots, self.stats)
+            repos._dir = dir
+        # Called by `close()`, at the end of the request
+        repos._release = self._checkin
+        return repos
+
+    def _checkin(self, repos):
+        self._lock.acquire()
+        try:
+            self._idle.setdefault(repos._dir, []).append(repos)
+        finally:
+            self._lock.release()
+        self.log.debug('Subversion connections: %(repositories_opened)d '
+                       'opened, %(repositories_reused)d reused; revision '
+                       'roots: %(roots_opened)d opened, %(root_hits)d reused, '
+                       '%(pool_recycles)d pool recycles' % self.stats)
+
 
 
 class SubversionRepository(Repository):
@@ -270,9 +369,10 @@ class SubversionRepository(Repository):
     Repository implementation based on the svn.fs API.
     """
 
-    def __init__(self, path, authz, log):
+    def __init__(self, path, authz, log, cached_roots=50, stats=None):
         self.path = path # might be needed by __del__()/close()
         self.log = log
+        self._release = None
         if core.SVN_VER_MAJOR < 1:
             raise TracError("Subversion >= 1.0 required: Found %d.%d.%d" % \
                             (core.SVN_VER_MAJOR,
@@ -304,6 +404,13 @@ class SubversionRepository(Repository):
         else:
             self.scope = '/'
         assert self.scope[0] == '/'
+
+        if stats is None:
+            stats = {'roots_opened': 0, 'root_hits': 0, 'pool_recycles': 0}
+        self.roots = RevisionRootCache(self.fs_ptr, self.pool, cached_roots,
+                                       stats)
+        self._request_pool = Pool(self.pool)
+        self._nodes = {}
         self.clear()
 
     def clear(self, youngest_rev=None):
@@ -313,12 +420,13 @@ class SubversionRepository(Repository):
         self.oldest = None
 
     def __del__(self):
+        self._release = None
         self.close()
 
     def has_node(self, path, rev, pool=None):
         if not pool:
-            pool = self.pool
-        rev_root = fs.revision_root(self.fs_ptr, rev, pool())
+            pool = self._request_pool
+        rev_root = self.roots.get(rev, pool)
         node_type = fs.check_path(rev_root, _to_svn(self.scope, path), pool())
         return node_type in _kindmap
 
@@ -337,13 +445,26 @@ class SubversionRepository(Repository):
         return rev
 
     def close(self):
+        release = self._release
+        if release:
+            # The connection is kept open for another request, but not what
+            # was allocated for this one
+            self._release = None
+            self._nodes = {}
+            self._request_pool.clear()
+            self.roots.recycle()
+            release(self)
+            return
         self.repos = None
         self.fs_ptr = None
+        self.roots = None
+        self._nodes = None
+        self._request_pool = None
         self.pool = None
 
     def get_changeset(self, rev):
         return SubversionChangeset(int(rev), self.authz, self.scope,
-                                   self.fs_ptr, self.pool)
+                                   self.fs_ptr, self.pool, self.roots)
 
     def get_node(self, path, rev=None):
         path = path or ''
@@ -353,12 +474,20 @@ class SubversionRepository(Repository):
 
         rev = self.normalize_rev(rev)
 
-        return SubversionNode(path, rev, self.authz, self.scope, self.fs_ptr,
-                              self.pool)
+        # Nodes are only shared within a request and for the same `authz`,
+        # which they use for their entries
+        key = (path, rev, self.authz)
+        node = self._nodes.get(key)
+        if node is None:
+            node = SubversionNode(path, rev, self.authz, self.scope,
+                                  self.fs_ptr, self.pool, self.roots)
+            if len(self._nodes) < MAX_CACHED_NODES:
+                self._nodes[key] = node
+        return node
 
     def _history(self, path, start, end, limit=None, pool=None):
         return _get_history(_to_svn(self.scope, path), self.authz, self.fs_ptr,
-                            pool or self.pool, start, end, limit)
+                            pool or self._request_pool, start, end, limit)
 
     def _previous_rev(self, rev, path='', pool=None):
         if rev > 1: # don't use oldest here, as it's too expensive
@@ -381,7 +510,8 @@ class SubversionRepository(Repository):
 
     def get_youngest_rev(self):
         if not self.youngest:
-            self.youngest = fs.youngest_rev(self.fs_ptr, self.pool())
+            self.youngest = fs.youngest_rev(self.fs_ptr,
+                                            self._request_pool())
             if self.scope != '/':
                 for path, rev in self._history('', 0, self.youngest, limit=1):
                     self.youngest = rev
@@ -482,8 +612,8 @@ class SubversionRepository(Repository):
         if new_node.isdir:
             editor = DiffChangeEditor()
             e_ptr, e_baton = delta.make_editor(editor, subpool())
-            old_root = fs.revision_root(self.fs_ptr, old_rev, subpool())
-            new_root = fs.revision_root(self.fs_ptr, new_rev, subpool())
+            old_root = self.roots.get(old_rev, subpool)
+            new_root = self.roots.get(new_rev, subpool)
             def authz_cb(root, path, pool): return 1
             text_deltas = 0 # as this is anyway re-done in Diff.py...
             entry_props = 0 # "... typically used only for working copy updates"
@@ -513,8 +643,8 @@ class SubversionRepository(Repository):
                                                   subpool())]
                 yield  (old_node, new_node, kind, change)
         else:
-            old_root = fs.revision_root(self.fs_ptr, old_rev, subpool())
-            new_root = fs.revision_root(self.fs_ptr, new_rev, subpool())
+            old_root = self.roots.get(old_rev, subpool)
+            new_root = self.roots.get(new_rev, subpool)
             if fs.contents_changed(old_root, _to_svn(self.scope, old_path),
                                    new_root, _to_svn(self.scope, new_path),
                                    subpool()):
@@ -523,15 +653,19 @@ class SubversionRepository(Repository):
 
 class SubversionNode(Node):
 
-    def __init__(self, path, rev, authz, scope, fs_ptr, pool=None):
+    def __init__(self, path, rev, authz, scope, fs_ptr, pool=None, roots=None):
         self.authz = authz
         self.scope = scope
         self._scoped_svn_path = _to_svn(scope, path)
         self.fs_ptr = fs_ptr
         self.pool = Pool(pool)
+        self.roots = roots
         self._requested_rev = rev
 
-        self.root = fs.revision_root(fs_ptr, rev, self.pool())
+        if roots:
+            self.root = roots.get(rev, self.pool)
+        else:
+            self.root = fs.revision_root(fs_ptr, rev, self.pool())
         node_type = fs.check_path(self.root, self._scoped_svn_path,
                                   self.pool())
         if not node_type in _kindmap:
@@ -574,7 +708,8 @@ class SubversionNode(Node):
             if not self.authz.has_permission(path):
                 continue
             yield SubversionNode(path, self._requested_rev, self.authz,
-                                 self.scope, self.fs_ptr, self.pool)
+                                 self.scope, self.fs_ptr, self.pool,
+                                 self.roots)
 
     def get_history(self,limit=None):
         newer = None # 'newer' is the previously seen history tuple
@@ -629,12 +764,13 @@ class SubversionNode(Node):
 
 class SubversionChangeset(Changeset):
 
-    def __init__(self, rev, authz, scope, fs_ptr, pool=None):
+    def __init__(self, rev, authz, scope, fs_ptr, pool=None, roots=None):
         self.rev = rev
         self.authz = authz
         self.scope = scope
         self.fs_ptr = fs_ptr
         self.pool = Pool(pool)
+        self.roots = roots
         message = self._get_prop(core.SVN_PROP_REVISION_LOG)
         author = self._get_prop(core.SVN_PROP_REVISION_AUTHOR)
         date = self._get_prop(core.SVN_PROP_REVISION_DATE)
@@ -647,7 +783,7 @@ class SubversionChangeset(Changeset):
     def get_changes(self):
         pool = Pool(self.pool)
         tmp = Pool(pool)
-        root = fs.revision_root(self.fs_ptr, self.rev, pool())
+        root = self._get_root(self.rev, pool)
         editor = repos.RevisionChangeCollector(self.fs_ptr, self.rev, pool())
         e_ptr, e_baton = delta.make_editor(editor, pool())
         repos.svn_repos_replay(root, e_ptr, e_baton, pool())
@@ -695,7 +831,7 @@ class SubversionChangeset(Changeset):
                 if revroots.has_key(base_rev):
                     b_root = revroots[base_rev]
                 else:
-                    b_root = fs.revision_root(self.fs_ptr, base_rev, pool())
+                    b_root = self._get_root(base_rev, pool)
                     revroots[base_rev] = b_root
                 tmp.clear()
                 cbase_path = fs.node_created_path(b_root, base_path, tmp())
@@ -728,6 +864,11 @@ class SubversionChangeset(Changeset):
     def _get_prop(self, name):
         return fs.revision_prop(self.fs_ptr, self.rev, name, self.pool())
 
+    def _get_root(self, rev, pool):
+        if self.roots:
+            return self.roots.get(rev, pool)
+        return fs.revision_root(self.fs_ptr, rev, pool())
+
 
 #
 # Delta editor for diffs between arbitrary nodes
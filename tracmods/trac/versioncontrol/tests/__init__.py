@@ -1,12 +1,15 @@
 import unittest
 
-from trac.versioncontrol.tests import cache, diff, svn_authz, svn_fs
+from trac.versioncontrol.tests import cache, diff, diffcache, diffengine, \
+                                    svn_authz, svn_fs
 
 def suite():
 
     suite = unittest.TestSuite()
     suite.addTest(cache.suite())
     suite.addTest(diff.suite())
+    suite.addTest(diffcache.suite())
+    suite.addTest(diffengine.suite())
     suite.addTest(svn_authz.suite())
     suite.addTest(svn_fs.suite())
     return suite
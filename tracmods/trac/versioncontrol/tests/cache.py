@@ -147,6 +147,122 @@ class CacheTestCase(unittest.TestCase):
                          changes.next())
         self.assertRaises(StopIteration, changes.next)
 
+    def _sync_history(self):
+        D, F = Node.DIRECTORY, Node.FILE
+        changes = {
+            1: [('trunk', D, Changeset.ADD, None, None),
+                ('trunk/README', F, Changeset.ADD, None, None)],
+            2: [('trunk/README', F, Changeset.EDIT, 'trunk/README', 1)],
+            3: [('branches', D, Changeset.ADD, None, None),
+                ('branches/b', D, Changeset.COPY, 'trunk', 2)],
+            4: [('branches/b/README', F, Changeset.EDIT,
+                 'branches/b/README', 3)],
+            5: [('trunk/README', F, Changeset.DELETE, 'trunk/README', 2)],
+            6: [('trunk/README', F, Changeset.ADD, None, None)],
+            7: [('trunk/README', F, Changeset.EDIT, 'trunk/README', 6)],
+            8: [('branches/b/NEWS', F, Changeset.MOVE, 'trunk/README', 7)]}
+        def get_changeset(rev):
+            rev = int(rev)
+            return Mock(Changeset, rev, 'r%d' % rev, 'joe', 42000 + rev,
+                        get_changes=lambda: iter(changes[rev]))
+        repos = Mock(Repository, 'test-repos', None, self.log,
+                     get_changeset=get_changeset,
+                     get_oldest_rev=lambda: 1,
+                     get_youngest_rev=lambda: 8,
+                     normalize_path=lambda path: path.strip('/') or '/',
+                     normalize_rev=lambda rev: rev and int(rev) or 8,
+                     next_rev=lambda rev: int(rev) < 8 and int(rev) + 1 \
+                                          or None)
+        return CachedRepository(self.db, repos, None, self.log)
+
+    def test_get_node_history(self):
+        cache = self._sync_history()
+        self.assertEqual([('branches/b/README', 4, Changeset.EDIT),
+                          ('branches/b/README', 3, Changeset.COPY),
+                          ('trunk/README', 2, Changeset.EDIT),
+                          ('trunk/README', 1, Changeset.ADD)],
+                         list(cache.get_node_history('/branches/b/README')))
+        self.assertEqual([('branches/b/README', 4, Changeset.EDIT),
+                          ('branches/b/README', 3, Changeset.ADD)],
+                         list(cache.get_node_history('branches/b/README',
+                                                     limit=2)))
+        self.assertEqual([('trunk/README', 7, Changeset.EDIT),
+                          ('trunk/README', 6, Changeset.ADD)],
+                         list(cache.get_node_history('trunk/README', 7)))
+        self.assertEqual([('branches/b/NEWS', 8, Changeset.COPY),
+                          ('trunk/README', 7, Changeset.EDIT),
+                          ('trunk/README', 6, Changeset.ADD)],
+                         list(cache.get_node_history('branches/b/NEWS')))
+        self.assertEqual([('trunk', 8, Changeset.EDIT),
+                          ('trunk', 7, Changeset.EDIT),
+                          ('trunk', 6, Changeset.EDIT),
+                          ('trunk', 5, Changeset.EDIT),
+                          ('trunk', 2, Changeset.EDIT),
+                          ('trunk', 1, Changeset.ADD)],
+                         list(cache.get_node_history('trunk')))
+        self.assertEqual([('/', 3, Changeset.EDIT),
+                          ('/', 2, Changeset.EDIT),
+                          ('/', 1, Changeset.ADD)],
+                         list(cache.get_node_history('/', 3)))
+
+    def test_get_path_history(self):
+        cache = self._sync_history()
+        self.assertEqual([('trunk/README', 8, Changeset.DELETE),
+                          ('trunk/README', 7, Changeset.EDIT),
+                          ('trunk/README', 6, Changeset.ADD),
+                          ('trunk/README', 5, Changeset.DELETE),
+                          ('trunk/README', 2, Changeset.EDIT),
+                          ('trunk/README', 1, Changeset.ADD)],
+                         list(cache.get_path_history('trunk/README')))
+        self.assertEqual([('branches/b/README', 4, Changeset.EDIT),
+                          ('branches/b/README', 3, Changeset.COPY),
+                          ('trunk/README', 2, 'unknown')],
+                         list(cache.get_path_history('branches/b/README')))
+
+    def test_get_listing(self):
+        cursor = self.db.cursor()
+        cursor.execute("INSERT INTO revision (rev,time,author,message) "
+                       "VALUES (1,42000,'joe','Import')")
+        cursor.execute("UPDATE system SET value='2' WHERE name='youngest_rev'")
+
+        entries = [Mock(Node, 'trunk/README', 1, Node.FILE,
+                        get_content_length=lambda: 42),
+                   Mock(Node, 'trunk/secret', 1, Node.FILE,
+                        get_content_length=lambda: 0),
+                   Mock(Node, 'trunk/src', 2, Node.DIRECTORY,
+                        get_content_length=lambda: None)]
+        nodes = []
+        def get_node(path, rev):
+            nodes.append((path, rev))
+            return Mock(Node, path, rev, Node.DIRECTORY,
+                        get_entries=lambda: iter(entries))
+        repos = Mock(Repository, 'test-repos', None, self.log,
+                     get_node=get_node,
+                     get_youngest_rev=lambda: 2,
+                     get_oldest_rev=lambda: 0,
+                     next_rev=lambda x: None,
+                     normalize_rev=lambda rev: int(rev))
+        cache = CachedRepository(self.db, repos, None, self.log)
+        cache.authz = Mock(has_permission=lambda path: path != 'trunk/secret')
+        node = cache.get_node('trunk', 2)
+        for i in range(2):
+            listing = list(cache.get_listing(node))
+            listing.sort(lambda a, b: cmp(a[0].name, b[0].name))
+            self.assertEqual(2, len(listing))
+            readme, changeset = listing[0]
+            self.assertEqual(('trunk/README', 1, Node.FILE, 42),
+                             (readme.path, readme.rev, readme.kind,
+                              readme.content_length))
+            self.assertEqual((1, 'joe', 'Import', 42000),
+                             (changeset.rev, changeset.author,
+                              changeset.message, changeset.date))
+            src, changeset = listing[1]
+            self.assertEqual(('trunk/src', 2, Node.DIRECTORY, None),
+                             (src.path, src.rev, src.kind, src.content_length))
+            self.assertEqual(None, changeset)
+        # The entries are read from the repository only once
+        self.assertEqual([('trunk', 2), ('trunk', 2)], nodes)
+
 
 def suite():
     return unittest.makeSuite(CacheTestCase, 'test')
@@ -99,6 +99,48 @@ class DiffTestCase(unittest.TestCase):
     def test_unified_diff_no_context(self):
         diff_lines = list(diff.unified_diff(['a'], ['b']))
         self.assertEqual(['@@ -1,1 +1,1 @@', '-a', '+b'], diff_lines)
+
+    def test_histogram_opcodes(self):
+        for fromlines, tolines in [
+                ([], []), (['A'], []), ([], ['A']),
+                (['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H'],
+                 ['A', 'B', 'C', 'd', 'e', 'f', 'G', 'H']),
+                (['B', 'C', 'D', 'E', 'F', 'G'],
+                 ['A', 'B', 'C', 'D', 'E', 'F', 'G'])]:
+            self.assertEqual(
+                list(diff._get_opcodes(fromlines, tolines)),
+                list(diff._get_opcodes(fromlines, tolines,
+                                       algorithm='histogram')))
+
+    def test_histogram_moved_block(self):
+        fromlines = ['}', 'def f():', 'x', '}', 'def g():', 'y', '}']
+        tolines = ['}', 'def g():', 'y', '}', 'def f():', 'x', '}']
+        opcodes = list(diff._get_opcodes(fromlines, tolines,
+                                         algorithm='histogram'))
+        self.assertEqual(('equal', 0, 1, 0, 1), opcodes[0])
+        self.assertEqual(('equal', 6, 7, 6, 7), opcodes[-1])
+        result = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            if tag == 'equal':
+                self.assertEqual(fromlines[i1:i2], tolines[j1:j2])
+            result += tolines[j1:j2]
+        self.assertEqual(tolines, result)
+
+    def test_histogram_ignore_space_changes(self):
+        opcodes = diff._get_opcodes(['A', 'B b'], ['A', 'B  b'],
+                                    ignore_space_changes=1,
+                                    algorithm='histogram')
+        self.assertEqual(('equal', 0, 2, 0, 2), opcodes.next())
+
+    def test_histogram_unified_diff(self):
+        diff_lines = list(diff.unified_diff(['a', 'b', 'c'], ['a', 'c', 'd'],
+                                            algorithm='histogram'))
+        self.assertEqual(['@@ -1,3 +1,3 @@', ' a', '-b', ' c', '+d'],
+                         diff_lines)
+
+    def test_unknown_algorithm(self):
+        diff_lines = list(diff.unified_diff(['a'], ['b'], algorithm='foo'))
+        self.assertEqual(['@@ -1,1 +1,1 @@', '-a', '+b'], diff_lines)
     
 
 def suite():
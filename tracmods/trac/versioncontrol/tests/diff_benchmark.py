@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2006 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+"""Compare the speed and output of the line-diff algorithms.
+
+Usage: python -m trac.versioncontrol.tests.diff_benchmark [OLD NEW]...
+
+Each pair of files given on the command line is compared with every
+algorithm returned by `get_diff_algorithms()`.  Without arguments, the
+Python modules of Trac are compared against edited copies of themselves,
+along with a large generated file.
+
+For each pair, the time spent in `hdf_diff` and the number of changed lines
+are reported; the edit script of every algorithm is also checked to turn the
+old lines into the new ones.
+"""
+
+import os
+import random
+import sys
+import time
+
+import trac
+from trac.versioncontrol import diff
+
+
+def edit(lines, rnd, changes=20):
+    """Return a copy of `lines` with some lines changed, removed, added
+    and moved around."""
+    lines = lines[:]
+    for i in range(changes):
+        if not lines:
+            break
+        pos = rnd.randrange(len(lines))
+        action = rnd.randrange(4)
+        if action == 0:
+            lines[pos] = lines[pos].replace('e', 'E')
+        elif action == 1:
+            del lines[pos:pos + rnd.randrange(1, 10)]
+        elif action == 2:
+            lines[pos:pos] = ['new line %d' % i] * rnd.randrange(1, 5)
+        else:
+            block = lines[pos:pos + rnd.randrange(1, 20)]
+            del lines[pos:pos + len(block)]
+            pos = rnd.randrange(len(lines) + 1)
+            lines[pos:pos] = block
+    return lines
+
+def generated_file(rnd, size=20000):
+    """Return the lines of a generated file full of repeated lines, which
+    are close to the worst case for `SequenceMatcher`."""
+    return ['    x[%d] = 0;' % rnd.randrange(size / 20)
+            for i in range(size)]
+
+def default_pairs():
+    rnd = random.Random(0)
+    root = os.path.dirname(trac.__file__)
+    for dirpath, dirnames, filenames in os.walk(root):
+        filenames.sort()
+        for filename in filenames:
+            if filename.endswith('.py'):
+                path = os.path.join(dirpath, filename)
+                lines = open(path).read().splitlines()
+                yield path[len(root) + 1:], lines, edit(lines, rnd)
+    lines = generated_file(rnd)
+    yield '<generated>', lines, edit(lines, rnd, 200)
+
+def file_pairs(args):
+    for i in range(0, len(args) - 1, 2):
+        yield '%s %s' % (args[i], args[i + 1]), \
+              open(args[i]).read().splitlines(), \
+              open(args[i + 1]).read().splitlines()
+
+def check(fromlines, tolines, algorithm):
+    """Return the number of changed lines, after checking that the opcodes
+    turn `fromlines` into `tolines`."""
+    result = []
+    changed = 0
+    for tag, i1, i2, j1, j2 in diff._get_opcodes(fromlines, tolines,
+                                                 algorithm=algorithm):
+        if tag == 'equal':
+            assert fromlines[i1:i2] == tolines[j1:j2]
+        else:
+            changed += (i2 - i1) + (j2 - j1)
+        result += tolines[j1:j2]
+    assert result == tolines
+    return changed
+
+def main(args):
+    algorithms = diff.get_diff_algorithms()
+    if args:
+        pairs = file_pairs(args)
+    else:
+        pairs = default_pairs()
+    totals = dict([(algorithm, 0.0) for algorithm in algorithms])
+    print '%-50s' % 'file' + ''.join(['%22s' % a for a in algorithms])
+    for name, fromlines, tolines in pairs:
+        row = []
+        for algorithm in algorithms:
+            start = time.time()
+            # hdf_diff() modifies the lines it's given
+            diff.hdf_diff(fromlines[:], tolines[:], context=3,
+                          algorithm=algorithm)
+            elapsed = time.time() - start
+            totals[algorithm] += elapsed
+            changed = check(fromlines, tolines, algorithm)
+            row.append('%10.3fs %6d lines' % (elapsed, changed))
+        print '%-50s' % name[-50:] + ''.join(['%22s' % r for r in row])
+    print '%-50s' % 'total' + ''.join(['%21.3fs' % totals[a]
+                                       for a in algorithms])
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
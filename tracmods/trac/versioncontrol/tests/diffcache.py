@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2006 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from trac.test import EnvironmentStub, Mock
+from trac.util.html import Markup
+from trac.versioncontrol.diffcache import DiffCache
+
+
+class DiffCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.path = tempfile.mkdtemp()
+        self.cache = DiffCache(self.env)
+        self.repos = Mock(name='svn:test')
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.env.path)
+
+    def _node(self, path, rev, content_type=None):
+        return Mock(path=path, rev=rev, content_type=content_type)
+
+    def _compute(self, value):
+        def compute():
+            self.calls += 1
+            return value
+        return compute
+
+    def test_cached_value(self):
+        key = self.cache.make_key(self.repos, self._node('trunk/a', 1),
+                                  self._node('trunk/a', 2), 'html', 3)
+        value = [[{'type': 'mod', 'base.lines': [Markup('<del>a</del>')]}]]
+        self.assertEqual(value, self.cache.get(key, self._compute(value)))
+        cached = self.cache.get(key, self._compute(None))
+        self.assertEqual(value, cached)
+        self.assertEqual(Markup, type(cached[0][0]['base.lines'][0]))
+        self.assertEqual(1, self.calls)
+
+    def test_none_is_cached(self):
+        key = self.cache.make_key(self.repos, None, self._node('trunk/a', 1))
+        self.assertEqual(None, self.cache.get(key, self._compute(None)))
+        self.assertEqual(None, self.cache.get(key, self._compute([])))
+        self.assertEqual(1, self.calls)
+
+    def test_keys(self):
+        old, new = self._node('trunk/a', 1), self._node('trunk/a', 2)
+        key = self.cache.make_key(self.repos, old, new, 'html', 3)
+        self.assertEqual(key, self.cache.make_key(self.repos, old, new,
+                                                  'html', 3))
+        self.assertNotEqual(key, self.cache.make_key(self.repos, old, new,
+                                                     'html', 5))
+        self.assertNotEqual(key, self.cache.make_key(self.repos, new, old,
+                                                     'html', 3))
+        self.assertNotEqual(key, self.cache.make_key(Mock(name='svn:other'),
+                                                     old, new, 'html', 3))
+
+    def test_charset_keys(self):
+        old, new = self._node('trunk/a', 1), self._node('trunk/a', 2)
+        key = self.cache.make_key(self.repos, old, new, 'html')
+        self.assertNotEqual(key, self.cache.make_key(
+            self.repos, old, self._node('trunk/a', 2,
+                                        'text/plain; charset=utf-8'), 'html'))
+        self.env.config.set('trac', 'default_charset', 'utf-8')
+        self.assertNotEqual(key, self.cache.make_key(self.repos, old, new,
+                                                     'html'))
+
+    def test_disabled(self):
+        self.env.config.set('changeset', 'diff_cache_size', 0)
+        key = self.cache.make_key(self.repos, None, None)
+        self.cache.get(key, self._compute([]))
+        self.cache.get(key, self._compute([]))
+        self.assertEqual(2, self.calls)
+        self.assertEqual([], os.listdir(self.env.path))
+
+    def test_eviction(self):
+        self.env.config.set('changeset', 'diff_cache_size', 3000)
+        keys = []
+        for i in range(10):
+            key = self.cache.make_key(self.repos, None, self._node('a', i))
+            self.cache.get(key, self._compute(os.urandom(500)))
+            keys.append(key)
+        total = sum([size for path, size, mtime in self.cache._get_files()])
+        self.assert_(total <= 3000, total)
+        # The most recent entry is still there
+        self.cache.get(keys[-1], self._compute(None))
+        self.assertEqual(10, self.calls)
+
+    def test_invalid_file(self):
+        key = self.cache.make_key(self.repos, None, None)
+        self.cache.get(key, self._compute([1]))
+        fileobj = open(self.cache._get_path(key), 'wb')
+        fileobj.write('garbage')
+        fileobj.close()
+        self.assertEqual([2], self.cache.get(key, self._compute([2])))
+        self.assertEqual([2], self.cache.get(key, self._compute([3])))
+
+    def test_clear(self):
+        key = self.cache.make_key(self.repos, None, None)
+        self.cache.get(key, self._compute([1]))
+        self.cache.clear()
+        self.assertEqual([2], self.cache.get(key, self._compute([2])))
+
+
+def suite():
+    return unittest.makeSuite(DiffCacheTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2006 Edgewall Software
+# All rights reserved.
+#
+# This software is licensed as described in the file COPYING, which
+# you should have received as part of this distribution. The terms
+# are also available at http://trac.edgewall.org/wiki/TracLicense.
+#
+# This software consists of voluntary contributions made by many
+# individuals. For the exact contribution history, see the revision
+# history and logs, available at http://trac.edgewall.org/log/.
+
+import shutil
+import tempfile
+import time
+import unittest
+
+from trac.test import EnvironmentStub
+from trac.versioncontrol import diffengine
+from trac.versioncontrol.diff import hdf_diff
+from trac.versioncontrol.diffcache import DiffCache
+from trac.versioncontrol.diffengine import DiffEngine
+
+
+class DiffEngineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.env.path = tempfile.mkdtemp()
+        self.engine = DiffEngine(self.env)
+        self.tasks = [('key%d' % i, (u'a\nb\nc\n', u'a\nB%d\nc\n' % i, 3, 8,
+                                     []))
+                      for i in range(3)]
+
+    def tearDown(self):
+        shutil.rmtree(self.env.path)
+
+    def _expected(self, i):
+        return hdf_diff([u'a', u'b', u'c'], [u'a', u'B%d' % i, u'c'], 3, 8)
+
+    def test_serial(self):
+        results = self.engine.hdf_diffs(self.tasks)
+        self.assertEqual(3, len(results))
+        for i in range(3):
+            self.assertEqual(self._expected(i), results['key%d' % i])
+            self.assertEqual(self._expected(i),
+                             DiffCache(self.env).load('key%d' % i))
+
+    def test_deadline(self):
+        results = self.engine.hdf_diffs(self.tasks, time.time() - 1)
+        self.assertEqual({}, results)
+        self.assertRaises(KeyError, DiffCache(self.env).load, 'key0')
+
+    def test_pool(self):
+        if not diffengine.multiprocessing:
+            return
+        self.env.config.set('changeset', 'diff_workers', 2)
+        results = self.engine.hdf_diffs(self.tasks, time.time() + 60)
+        self.assertEqual(3, len(results))
+        for i in range(3):
+            self.assertEqual(self._expected(i), results['key%d' % i])
+
+
+def suite():
+    return unittest.makeSuite(DiffEngineTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -30,9 +30,11 @@ except:
     has_svn = False
 
 from trac.log import logger_factory
-from trac.test import TestSetup
+from trac.test import EnvironmentStub, TestSetup
 from trac.core import TracError
-from trac.versioncontrol import Changeset, Node
+from trac.util import sorted
+from trac.versioncontrol import Authorizer, Changeset, Node
+from trac.versioncontrol.cache import CachedRepository
 from trac.versioncontrol.svn_fs import SubversionRepository
 
 REPOS_PATH = os.path.join(tempfile.gettempdir(), 'trac-svnrepos')
@@ -124,6 +126,43 @@ class SubversionRepositoryTestCase(unittest.TestCase):
         self.assertEqual(None, self.repos.previous_rev(17, u'trunk/R\xe9sum\xe9.txt'))
         self.assertEqual(17, self.repos.next_rev(16, u'trunk/R\xe9sum\xe9.txt'))
 
+    def test_revision_roots_reused(self):
+        stats = self.repos.roots.stats
+        node = self.repos.get_node('/trunk', 4)
+        opened = stats['roots_opened']
+        list(node.get_entries())
+        self.assertEqual(True, self.repos.has_node('/trunk/dir1', 4))
+        self.assertEqual(opened, stats['roots_opened'])
+        self.assert_(node is self.repos.get_node('/trunk/', 4))
+
+    def test_release_on_close(self):
+        released = []
+        self.repos._release = released.append
+        self.repos.get_node('/trunk', 4)
+        self.repos.close()
+        self.assertEqual([self.repos], released)
+        self.assertEqual({}, self.repos._nodes)
+        self.assertEqual('/trunk', self.repos.get_node('/trunk', 4).path)
+
+    def test_listing_cached_for_all_users(self):
+        class NoTagsAuthorizer(Authorizer):
+            def has_permission(self, path):
+                return 'tags' not in path
+        db = EnvironmentStub().get_db_cnx()
+        log = logger_factory('test')
+        self.repos.authz = NoTagsAuthorizer()
+        restricted = CachedRepository(db, self.repos, self.repos.authz, log)
+        root = restricted.get_node('/')
+        self.assertEqual(['branches', 'trunk'],
+                         sorted([entry.name for entry, changeset
+                                 in restricted.get_listing(root)]))
+        self.repos.authz = Authorizer()
+        unrestricted = CachedRepository(db, self.repos, None, log)
+        root = unrestricted.get_node('/')
+        self.assertEqual(['branches', 'tags', 'trunk'],
+                         sorted([entry.name for entry, changeset
+                                 in unrestricted.get_listing(root)]))
+
     def test_has_node(self):
         self.assertEqual(False, self.repos.has_node('/trunk/dir1', 3))
         self.assertEqual(True, self.repos.has_node('/trunk/dir1', 4))
@@ -147,14 +147,54 @@ class BrowserModule(Component):
         add_stylesheet(req, 'common/css/browser.css')
         return 'browser.cs', None
 
+    # Public API
+
+    def warm_preview_cache(self, repos, path, rev=None):
+        """Render the previews of the files below `path` in the given
+        revision, so that the ones kept in the preview cache are ready before
+        they are first browsed.
+
+        Only the files whose preferred renderer is `cacheable` are rendered,
+        and only the first page of their preview.  Generate the paths of the
+        rendered files.
+        """
+        mimeview = Mimeview(self.env)
+        nodes = [repos.get_node(path, rev)]
+        while nodes:
+            node = nodes.pop()
+            if node.isdir:
+                nodes += node.get_entries()
+                continue
+            chunk = node.get_content().read(CHUNK_SIZE)
+            if is_binary(chunk):
+                continue
+            mime_type = self._get_mime_type(mimeview, node, chunk)
+            renderers = mimeview.get_preview_renderers(mime_type)
+            if not renderers or not getattr(renderers[0], 'cacheable', False):
+                continue
+            mimeview.preview_to_hdf(None, node.get_content(),
+                                    node.content_length, mime_type,
+                                    node.created_path, annotations=['lineno'],
+                                    page_href=lambda offset: None)
+            yield node.path
+
     # Internal methods
 
+    def _get_mime_type(self, mimeview, node, chunk):
+        mime_type = node.content_type
+        if not mime_type or mime_type == 'application/octet-stream':
+            mime_type = mimeview.get_mimetype(node.name, chunk) or \
+                        mime_type or 'text/plain'
+        return mime_type
+
     def _render_directory(self, req, repos, node, rev=None):
         req.perm.assert_permission('BROWSER_VIEW')
 
         # Entries metadata
         info = []
-        for entry in node.get_entries():
+        changesets = {}
+        for entry, changeset in repos.get_listing(node):
+            changesets[entry.rev] = changeset
             info.append({
                 'name': entry.name,
                 'fullpath': entry.path,
@@ -165,7 +205,12 @@ class BrowserModule(Component):
                 'log_href': req.href.log(entry.path, rev=rev),
                 'browser_href': req.href.browser(entry.path, rev=rev)
             })
-        changes = get_changes(self.env, repos, [i['rev'] for i in info])
+        changes_info = get_changesets_info(self.env,
+                                           filter(None, changesets.values()))
+        changes = {}
+        for entry_rev, changeset in changesets.items():
+            changes[entry_rev] = changeset and changes_info[changeset.rev] \
+                                 or {}
 
         # Ordering of entries
         order = req.args.get('order', 'name').lower()
@@ -215,10 +260,7 @@ class BrowserModule(Component):
         # MIME type detection
         content = node.get_content()
         chunk = content.read(CHUNK_SIZE)
-        mime_type = node.content_type
-        if not mime_type or mime_type == 'application/octet-stream':
-            mime_type = mimeview.get_mimetype(node.name, chunk) or \
-                        mime_type or 'text/plain'
+        mime_type = self._get_mime_type(mimeview, node, chunk)
 
         # Eventually send the file directly
         format = req.args.get('format')
@@ -277,9 +319,17 @@ class BrowserModule(Component):
 
             del content # the remainder of that content is not needed
 
+            def page_href(offset):
+                return req.href.browser(node.path, rev=rev,
+                                        offset=offset or None)
+            try:
+                offset = int(req.args.get('offset') or 0)
+            except ValueError:
+                offset = 0
             req.hdf['file'] = mimeview.preview_to_hdf(
                 req, node.get_content(), node.get_content_length(), mime_type,
-                node.created_path, raw_href, annotations=['lineno'])
+                node.created_path, raw_href, annotations=['lineno'],
+                offset=offset, page_href=page_href)
 
             add_stylesheet(req, 'common/css/code.css')
 
@@ -296,7 +346,14 @@ class BrowserModule(Component):
     def _format_link(self, formatter, ns, path, label):
         path, rev, line = get_path_rev_line(path)
         fragment = ''
+        offset = None
         if line is not None:
             fragment = '#L%d' % line
+            # Link to a page of the preview starting at that line, as the
+            # pages are also limited in size (the whole file is shown anyway
+            # if it fits in a single page)
+            if line > 1 and Mimeview(self.env).max_preview_lines > 0:
+                offset = line - 1
         return html.A(label, class_='source',
-                      href=formatter.href.browser(path, rev=rev) + fragment)
+                      href=formatter.href.browser(path, rev=rev,
+                                                  offset=offset) + fragment)
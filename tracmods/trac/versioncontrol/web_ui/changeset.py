@@ -20,23 +20,27 @@
 
 import posixpath
 import re
-from StringIO import StringIO
+import threading
 import time
 
 from trac import util
-from trac.config import BoolOption, IntOption
+from trac.config import BoolOption, IntOption, Option
 from trac.core import *
 from trac.mimeview import Mimeview, is_binary
 from trac.perm import IPermissionRequestor
 from trac.Search import ISearchSource, search_to_sql, shorten_result
 from trac.Timeline import ITimelineEventProvider
+from trac.util import sorted
 from trac.util.datefmt import format_datetime, pretty_timedelta
 from trac.util.html import html, escape, unescape, Markup
 from trac.util.text import unicode_urlencode, shorten_line, CRLF
+from trac.util.zipstream import ZipStream
 from trac.versioncontrol import Changeset, Node, NoSuchChangeset
 from trac.versioncontrol.diff import get_diff_options, hdf_diff, unified_diff
+from trac.versioncontrol.diffcache import DiffCache
+from trac.versioncontrol.diffengine import DiffEngine
 from trac.versioncontrol.web_ui.util import render_node_property
-from trac.web import IRequestHandler
+from trac.web import HTTPServiceUnavailable, IRequestHandler
 from trac.web.chrome import INavigationContributor, add_link, add_stylesheet
 from trac.wiki import wiki_to_html, wiki_to_oneliner, IWikiSyntaxProvider, \
                       Formatter
@@ -85,6 +89,15 @@ class ChangesetModule(Component):
         plus their new size) for which the changeset view will attempt to show
         the diffs inlined (''since 0.10'').""")
 
+    diff_algorithm = Option('diff', 'algorithm', 'difflib',
+        """Algorithm used for computing the differences between lines of
+        text, either `difflib` (Python's `SequenceMatcher`) or `histogram`,
+        which is much faster on large files (''since 0.10'').""")
+
+    max_zip_downloads = IntOption('changeset', 'max_zip_downloads', 4,
+        """Maximum number of Zip archives generated at the same time by each
+        server process, `0` for no limit (''since 0.10'').""")
+
     wiki_format_messages = BoolOption('changeset', 'wiki_format_messages',
                                       'true',
         """Whether wiki formatting should be applied to changeset messages.
@@ -92,6 +105,12 @@ class ChangesetModule(Component):
         If this option is disabled, changeset messages will be rendered as
         pre-formatted text.""")
 
+    def __init__(self):
+        self._zip_semaphore = None
+        if self.max_zip_downloads > 0:
+            self._zip_semaphore = threading.BoundedSemaphore(
+                self.max_zip_downloads)
+
     # INavigationContributor methods
 
     def get_active_navigation_item(self, req):
@@ -435,50 +454,89 @@ class ChangesetModule(Component):
             new_size = new_node.get_content_length()
             return old_size + new_size
 
-        def _content_changes(old_node, new_node):
-            """Returns the list of differences.
+        context = 3
+        options = diff_options[1]
+        for option in options:
+            if option.startswith('-U'):
+                context = int(option[2:])
+                break
+        if context < 0:
+            context = None
+        tabwidth = self.config['diff'].getint('tab_width') or \
+                   self.config['mimeviewer'].getint('tab_width', 8)
+        diff_cache = DiffCache(self.env)
+        diff_engine = DiffEngine(self.env)
+
+        def _content_changes(changes):
+            """Returns a dictionary with the list of differences of each
+            modified file, by index.
 
             The list is empty when no differences between comparable files
-            are detected, but the return value is None for non-comparable files.
+            are detected, but the value is None for non-comparable files.
+            Files whose differences couldn't be computed before the deadline
+            are missing.
             """
-            old_content = old_node.get_content().read()
-            if is_binary(old_content):
-                return None
+            deadline = diff_engine.get_deadline()
+            diffs, keys, tasks = {}, {}, []
+            mview = Mimeview(self.env)
+            for idx, (old_node, new_node, kind, change) in enumerate(changes):
+                if change not in Changeset.DIFF_CHANGES or kind != Node.FILE:
+                    continue
+                key = diff_cache.make_key(repos, old_node, new_node, 'html',
+                                          context, tabwidth, sorted(options),
+                                          self.diff_algorithm)
+                try:
+                    diffs[idx] = diff_cache.load(key)
+                    continue
+                except KeyError:
+                    pass
+                if deadline and time.time() > deadline:
+                    continue
 
-            new_content = new_node.get_content().read()
-            if is_binary(new_content):
-                return None
+                old_content = old_node.get_content().read()
+                new_content = None
+                if not is_binary(old_content):
+                    new_content = new_node.get_content().read()
+                if new_content is None or is_binary(new_content):
+                    diffs[idx] = None
+                    diff_cache.store(key, None)
+                    continue
+                old_content = mview.to_unicode(old_content,
+                                               old_node.content_type)
+                new_content = mview.to_unicode(new_content,
+                                               new_node.content_type)
+                if old_content == new_content:
+                    diffs[idx] = []
+                    diff_cache.store(key, [])
+                    continue
+                keys[idx] = key
+                tasks.append((key, (old_content, new_content, context,
+                                    tabwidth, options, self.diff_algorithm)))
 
-            mview = Mimeview(self.env)
-            old_content = mview.to_unicode(old_content, old_node.content_type)
-            new_content = mview.to_unicode(new_content, new_node.content_type)
-
-            if old_content != new_content:
-                context = 3
-                options = diff_options[1]
-                for option in options:
-                    if option.startswith('-U'):
-                        context = int(option[2:])
-                        break
-                if context < 0:
-                    context = None
-                tabwidth = self.config['diff'].getint('tab_width') or \
-                           self.config['mimeviewer'].getint('tab_width', 8)
-                return hdf_diff(old_content.splitlines(),
-                                new_content.splitlines(),
-                                context, tabwidth,
-                                ignore_blank_lines='-B' in options,
-                                ignore_case='-i' in options,
-                                ignore_space_changes='-b' in options)
-            else:
-                return []
+            results = diff_engine.hdf_diffs(tasks, deadline)
+            for idx, key in keys.items():
+                if key in results:
+                    diffs[idx] = results[key]
+            return diffs
 
+        def _diff_href(old_node, new_node):
+            if chgset:
+                return req.href.changeset(new_node.rev, new_node.path)
+            else:
+                return req.href.changeset(new_node.created_rev,
+                                          new_node.created_path,
+                                          old=old_node.created_rev,
+                                          old_path=old_node.created_path)
+
+        # The changes are only retrieved once, for estimating the size of the
+        # differences and for rendering them
+        changes = list(get_changes())
         if req.perm.has_permission('FILE_VIEW'):
             diff_bytes = diff_files = 0
-            if self.max_diff_bytes or self.max_diff_files:
-                for old_node, new_node, kind, change in get_changes():
-                    if change in Changeset.DIFF_CHANGES and kind == Node.FILE:
-                        diff_files += 1
+            for old_node, new_node, kind, change in changes:
+                if change in Changeset.DIFF_CHANGES and kind == Node.FILE:
+                    diff_files += 1
+                    if self.max_diff_bytes:
                         diff_bytes += _estimate_changes(old_node, new_node)
             show_diffs = (not self.max_diff_files or \
                           diff_files <= self.max_diff_files) and \
@@ -488,9 +546,14 @@ class ChangesetModule(Component):
         else:
             show_diffs = False
 
-        idx = 0
-        for old_node, new_node, kind, change in get_changes():
+        if show_diffs:
+            all_diffs = _content_changes(changes)
+
+        for idx, (old_node, new_node, kind, change) in enumerate(changes):
             show_entry = change != Changeset.EDIT
+            diff_href = None
+            if change in Changeset.DIFF_CHANGES and not show_diffs:
+                diff_href = _diff_href(old_node, new_node)
             if change in Changeset.DIFF_CHANGES and \
                    req.perm.has_permission('FILE_VIEW'):
                 assert old_node and new_node
@@ -499,26 +562,22 @@ class ChangesetModule(Component):
                     req.hdf['changeset.changes.%d.props' % idx] = props
                     show_entry = True
                 if kind == Node.FILE and show_diffs:
-                    diffs = _content_changes(old_node, new_node)
-                    if diffs != []:
-                        if diffs:
-                            req.hdf['changeset.changes.%d.diff' % idx] = diffs
-                        # elif None (means: manually compare to (previous))
+                    if idx not in all_diffs: # not computed in time
+                        diff_href = _diff_href(old_node, new_node)
                         show_entry = True
+                    else:
+                        diffs = all_diffs[idx]
+                        if diffs != []:
+                            if diffs:
+                                req.hdf['changeset.changes.%d.diff' % idx] = \
+                                    diffs
+                            # elif None (means: manually compare to (previous))
+                            show_entry = True
             if show_entry or not show_diffs:
                 info = _change_info(old_node, new_node, change)
-                if change in Changeset.DIFF_CHANGES and not show_diffs:
-                    if chgset:
-                        diff_href = req.href.changeset(new_node.rev,
-                                                       new_node.path)
-                    else:
-                        diff_href = req.href.changeset(
-                            new_node.created_rev, new_node.created_path,
-                            old=old_node.created_rev,
-                            old_path=old_node.created_path)
+                if diff_href:
                     info['diff_href'] = diff_href
                 req.hdf['changeset.changes.%d' % idx] = info
-            idx += 1 # the sequence should be immutable
 
     def _render_diff(self, req, filename, repos, diff, diff_options):
         """Raw Unified Diff version"""
@@ -528,89 +587,103 @@ class ChangesetModule(Component):
                         'filename=%s.diff' % filename)
         req.end_headers()
 
-        mimeview = Mimeview(self.env)
-        for old_node, new_node, kind, change in repos.get_changes(**diff):
-            # TODO: Property changes
-
-            # Content changes
-            if kind == Node.DIRECTORY:
-                continue
+        context = 3
+        options = diff_options[1]
+        for option in options:
+            if option.startswith('-U'):
+                context = int(option[2:])
+                break
 
+        def _content_changes(old_node, new_node):
+            """Returns the lines of the unified diff, or None if the files
+            are identical or if one of them is binary."""
             new_content = old_content = ''
-            new_node_info = old_node_info = ('','')
             mimeview = Mimeview(self.env)
-
             if old_node:
                 old_content = old_node.get_content().read()
                 if is_binary(old_content):
-                    continue
-                old_node_info = (old_node.path, old_node.rev)
+                    return None
                 old_content = mimeview.to_unicode(old_content,
                                                   old_node.content_type)
             if new_node:
                 new_content = new_node.get_content().read()
                 if is_binary(new_content):
-                    continue
-                new_node_info = (new_node.path, new_node.rev)
-                new_path = new_node.path
+                    return None
                 new_content = mimeview.to_unicode(new_content,
                                                   new_node.content_type)
+            if old_content == new_content:
+                return None
+            return list(unified_diff(old_content.splitlines(),
+                                     new_content.splitlines(), context,
+                                     ignore_blank_lines='-B' in options,
+                                     ignore_case='-i' in options,
+                                     ignore_space_changes='-b' in options,
+                                     algorithm=self.diff_algorithm))
+
+        diff_cache = DiffCache(self.env)
+        for old_node, new_node, kind, change in repos.get_changes(**diff):
+            # TODO: Property changes
+
+            # Content changes
+            if kind == Node.DIRECTORY:
+                continue
+
+            new_node_info = old_node_info = ('','')
+            if old_node:
+                old_node_info = (old_node.path, old_node.rev)
+            if new_node:
+                new_node_info = (new_node.path, new_node.rev)
+                new_path = new_node.path
             else:
                 old_node_path = repos.normalize_path(old_node.path)
                 diff_old_path = repos.normalize_path(diff.old_path)
                 new_path = posixpath.join(diff.new_path,
                                           old_node_path[len(diff_old_path)+1:])
 
-            if old_content != new_content:
-                context = 3
-                options = diff_options[1]
-                for option in options:
-                    if option.startswith('-U'):
-                        context = int(option[2:])
-                        break
+            key = diff_cache.make_key(repos, old_node, new_node, 'unified',
+                                      context, sorted(options),
+                                      self.diff_algorithm)
+            lines = diff_cache.get(key, lambda: _content_changes(old_node,
+                                                                 new_node))
+            if lines is not None:
                 if not old_node_info[0]:
                     old_node_info = new_node_info # support for 'A'dd changes
-                req.write('Index: ' + new_path + CRLF)
-                req.write('=' * 67 + CRLF)
-                req.write('--- %s (revision %s)' % old_node_info + CRLF)
-                req.write('+++ %s (revision %s)' % new_node_info + CRLF)
-                for line in unified_diff(old_content.splitlines(),
-                                         new_content.splitlines(), context,
-                                         ignore_blank_lines='-B' in options,
-                                         ignore_case='-i' in options,
-                                         ignore_space_changes='-b' in options):
-                    req.write(line + CRLF)
+                hunk = ['Index: ' + new_path, '=' * 67,
+                        '--- %s (revision %s)' % old_node_info,
+                        '+++ %s (revision %s)' % new_node_info]
+                for line in lines:
+                    if line.startswith('@@ ') and len(hunk) > 4:
+                        req.write(CRLF.join(hunk) + CRLF)
+                        hunk = []
+                    hunk.append(line)
+                req.write(CRLF.join(hunk) + CRLF)
 
     def _render_zip(self, req, filename, repos, diff):
         """ZIP archive with all the added and/or modified files."""
-        new_rev = diff.new_rev
-        req.send_response(200)
-        req.send_header('Content-Type', 'application/zip')
-        req.send_header('Content-Disposition', 'attachment;'
-                        'filename=%s.zip' % filename)
-
-        from zipfile import ZipFile, ZipInfo, ZIP_DEFLATED
-
-        buf = StringIO()
-        zipfile = ZipFile(buf, 'w', ZIP_DEFLATED)
-        for old_node, new_node, kind, change in repos.get_changes(**diff):
-            if kind == Node.FILE and change != Changeset.DELETE:
-                assert new_node
-                zipinfo = ZipInfo()
-                zipinfo.filename = new_node.path.encode('utf-8')
-                # Note: unicode filenames are not supported by zipfile.
-                # UTF-8 is not supported by all Zip tools either,
-                # but as some does, I think UTF-8 is the best option here.
-                zipinfo.date_time = time.gmtime(new_node.last_modified)[:6]
-                zipinfo.compress_type = ZIP_DEFLATED
-                zipfile.writestr(zipinfo, new_node.get_content().read())
-        zipfile.close()
-
-        buf.seek(0, 2) # be sure to be at the end
-        req.send_header("Content-Length", buf.tell())
-        req.end_headers()
-
-        req.write(buf.getvalue())
+        semaphore = self._zip_semaphore
+        if semaphore and not semaphore.acquire(False):
+            raise HTTPServiceUnavailable('Too many Zip archives are being '
+                                         'downloaded, please try again later')
+        try:
+            req.send_response(200)
+            req.send_header('Content-Type', 'application/zip')
+            req.send_header('Content-Disposition', 'attachment;'
+                            'filename=%s.zip' % filename)
+            req.end_headers()
+
+            zipstream = ZipStream(req.write)
+            for old_node, new_node, kind, change in \
+                    repos.get_changes(**diff):
+                if kind == Node.FILE and change != Changeset.DELETE:
+                    assert new_node
+                    # Note: UTF-8 is not supported by all Zip tools,
+                    # but as some does, I think UTF-8 is the best option here.
+                    zipstream.add(new_node.path, new_node.get_content(),
+                                  time.gmtime(new_node.last_modified))
+            zipstream.close()
+        finally:
+            if semaphore:
+                semaphore.release()
 
     def title_for_diff(self, diff):
         if diff.new_path == diff.old_path: # ''diff between 2 revisions'' mode
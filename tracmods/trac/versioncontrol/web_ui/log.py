@@ -97,14 +97,17 @@ class LogModule(Component):
             add_link(req, 'up', path_links[-1]['href'], 'Parent directory')
 
         # The `history()` method depends on the mode:
-        #  * for ''stop on copy'' and ''follow copies'', it's `Node.history()` 
+        #  * for ''stop on copy'' and ''follow copies'', it's
+        #    `Repository.get_node_history()`
         #  * for ''show only add, delete'' it's`Repository.get_path_history()` 
         if mode == 'path_history':
             def history(limit):
                 for h in repos.get_path_history(path, rev, limit):
                     yield h
         else:
-            history = get_existing_node(req, repos, path, rev).get_history
+            get_existing_node(req, repos, path, rev)
+            def history(limit):
+                return repos.get_node_history(path, rev, limit)
 
         # -- retrieve history, asking for limit+1 results
         info = []
@@ -0,0 +1,51 @@
+import unittest
+
+from trac.test import EnvironmentStub, Mock
+from trac.versioncontrol.web_ui.browser import BrowserModule
+from trac.web.href import Href
+
+
+class BrowserModuleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.env = EnvironmentStub()
+        self.req = Mock(hdf={}, args={}, href=Href('/trac'),
+                        perm=Mock(assert_permission=lambda action: None))
+
+    def _entry(self, name, rev):
+        entry = Mock(name=name, path='trunk/' + name, isdir=False,
+                     content_length=10, rev=rev)
+        changeset = Mock(rev=rev, message='Change %d' % rev, author='joe',
+                         date=rev * 1000)
+        return entry, changeset
+
+    def test_order_href_keeps_rev(self):
+        repos = Mock(get_listing=lambda node: [self._entry('a', 2),
+                                               self._entry('b', 3)],
+                     youngest_rev=5)
+        node = Mock(path='trunk')
+        BrowserModule(self.env)._render_directory(self.req, repos, node, 5)
+        browser = self.req.hdf['browser']
+        for col in ('name', 'size', 'date'):
+            self.assert_('rev=5' in browser['order_href'][col],
+                         browser['order_href'][col])
+        self.assertEqual('Change 2', browser['changes'][2]['message'])
+
+    def test_line_link_offset(self):
+        formatter = Mock(href=Href('/trac'))
+        module = BrowserModule(self.env)
+        link = module._format_link(formatter, 'source', 'trunk/README@5#L1',
+                                   'README')
+        self.assertEqual('/trac/browser/trunk/README?rev=5#L1',
+                         link.attr['href'])
+        link = module._format_link(formatter, 'source',
+                                   'trunk/README@5#L7000', 'README')
+        self.assertEqual('/trac/browser/trunk/README?rev=5&offset=6999#L7000',
+                         link.attr['href'])
+
+
+def suite():
+    return unittest.makeSuite(BrowserModuleTestCase, 'test')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -187,9 +187,9 @@ source:/foo/bar@#L20
 <a class="source" href="/browser/foo%2520bar/baz%252Bquux?rev=42">source:/foo%2520bar/baz%252Bquux#42</a>
 <a class="source" href="/browser/?rev=42">source:#42</a>
 <a class="source" href="/browser/?rev=42">source:@42</a>
-<a class="source" href="/browser/foo/bar?rev=42#L20">source:/foo/bar@42#L20</a>
-<a class="source" href="/browser/foo/bar?rev=head#L20">source:/foo/bar@head#L20</a>
-<a class="source" href="/browser/foo/bar#L20">source:/foo/bar@#L20</a>
+<a class="source" href="/browser/foo/bar?rev=42&amp;offset=19#L20">source:/foo/bar@42#L20</a>
+<a class="source" href="/browser/foo/bar?rev=head&amp;offset=19#L20">source:/foo/bar@head#L20</a>
+<a class="source" href="/browser/foo/bar?offset=19#L20">source:/foo/bar@#L20</a>
 </p>
 ------------------------------
 ============================== source: provider, with quoting
@@ -26,20 +26,31 @@ from trac.util.text import shorten_line
 from trac.versioncontrol.api import NoSuchNode, NoSuchChangeset
 from trac.wiki import wiki_to_html, wiki_to_oneliner
 
-__all__ = ['get_changes', 'get_path_links', 'get_path_rev_line',
+__all__ = ['get_changes', 'get_changesets_info', 'get_path_links', 'get_path_rev_line',
            'get_existing_node', 'render_node_property']
 
 def get_changes(env, repos, revs, full=None, req=None, format=None):
-    db = env.get_db_cnx()
     changes = {}
+    changesets = {}
     for rev in revs:
+        if rev in changes or rev in changesets:
+            continue
         try:
-            changeset = repos.get_changeset(rev)
+            changesets[rev] = repos.get_changeset(rev)
         except NoSuchChangeset:
             changes[rev] = {}
-            continue
+    info = get_changesets_info(env, changesets.values(), full, req, format)
+    for rev, changeset in changesets.items():
+        changes[rev] = info[changeset.rev]
+    return changes
 
-        wiki_format = env.config['changeset'].getbool('wiki_format_messages')
+def get_changesets_info(env, changesets, full=None, req=None, format=None):
+    """Return the information displayed about each of the given changesets,
+    in a dictionary keyed by revision."""
+    db = env.get_db_cnx()
+    changes = {}
+    wiki_format = env.config['changeset'].getbool('wiki_format_messages')
+    for changeset in changesets:
         message = changeset.message or '--'
         absurls = (format == 'rss')
         if wiki_format:
@@ -62,7 +73,7 @@ def get_changes(env, repos, revs, full=None, req=None, format=None):
                 shortlog = shortlog.plaintext(keeplinebreaks=False)
             message = unicode(message)
 
-        changes[rev] = {
+        changes[changeset.rev] = {
             'date_seconds': changeset.date,
             'date': format_datetime(changeset.date),
             'age': pretty_timedelta(changeset.date),
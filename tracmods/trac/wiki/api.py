@@ -20,6 +20,7 @@ try:
     import threading
 except ImportError:
     import dummy_threading as threading
+import md5
 import time
 import urllib
 import re
@@ -129,6 +130,7 @@ class WikiSystem(Component):
         self._link_resolvers = None
         self._helper_patterns = None
         self._external_handlers = None
+        self._render_signature = None
 
     def _update_index(self):
         self._index_lock.acquire()
@@ -164,6 +166,28 @@ class WikiSystem(Component):
         self._update_index()
         return self._index.has_key(pagename.rstrip('/'))
 
+    def get_render_signature(self, req=None):
+        """Return a hash identifying the wiki rule set, the link resolvers and
+        the macros, and the base URLs of the links rendered for `req`.
+
+        It is part of the keys of the caches of rendered wiki text, so that
+        these renderings get updated when a plugin changes the wiki syntax.
+        """
+        if not self._render_signature:
+            macros = []
+            for provider in self.macro_providers:
+                macros.extend(provider.get_macros())
+            resolvers = self.link_resolvers.keys()
+            macros.sort()
+            resolvers.sort()
+            self._render_signature = '\n'.join([self.rules.pattern,
+                                                ' '.join(resolvers),
+                                                ' '.join(macros)])
+        hrefs = req or self.env
+        signature = '%s\n%s %s' % (self._render_signature, hrefs.href(),
+                                   hrefs.abs_href())
+        return md5.new(signature.encode('utf-8')).hexdigest()
+
     def _get_rules(self):
         self._prepare_rules()
         return self._compiled_rules
@@ -18,6 +18,7 @@
 #         Christopher Lenz <cmlenz@gmx.de>
 #         Christian Boos <cboos@neuf.fr>
 
+import md5
 import re
 import os
 import urllib
@@ -31,7 +32,8 @@ from trac.util.html import escape, Markup, Element, html
 from trac.util.text import shorten_line, to_unicode
 
 __all__ = ['wiki_to_html', 'wiki_to_oneliner', 'wiki_to_outline',
-           'wiki_to_link', 'Formatter' ]
+           'wiki_to_link', 'wiki_to_cacheable_html', 'get_dependencies_hash',
+           'Formatter']
 
 
 def system_message(msg, text=None):
@@ -989,6 +991,44 @@ class LinkFormatter(OutlineFormatter):
             return self.handle_match(match)
 
 
+class DependencyFormatter(Formatter):
+    """Formatter recording the parts of the text whose rendering depends on
+    the state of the environment, and not only on the text itself.
+
+    These `dependencies` are the links, including the shorthand ones provided
+    by `IWikiSyntaxProvider`s, and the macros: a link to a ticket changes when
+    the ticket gets closed, a link to a wiki page when the page gets created.
+    They are rendered again by `get_dependencies_hash()` to check whether a
+    cached rendering is still up to date.  The blocks processed by a macro or
+    by a MIME type renderer can't be checked that way: `cacheable` is set to
+    `False` when the text contains one.
+    """
+
+    def __init__(self, env, req=None, absurls=False, db=None):
+        Formatter.__init__(self, env, req, absurls, db)
+        self.dependencies = []
+        self.cacheable = True
+
+    def handle_match(self, fullmatch):
+        for itype, match in fullmatch.groupdict().items():
+            if match and not itype in self.wiki.helper_patterns:
+                if match[0] != '!' and \
+                        (itype in self.wiki.external_handlers or
+                         itype in ('shref', 'lhref') or itype == 'macro' and
+                         fullmatch.group('macroname').lower() != 'br'):
+                    self.dependencies.append(fullmatch.group(0))
+                break
+        return Formatter.handle_match(self, fullmatch)
+
+    def handle_code_block(self, line):
+        Formatter.handle_code_block(self, line)
+        processor = self.in_code_block and self.code_processor
+        if processor and processor.processor not in (
+                processor._default_processor, processor._comment_processor,
+                processor._html_processor):
+            self.cacheable = False
+
+
 # -- wiki_to_* helper functions
 
 def wiki_to_html(wikitext, env, req, db=None,
@@ -999,6 +1039,47 @@ def wiki_to_html(wikitext, env, req, db=None,
     Formatter(env, req, absurls, db).format(wikitext, out, escape_newlines)
     return Markup(out.getvalue())
 
+def wiki_to_cacheable_html(wikitext, env, req, db=None, absurls=False,
+                           escape_newlines=False):
+    """Same as `wiki_to_html()`, but return a `(html, dependencies)` tuple.
+
+    `dependencies` is the list of the parts of the text whose rendering can
+    change without the text changing, as found by `DependencyFormatter`, or
+    `None` if the rendering mustn't be cached.
+    """
+    if not wikitext:
+        return Markup(), []
+    out = StringIO()
+    formatter = DependencyFormatter(env, req, absurls, db)
+    formatter.format(wikitext, out, escape_newlines)
+    dependencies = None
+    if formatter.cacheable:
+        dependencies = formatter.dependencies
+    return Markup(out.getvalue()), dependencies
+
+def get_dependencies_hash(env, req, dependencies, db=None, absurls=False,
+                          rendered=None):
+    """Return a hash of the current rendering of the `dependencies` returned
+    by `wiki_to_cacheable_html()`.
+
+    If given, `rendered` is a dictionary keeping the renderings of the
+    dependencies, with the same `absurls`, so that the links shared by
+    several texts are only rendered once.
+    """
+    if rendered is None:
+        rendered = {}
+    formatter = None
+    digest = md5.new()
+    for dependency in dependencies:
+        if dependency not in rendered:
+            if not formatter:
+                formatter = Formatter(env, req, absurls, db)
+                formatter.reset()
+            rendered[dependency] = re.sub(formatter.wiki.rules,
+                                          formatter.replace, dependency)
+        digest.update(rendered[dependency].encode('utf-8') + '\n')
+    return digest.hexdigest()
+
 def wiki_to_oneliner(wikitext, env, db=None, shorten=False, absurls=False):
     if not wikitext:
         return Markup()
@@ -344,7 +344,8 @@ class WikiModule(Component):
         changes = hdf_diff(oldtext, newtext, context=context,
                            ignore_blank_lines='-B' in diff_options,
                            ignore_case='-i' in diff_options,
-                           ignore_space_changes='-b' in diff_options)
+                           ignore_space_changes='-b' in diff_options,
+                           algorithm=self.config.get('diff', 'algorithm'))
         req.hdf['wiki.diff'] = changes
 
     def _render_editor(self, req, db, page, preview=False):